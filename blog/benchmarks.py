@@ -0,0 +1,320 @@
+"""
+End-to-end benchmarks of the blog views.
+
+A deterministic corpus of posts is seeded into fresh testbed stubs, then
+every scenario is run through the Django test client (so through all the
+middleware) a number of times. For every scenario the report has latency
+percentiles, RPCs (see rpcstats) and response size.
+
+Results can be saved as a baseline and later runs compared against it,
+see the `benchmark` management command. Latency of the stubs says little
+about production, RPC counts and estimated operations are the stable part.
+"""
+import datetime
+import json
+import os
+import random
+import time
+
+from django.test.client import Client
+from google.appengine.api import memcache
+from google.appengine.datastore import datastore_stub_util
+from google.appengine.ext import ndb, testbed
+
+from appengine_sessions.models import Session
+from blog.bulk import import_posts
+from lib import rpcstats
+from lib.ndbtestcase import run_deferred_tasks
+
+CORPORA = {
+    "10": 10,
+    "1k": 1000,
+    "50k": 50000,
+}
+
+EXPIRED_SESSIONS = 100
+
+WORDS = (
+    "python django engine datastore memcache query cursor index entity "
+    "transaction template cache request response model view test deploy "
+    "instance latency batch shard counter session feed sitemap markdown"
+).split()
+
+TAGS = ["python", "django", "appengine", "ndb", "performance", "testing"]
+
+START_DATE = datetime.datetime(2012, 1, 1)
+
+
+def corpus_records(count, seed=0):
+    """
+    JSON lines of `count` posts, the same for the same seed
+    """
+    rand = random.Random(seed)
+    for number in range(1, count + 1):
+        words = [rand.choice(WORDS) for _ in range(rand.randint(50, 500))]
+        yield json.dumps({
+            "id": number,
+            "title": u"Benchmark post {}".format(number),
+            "body": u" ".join(words),
+            "author": u"Benchmark",
+            "tags": rand.sample(TAGS, rand.randint(0, 3)),
+            "created_at": (
+                START_DATE + datetime.timedelta(hours=number)
+            ).strftime("%Y-%m-%dT%H:%M:%S.%f"),
+        }) + "\n"
+
+
+class Environment(object):
+    """
+    Testbed stubs with a seeded corpus
+    """
+
+    def __init__(self, corpus):
+        self.corpus = corpus
+        self.size = CORPORA[corpus]
+
+    def __enter__(self):
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.testbed.init_datastore_v3_stub(
+            consistency_policy=datastore_stub_util.PseudoRandomHRConsistencyPolicy(probability=1))
+        self.testbed.init_memcache_stub()
+        self.testbed.init_taskqueue_stub()
+        self.testbed.init_user_stub()
+        self.taskqueue = self.testbed.get_stub(testbed.TASKQUEUE_SERVICE_NAME)
+        rpcstats.install()
+
+        import_posts(corpus_records(self.size), "benchmark", progress=_SilentProgress())
+        # Search indexing isn't benchmarked
+        self.taskqueue.FlushQueue("default")
+
+        self.client = Client()
+        self.logout()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.testbed.deactivate()
+
+    def login_admin(self):
+        self.testbed.setup_env(
+            USER_EMAIL="owner@localhost", USER_ID="1", USER_IS_ADMIN="1",
+            AUTH_DOMAIN="testbed", overwrite=True)
+
+    def logout(self):
+        self.testbed.setup_env(
+            USER_EMAIL="", USER_ID="", USER_IS_ADMIN="0",
+            AUTH_DOMAIN="testbed", overwrite=True)
+
+    def post_url(self, iteration):
+        # Spread over the corpus, the same posts in every run
+        return "/blog/post/benchmark-post-{}/".format(
+            iteration * 7919 % self.size + 1)
+
+
+class _SilentProgress(object):
+
+    def add(self, rows):
+        pass
+
+    def done(self):
+        pass
+
+
+class Scenario(object):
+    """
+    `run` is measured, `setup` (run before every iteration) is not
+    """
+    name = None
+    cold = False
+
+    def setup(self, env, iteration):
+        env.logout()
+        # Tasks left by earlier iterations (e.g. indexing of updated posts)
+        env.taskqueue.FlushQueue("default")
+        ndb.get_context().clear_cache()
+        if self.cold:
+            memcache.flush_all()
+
+    def run(self, env, iteration):
+        raise NotImplementedError()
+
+
+class GetScenario(Scenario):
+
+    def __init__(self, name, path, cold=False):
+        self.name = name
+        self.path = path
+        self.cold = cold
+
+    def run(self, env, iteration):
+        return env.client.get(self.path)
+
+
+class PostViewScenario(Scenario):
+
+    def __init__(self, name, cold=False):
+        self.name = name
+        self.cold = cold
+
+    def run(self, env, iteration):
+        return env.client.get(env.post_url(iteration))
+
+
+class PostUpdateScenario(Scenario):
+    name = "post update"
+
+    def setup(self, env, iteration):
+        super(PostUpdateScenario, self).setup(env, iteration)
+        env.login_admin()
+
+    def run(self, env, iteration):
+        url = env.post_url(iteration)
+        number = url.rstrip("/").rsplit("-", 1)[1]
+        return env.client.post(url, {
+            "title": u"Benchmark post {}".format(number),
+            "body": u"Updated in iteration {}".format(iteration),
+            "tags": u"python, benchmark",
+        })
+
+
+class SessionCleanupScenario(Scenario):
+    name = "session cleanup"
+
+    def setup(self, env, iteration):
+        super(SessionCleanupScenario, self).setup(env, iteration)
+        expire_date = datetime.datetime.utcnow() - datetime.timedelta(days=1)
+        ndb.put_multi([
+            Session(id="benchmark-{}-{}".format(iteration, i),
+                    session_key="benchmark-{}-{}".format(iteration, i),
+                    expire_date=expire_date)
+            for i in range(EXPIRED_SESSIONS)
+        ])
+
+    def run(self, env, iteration):
+        env.login_admin()
+        response = env.client.get("/appengine_sessions/clean-up/")
+        run_deferred_tasks(env.taskqueue)
+        return response
+
+
+SCENARIOS = [
+    GetScenario("home", "/"),
+    GetScenario("home (cold)", "/", cold=True),
+    GetScenario("post list", "/blog/"),
+    GetScenario("post list (cold)", "/blog/", cold=True),
+    PostViewScenario("post view"),
+    PostViewScenario("post view (cold)", cold=True),
+    PostUpdateScenario(),
+    SessionCleanupScenario(),
+]
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    index = min(int(round(fraction * (len(values) - 1))), len(values) - 1)
+    return values[index]
+
+
+def run_scenario(env, scenario, iterations):
+    latencies, sizes = [], []
+    calls, ops = {}, {}
+
+    for iteration in range(iterations):
+        scenario.setup(env, iteration)
+
+        with rpcstats.recording() as stats:
+            start = time.time()
+            response = scenario.run(env, iteration)
+            latencies.append((time.time() - start) * 1000)
+
+        if response.status_code >= 400:
+            raise AssertionError("{} failed with status {}".format(
+                scenario.name, response.status_code))
+
+        sizes.append(len(response.content))
+        for service, count in stats.by_service().iteritems():
+            calls[service] = calls.get(service, 0) + count
+        for name, count in stats.ops.iteritems():
+            ops[name] = ops.get(name, 0) + count
+
+    return {
+        "p50": percentile(latencies, 0.5),
+        "p90": percentile(latencies, 0.9),
+        "p99": percentile(latencies, 0.99),
+        "calls": dict((k, float(v) / iterations) for k, v in calls.iteritems()),
+        "ops": dict((k, float(v) / iterations) for k, v in ops.iteritems()),
+        "bytes": float(sum(sizes)) / iterations,
+    }
+
+
+def run(corpus, iterations, names=None):
+    """
+    Results of the scenarios (all, or only the named ones) by their names
+    """
+    scenarios = [s for s in SCENARIOS if not names or s.name in names]
+    with Environment(corpus) as env:
+        return dict(
+            (scenario.name, run_scenario(env, scenario, iterations))
+            for scenario in scenarios)
+
+
+def compare(results, baseline, latency_threshold=1.5, rpc_threshold=0.0,
+            size_threshold=1.1):
+    """
+    List of regressions of the results against the baseline: p50 latency
+    more than `latency_threshold` times, RPCs or estimated operations more
+    than `rpc_threshold` (a fraction) or responses more than
+    `size_threshold` times the baseline.
+    """
+    failures = []
+    for name, result in sorted(results.iteritems()):
+        base = baseline.get(name)
+        if base is None:
+            continue
+
+        if result["p50"] > base["p50"] * latency_threshold:
+            failures.append("{}: p50 {:.1f}ms, baseline {:.1f}ms".format(
+                name, result["p50"], base["p50"]))
+
+        for kind in ("calls", "ops"):
+            for key, value in sorted(result[kind].iteritems()):
+                allowed = base[kind].get(key, 0) * (1 + rpc_threshold)
+                if value > allowed + 1e-9:
+                    failures.append("{}: {} {} {:.1f}, baseline {:.1f}".format(
+                        name, kind, key, value, base[kind].get(key, 0)))
+
+        if result["bytes"] > base["bytes"] * size_threshold:
+            failures.append("{}: {:.0f} bytes, baseline {:.0f}".format(
+                name, result["bytes"], base["bytes"]))
+
+    return failures
+
+
+def format_results(results):
+    lines = ["{:<20} {:>8} {:>8} {:>8} {:>10} {:>10} {:>12} {:>10}".format(
+        "scenario", "p50 ms", "p90 ms", "p99 ms", "datastore", "memcache",
+        "reads/writes", "bytes")]
+    for name, result in sorted(results.iteritems()):
+        lines.append(
+            "{:<20} {:>8.1f} {:>8.1f} {:>8.1f} {:>10.1f} {:>10.1f} {:>12} {:>10.0f}".format(
+                name, result["p50"], result["p90"], result["p99"],
+                result["calls"].get("datastore_v3", 0),
+                result["calls"].get("memcache", 0),
+                "{:.0f}/{:.0f}".format(
+                    result["ops"].get("reads", 0), result["ops"].get("writes", 0)),
+                result["bytes"]))
+    return "\n".join(lines)
+
+
+def load_baseline(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_baseline(path, corpus, results):
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    with open(path, "w") as f:
+        json.dump({"corpus": corpus, "scenarios": results}, f, indent=2, sort_keys=True)
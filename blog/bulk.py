@@ -0,0 +1,230 @@
+"""
+Export of posts to JSON lines, and import back.
+
+Both stream: export reads cursor-paged batches of posts with the context
+cache off, import reads the input line by line and writes a batch at a
+time, so memory doesn't grow with the number of posts.
+
+Import writes all entities a post has (summary, slug index, tags, archive,
+search index) in batches instead of a transaction per post. Its progress is
+checkpointed in the transaction writing a batch, so an interrupted import
+resumes after the last written batch.
+"""
+import datetime
+import json
+import logging
+import time
+
+from google.appengine.ext import deferred, ndb
+
+from blog.cache import bump_generation
+from blog.markup import render
+from blog.models import (
+    ImportCheckpoint, Post, PostArchive, PostCollection, PostSlug, PostSummary,
+    normalize_tags, update_tags_multi
+)
+from blog.search import index_posts
+
+EXPORT_BATCH_SIZE = 200
+
+# Posts are written in a single cross-group transaction together with the
+# archive, tags, collection and checkpoint (25 entity groups at most)
+MAX_IMPORT_BATCH_SIZE = 20
+
+DATE_FORMAT = "%Y-%m-%dT%H:%M:%S.%f"
+
+
+class Progress(object):
+    """
+    Counts rows, reported with their rate to `report` (a callable taking
+    a line of text) every `every` rows
+    """
+
+    def __init__(self, report=None, every=1000):
+        self.report = report or logging.info
+        self.every = every
+        self.rows = 0
+        self.start = time.time()
+
+    @property
+    def rate(self):
+        elapsed = time.time() - self.start
+        return self.rows / elapsed if elapsed else 0.0
+
+    def add(self, rows):
+        before = self.rows
+        self.rows += rows
+        if self.rows // self.every != before // self.every:
+            self.report("{} rows, {:.1f} rows/s".format(self.rows, self.rate))
+
+    def done(self):
+        self.report("Done, {} rows in {:.1f}s, {:.1f} rows/s".format(
+            self.rows, time.time() - self.start, self.rate))
+
+
+def post_to_record(post):
+    return {
+        "id": post.key.id(),
+        "title": post.title,
+        "body": post.body,
+        "author": post.author,
+        "tags": post.tags,
+        "created_at": post.created_at.strftime(DATE_FORMAT),
+    }
+
+
+def post_from_record(record):
+    return Post(
+        id=record["id"],
+        title=record["title"],
+        body=record.get("body"),
+        author=record.get("author"),
+        tags=normalize_tags(record.get("tags")),
+        created_at=datetime.datetime.strptime(record["created_at"], DATE_FORMAT),
+    )
+
+
+def iter_posts(batch_size=EXPORT_BATCH_SIZE):
+    """
+    All posts in order of their keys, fetched a page at a time
+    """
+    query = Post.query().order(Post.key)
+    cursor, more = None, True
+    while more:
+        posts, cursor, more = query.fetch_page(
+            batch_size, start_cursor=cursor,
+            use_cache=False, use_memcache=False)
+        for post in posts:
+            yield post
+
+
+def export_posts(out, batch_size=EXPORT_BATCH_SIZE, progress=None):
+    """
+    Write all posts to the file as JSON lines
+    """
+    progress = progress or Progress()
+    for post in iter_posts(batch_size):
+        out.write(json.dumps(post_to_record(post)) + "\n")
+        progress.add(1)
+
+    progress.done()
+    return progress.rows
+
+
+def import_batch(posts, checkpoint, line, defer_indexing=True):
+    """
+    Write the posts with everything derived from them, and the checkpoint
+    at `line`. Returns the number of skipped posts (their slug belongs to
+    other posts).
+
+    Posts are added to the search index by a task enqueued with the batch,
+    or right after it without `defer_indexing`.
+    """
+    previous_posts = ndb.get_multi([post.key for post in posts])
+    # Keys can't have empty ids, posts without a slug are skipped below
+    with_slug = [post.slug for post in posts if post.slug]
+    indexes = dict(zip(with_slug, ndb.get_multi(
+        [ndb.Key(PostSlug, slug) for slug in with_slug])))
+
+    accepted, slugs = [], set()
+    for post, previous in zip(posts, previous_posts):
+        index = indexes.get(post.slug)
+        taken = index is not None and index.post != post.key
+        if not post.slug or post.slug in slugs or taken:
+            logging.warning(
+                'Post %s skipped, slug "%s" is empty or taken', post.key.id(), post.slug)
+            continue
+
+        slugs.add(post.slug)
+        post.updated_at = datetime.datetime.utcnow()
+        post.version = previous.version + 1 if previous else 1
+        post.body_html, post.renderer_version = render(post.body)
+        accepted.append((post, previous))
+
+    # Derived from the posts only, written again if the batch is retried
+    ndb.put_multi(
+        [PostSummary.from_post(post) for post, _ in accepted] +
+        [PostSlug(id=post.slug, post=post.key, version=post.version,
+                  updated_at=post.updated_at)
+         for post, _ in accepted])
+    ndb.delete_multi([
+        ndb.Key(PostSlug, previous.slug) for post, previous in accepted
+        if previous and previous.slug and previous.slug != post.slug
+    ])
+
+    imported = checkpoint.imported + len(accepted)
+    skipped = checkpoint.skipped + len(posts) - len(accepted)
+
+    def txn():
+        archive = PostArchive.get_current()
+        for post, previous in accepted:
+            if previous:
+                archive.add(previous.created_at, -1)
+            archive.add(post.created_at)
+
+        update_tags_multi([
+            (post.key.id(), post.created_at,
+             previous.tags if previous else [], post.tags)
+            for post, previous in accepted
+        ])
+
+        # Post.put would render and index every post again, so this is a
+        # plain put of all of them
+        ndb.put_multi([post for post, _ in accepted] + [archive])
+        PostCollection.touch(
+            max(post.updated_at for post, _ in accepted) if accepted else None)
+
+        checkpoint.populate(line=line, imported=imported, skipped=skipped)
+        checkpoint.put()
+
+        if defer_indexing:
+            deferred.defer(index_posts, post_ids, _transactional=True)
+
+    post_ids = [post.key.id() for post, _ in accepted]
+    ndb.transaction(txn, xg=True)
+    if not defer_indexing:
+        index_posts(post_ids)
+
+    return len(posts) - len(accepted)
+
+
+def import_posts(lines, name, batch_size=MAX_IMPORT_BATCH_SIZE, restart=False,
+                 progress=None, defer_indexing=True):
+    """
+    Import posts from JSON lines, resuming the import of the same name
+    unless `restart`. Returns the checkpoint of the import.
+    """
+    batch_size = min(batch_size, MAX_IMPORT_BATCH_SIZE)
+    progress = progress or Progress()
+
+    checkpoint = ImportCheckpoint.get_by_id(name)
+    if checkpoint is None or restart:
+        checkpoint = ImportCheckpoint(id=name)
+    elif checkpoint.line:
+        logging.info("Resuming import %s after line %d", name, checkpoint.line)
+
+    context = ndb.get_context()
+    cache_policy = context.get_cache_policy()
+    context.set_cache_policy(False)
+    try:
+        batch = []
+        number = 0
+        for number, line in enumerate(lines, 1):
+            if number <= checkpoint.line or not line.strip():
+                continue
+
+            batch.append(post_from_record(json.loads(line)))
+            if len(batch) >= batch_size:
+                import_batch(batch, checkpoint, number, defer_indexing)
+                progress.add(len(batch))
+                batch = []
+
+        if batch:
+            import_batch(batch, checkpoint, number, defer_indexing)
+            progress.add(len(batch))
+    finally:
+        context.set_cache_policy(cache_policy)
+
+    bump_generation()
+    progress.done()
+    return checkpoint
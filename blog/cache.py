@@ -0,0 +1,192 @@
+"""
+Caching of rendered pages for anonymous users.
+
+Pages are stored in memcache under the request path and a content
+generation number. Any change of the content bumps the generation, so all
+pages cached before the change are never read again and expire on their own.
+
+Conditional requests (ETag / Last-Modified) are answered with 304 before
+the page is looked up or rendered at all.
+
+Public pages are also marked as cacheable by browsers and Google's edge
+cache, see blog.middleware.CachePolicyMiddleware.
+
+Pages listing posts are read by eventually consistent queries, which may
+miss a write for a while. Views set `page_complete` to False for such a
+page (see PostCollection.is_complete), it's served but neither cached nor
+given an ETag or Last-Modified, clients would keep it for the new version.
+"""
+import hashlib
+import os
+import time
+
+from django.conf import settings
+from django.http import HttpResponse
+from django.views.decorators.http import condition
+from google.appengine.api import memcache, users
+
+GENERATION_KEY = "blog.cache.generation"
+PAGE_KEY_PREFIX = "blog.cache.page:"
+
+
+def _initial_generation():
+    # Time based, so a generation lost from memcache is never reused
+    return int(time.time() * 1000)
+
+
+def get_generation():
+    generation = memcache.get(GENERATION_KEY)
+    if generation is None:
+        memcache.add(GENERATION_KEY, _initial_generation())
+        generation = memcache.get(GENERATION_KEY)
+
+    return generation
+
+
+def bump_generation():
+    """
+    Invalidate all cached pages
+    """
+    return memcache.incr(GENERATION_KEY, initial_value=_initial_generation())
+
+
+def make_etag(*parts):
+    """
+    ETag made of given parts and version of the application, so a new
+    deployment (with possibly new templates) changes all ETags
+    """
+    parts = (os.environ.get("CURRENT_VERSION_ID", ""),) + parts
+    return "-".join(str(part) for part in parts)
+
+
+def page_cache_key(path, generation=None, parts=()):
+    """
+    Key of the page at the path, `parts` are anything else the page
+    depends on
+    """
+    if generation is None:
+        generation = get_generation()
+
+    page = u"-".join([path] + [unicode(part) for part in parts])
+    path_hash = hashlib.md5(page.encode("utf-8")).hexdigest()
+    return "{}{}:{}".format(PAGE_KEY_PREFIX, generation, path_hash)
+
+
+class CachedPageMixin(object):
+    """
+    Serve GET requests of anonymous users from memcache.
+
+    Logged in users (admins included) always get a freshly rendered page,
+    so their private controls never end up in the cache.
+    """
+    page_cache_timeout = None
+    # Set by the view to False when the page may miss the last write
+    page_complete = True
+
+    def get_page_cache_timeout(self):
+        if self.page_cache_timeout is None:
+            return settings.PAGE_CACHE_TIMEOUT
+
+        return self.page_cache_timeout
+
+    def get_page_cache_parts(self, request, *args, **kwargs):
+        """
+        What the page depends on besides its path and the content
+        generation, e.g. counters changing more often than the content
+        """
+        return ()
+
+    def dispatch(self, request, *args, **kwargs):
+        parent = super(CachedPageMixin, self)
+        if request.method != "GET" or users.get_current_user():
+            return parent.dispatch(request, *args, **kwargs)
+
+        key = page_cache_key(
+            request.get_full_path(),
+            parts=self.get_page_cache_parts(request, *args, **kwargs))
+        cached = memcache.get(key)
+        if cached is not None:
+            content, content_type = cached
+            return HttpResponse(content, content_type=content_type)
+
+        response = parent.dispatch(request, *args, **kwargs)
+        if response.status_code != 200:
+            return response
+
+        def store(response):
+            if not self.page_complete:
+                return
+
+            if len(response.content) >= memcache.MAX_VALUE_SIZE:
+                return
+
+            memcache.set(
+                key, (response.content, response["Content-Type"]),
+                time=self.get_page_cache_timeout())
+
+        if getattr(response, "is_rendered", True):
+            store(response)
+        else:
+            response.add_post_render_callback(store)
+
+        return response
+
+
+class ConditionalPageMixin(object):
+    """
+    Answer conditional GET requests of anonymous users.
+
+    Views provide `get_etag` and/or `get_last_modified`, both called with the
+    same arguments as the view, and both should be cheap to compute.
+    """
+
+    def get_etag(self, request, *args, **kwargs):
+        return None
+
+    def get_last_modified(self, request, *args, **kwargs):
+        return None
+
+    def dispatch(self, request, *args, **kwargs):
+        parent = super(ConditionalPageMixin, self).dispatch
+        if request.method not in ("GET", "HEAD") or users.get_current_user():
+            return parent(request, *args, **kwargs)
+
+        view = condition(
+            etag_func=self.get_etag,
+            last_modified_func=self.get_last_modified,
+        )(parent)
+
+        response = view(request, *args, **kwargs)
+        if not getattr(self, "page_complete", True):
+            for header in ("ETag", "Last-Modified"):
+                if response.has_header(header):
+                    del response[header]
+
+        return response
+
+
+class CachePolicyMixin(object):
+    """
+    Mark successful GET responses as public for `cache_max_age` seconds.
+
+    The mark only states what the view allows, CachePolicyMiddleware decides
+    at the end of the request whether the response really can be public.
+    """
+    cache_max_age = None
+
+    def get_cache_max_age(self):
+        if self.cache_max_age is None:
+            return settings.PUBLIC_CACHE_MAX_AGE
+
+        return self.cache_max_age
+
+    def dispatch(self, request, *args, **kwargs):
+        response = super(CachePolicyMixin, self).dispatch(
+            request, *args, **kwargs)
+
+        if (request.method in ("GET", "HEAD") and
+                response.status_code in (200, 304) and
+                getattr(self, "page_complete", True)):
+            response.public_cache_max_age = self.get_cache_max_age()
+
+        return response
@@ -0,0 +1,92 @@
+"""
+View counters of posts.
+
+A view is only a memcache incr. The first view buffered for a post
+schedules a deferred flush, which adds the buffered views to the post's
+PostViews and updates the list of popular posts. Writes are batched by the
+buffer and only the flush of the post writes its PostViews, so a single
+entity per post takes them without contention.
+
+The buffer is drained only after the views were written, so a failed flush
+is retried with them. Views buffered in memcache are lost if memcache
+evicts them (and counted twice if a flush fails between its write and the
+drain), the counts are approximate.
+"""
+import logging
+
+from django.conf import settings
+from google.appengine.api import memcache
+from google.appengine.ext import deferred, ndb
+
+from blog.cache import bump_generation
+from blog.models import PopularPosts, PostSummary, PostViews
+
+BUFFER_KEY_PREFIX = "blog.counters.views:"
+
+
+def buffer_key(post_id):
+    return "{}{}".format(BUFFER_KEY_PREFIX, post_id)
+
+
+def record_view(post_id):
+    buffered = memcache.incr(buffer_key(post_id), initial_value=0)
+    if buffered == 1:
+        schedule_flush(post_id)
+
+
+def schedule_flush(post_id):
+    deferred.defer(
+        flush_views, post_id, _countdown=settings.VIEW_COUNT_FLUSH_INTERVAL)
+
+
+def add_views(post_id, count):
+    """
+    Add views to the total of the post, returns the new total
+    """
+    def txn():
+        views = PostViews.get_by_id(post_id) or PostViews(id=post_id)
+        views.count += count
+        views.put()
+        return views.count
+
+    return ndb.transaction(txn)
+
+
+def update_popular(post_id, views):
+    """
+    Returns True if the list of popular posts changed
+    """
+    summary = PostSummary.get_by_id(post_id)
+    if summary is None:
+        return False
+
+    def txn():
+        popular = PopularPosts.get_current()
+        version = popular.version
+        if popular.update(post_id, views, summary.title, summary.slug,
+                          size=settings.BLOG_POPULAR_POSTS):
+            popular.put()
+        return popular.version != version
+
+    return ndb.transaction(txn)
+
+
+def flush_views(post_id):
+    key = buffer_key(post_id)
+    count = memcache.get(key)
+    if not count:
+        return
+
+    total = add_views(post_id, count)
+
+    # Written, views counted in the meantime stay buffered
+    remaining = memcache.decr(key, count)
+    if remaining:
+        schedule_flush(post_id)
+
+    if update_popular(post_id, total):
+        # Pages listing popular posts are out of date
+        bump_generation()
+
+    logging.info("Flushed %d views of post %s, %d in total", count, post_id, total)
+
@@ -0,0 +1,76 @@
+"""
+Atom feed of the latest posts.
+
+The XML is built once per version of the collection of posts and kept in
+memcache, so feed readers polling the feed cost a memcache get (or nothing
+at all, when they send the ETag back). Building it is a single query.
+
+The query is eventually consistent, right after a post is written it may
+not see it yet. Such a feed is served, but neither cached nor given the
+version of the collection as its ETag, see PostCollection.is_complete.
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.urlresolvers import reverse
+from django.utils import feedgenerator
+from google.appengine.api import memcache
+
+from blog.markup import RENDERER_VERSION
+from blog.models import Post
+
+FEED_KEY_PREFIX = "blog.feeds.atom:"
+
+CONTENT_TYPE = "application/atom+xml; charset=utf-8"
+
+
+def feed_cache_key(version, base_url):
+    # Links in the feed are absolute, every host gets its own copy. Bodies
+    # are HTML of the renderer, a new one changes the feed.
+    url_hash = hashlib.md5(base_url.encode("utf-8")).hexdigest()
+    return "{}{}:{}:{}:{}".format(
+        FEED_KEY_PREFIX, version, settings.BLOG_FEED_SIZE, RENDERER_VERSION,
+        url_hash)
+
+
+def build_feed(posts, base_url):
+    feed = feedgenerator.Atom1Feed(
+        title=u"Coding after hours",
+        link=base_url,
+        description=u"Latest posts",
+        feed_url=base_url.rstrip("/") + reverse("blog_feed"),
+        language=u"en",
+    )
+
+    for post in posts:
+        url = base_url.rstrip("/") + post.url
+        feed.add_item(
+            title=post.title,
+            link=url,
+            unique_id=url,
+            description=post.body_html or post.body,
+            author_name=post.author,
+            pubdate=post.updated_at,
+        )
+
+    return feed.writeString("utf-8")
+
+
+def get_feed(collection, base_url):
+    """
+    Feed of the collection of posts, cached in memcache, and whether it is
+    complete (includes the last write of the collection)
+    """
+    key = feed_cache_key(collection.version, base_url)
+    content = memcache.get(key)
+    if content is not None:
+        return content, True
+
+    posts = Post.query().order(-Post.created_at).fetch(settings.BLOG_FEED_SIZE)
+    content = build_feed(posts, base_url)
+    complete = collection.is_complete(posts)
+
+    if complete and len(content) < memcache.MAX_VALUE_SIZE:
+        memcache.set(key, content, time=settings.PAGE_CACHE_TIMEOUT)
+
+    return content, complete
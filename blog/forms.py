@@ -1,8 +1,32 @@
 from wtforms.form import Form
 from wtforms.fields import StringField, TextAreaField
-from wtforms.validators import InputRequired
+from wtforms.validators import InputRequired, ValidationError
+
+from blog.models import normalize_tags
+
+# Tags of a single post
+MAX_TAGS = 10
+
+
+class TagListField(StringField):
+    """
+    List of tags entered as comma separated text
+    """
+
+    def _value(self):
+        return u", ".join(self.data or [])
+
+    def process_formdata(self, valuelist):
+        text = valuelist[0] if valuelist else u""
+        self.data = normalize_tags(text.split(u","))
+
+
+def max_tags(form, field):
+    if len(field.data or []) > MAX_TAGS:
+        raise ValidationError("Post can't have more than {} tags".format(MAX_TAGS))
 
 
 class PostForm(Form):
     title = StringField(u'Title', [InputRequired("Title is required")])
     body = TextAreaField(u'Post body', [InputRequired("Body is required")])
+    tags = TagListField(u'Tags', [max_tags])
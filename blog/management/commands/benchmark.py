@@ -0,0 +1,70 @@
+"""
+Benchmark the views against a seeded corpus of posts:
+
+    python manage.py benchmark --corpus 1k --iterations 20
+    python manage.py benchmark --save-baseline benchmarks/1k.json
+    python manage.py benchmark --baseline benchmarks/1k.json
+
+Runs on fresh testbed stubs, the local datastore isn't touched. Compared
+against a baseline it fails when a scenario makes more RPCs (or estimated
+datastore operations) than the baseline, or is slower than
+--latency-threshold times the baseline p50.
+"""
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = "Benchmark the views with a seeded corpus of posts"
+
+    option_list = BaseCommand.option_list + (
+        make_option("--corpus", default="1k", choices=["10", "1k", "50k"],
+                    help="Number of seeded posts: 10, 1k or 50k"),
+        make_option("--iterations", type="int", default=20,
+                    help="Requests per scenario"),
+        make_option("--scenario", action="append", dest="scenarios",
+                    help="Run only this scenario (can be repeated)"),
+        make_option("--baseline", help="Compare with the baseline in this file"),
+        make_option("--save-baseline", help="Save results as a baseline to this file"),
+        make_option("--latency-threshold", type="float", default=1.5,
+                    help="Allowed p50 latency, times the baseline"),
+        make_option("--rpc-threshold", type="float", default=0.0,
+                    help="Allowed increase of RPCs, fraction of the baseline"),
+    )
+
+    def handle(self, *args, **options):
+        from blog import benchmarks
+
+        if options["iterations"] < 1:
+            raise CommandError("At least one iteration is needed")
+
+        names = set(s.name for s in benchmarks.SCENARIOS)
+        unknown = set(options["scenarios"] or []) - names
+        if unknown:
+            raise CommandError("Unknown scenarios: {}. Known: {}".format(
+                ", ".join(sorted(unknown)), ", ".join(sorted(names))))
+
+        baseline = None
+        if options["baseline"]:
+            baseline = benchmarks.load_baseline(options["baseline"])
+            if baseline["corpus"] != options["corpus"]:
+                raise CommandError("Baseline is for the {} corpus".format(
+                    baseline["corpus"]))
+
+        results = benchmarks.run(
+            options["corpus"], options["iterations"], options["scenarios"])
+        self.stdout.write(benchmarks.format_results(results) + "\n")
+
+        if options["save_baseline"]:
+            benchmarks.save_baseline(
+                options["save_baseline"], options["corpus"], results)
+
+        if baseline is not None:
+            failures = benchmarks.compare(
+                results, baseline["scenarios"],
+                options["latency_threshold"], options["rpc_threshold"])
+            if failures:
+                raise CommandError(
+                    "Regressions against the baseline:\n" + "\n".join(failures))
+            self.stdout.write("No regressions against the baseline\n")
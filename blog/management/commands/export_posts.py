@@ -0,0 +1,38 @@
+"""
+Export all posts to JSON lines:
+
+    python manage.py export_posts posts.jsonl
+
+Runs against the local datastore of dev_appserver (see shell.py), writes to
+stdout without a file name.
+"""
+import sys
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from lib.environ import DATASTORE_PATH, setup_stubs
+
+
+class Command(BaseCommand):
+    args = "[file]"
+    help = "Export posts as JSON lines"
+
+    option_list = BaseCommand.option_list + (
+        make_option("--batch-size", type="int", default=200,
+                    help="Posts fetched at once"),
+        make_option("--datastore-path", default=DATASTORE_PATH,
+                    help="Local datastore to read"),
+    )
+
+    def handle(self, *args, **options):
+        setup_stubs(options["datastore_path"])
+
+        from blog.bulk import Progress, export_posts
+
+        progress = Progress(lambda line: sys.stderr.write(line + "\n"))
+        if args:
+            with open(args[0], "w") as out:
+                export_posts(out, options["batch_size"], progress)
+        else:
+            export_posts(sys.stdout, options["batch_size"], progress)
@@ -0,0 +1,49 @@
+"""
+Import posts from JSON lines written by export_posts:
+
+    python manage.py import_posts posts.jsonl
+
+Runs against the local datastore of dev_appserver (see shell.py). Imports
+are checkpointed under the name of the file (or --name), running the same
+import again resumes it, unless --restart is given.
+"""
+import os
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from lib.environ import DATASTORE_PATH, setup_stubs
+
+
+class Command(BaseCommand):
+    args = "<file>"
+    help = "Import posts from JSON lines"
+
+    option_list = BaseCommand.option_list + (
+        make_option("--batch-size", type="int", default=20,
+                    help="Posts written at once (20 at most)"),
+        make_option("--name", help="Name of the import checkpoint"),
+        make_option("--restart", action="store_true", default=False,
+                    help="Ignore the checkpoint and import everything"),
+        make_option("--datastore-path", default=DATASTORE_PATH,
+                    help="Local datastore to write"),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError("Give the file to import")
+
+        setup_stubs(options["datastore_path"])
+
+        from blog.bulk import Progress, import_posts
+
+        progress = Progress(lambda line: self.stdout.write(line + "\n"))
+        with open(args[0]) as lines:
+            # Nothing runs tasks of the local stubs, posts are indexed here
+            checkpoint = import_posts(
+                lines, options["name"] or os.path.basename(args[0]),
+                options["batch_size"], options["restart"], progress,
+                defer_indexing=False)
+
+        self.stdout.write("{} posts imported, {} skipped\n".format(
+            checkpoint.imported, checkpoint.skipped))
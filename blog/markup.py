@@ -0,0 +1,115 @@
+"""
+Rendering of post bodies to HTML.
+
+Bodies are rendered once, when a post is stored (see Post._put), and the
+HTML is kept in Post.body_html, so showing a post never renders anything.
+
+Markdown and Pygments are optional, put them in lib/ to get markdown with
+highlighted code blocks. Without them (and for bodies longer than
+MARKDOWN_MAX_LENGTH, whose markdown rendering could run out of memory or
+time) bodies are rendered by `render_plain`: escaped paragraphs and fenced
+code blocks, in a single pass over the lines. Raw HTML in bodies is escaped
+by both renderers.
+
+RENDERER_VERSION tells which renderer made the HTML, bump REVISION with any
+change of the output and run blog.migrations.RerenderPostsMapper.
+"""
+import re
+
+from django.utils.html import escape
+
+try:
+    import markdown
+except ImportError:
+    markdown = None
+
+try:
+    import pygments
+except ImportError:
+    pygments = None
+
+# Changes of rendering done here
+REVISION = 2
+
+RENDERER_VERSION = "{}-{}".format(
+    REVISION,
+    "markdown-{}-pygments-{}".format(
+        markdown.version, pygments.__version__ if pygments else "none")
+    if markdown else "plain")
+
+MARKDOWN_MAX_LENGTH = 100000
+
+FENCE_RE = re.compile(r"^(```|~~~)\s*([\w+-]*)\s*$")
+
+
+def render_markdown(body):
+    """
+    Markdown with raw HTML escaped, the same as in `render_plain`
+    """
+    extensions = ["fenced_code"]
+    if pygments is not None:
+        extensions.append("codehilite")
+
+    md = markdown.Markdown(extensions=extensions, output_format="html5")
+    for registry, name in [(md.preprocessors, "html_block"),
+                           (md.inlinePatterns, "html")]:
+        if hasattr(registry, "deregister"):
+            registry.deregister(name, strict=False)
+        elif name in registry:
+            del registry[name]
+
+    return md.convert(body)
+
+
+def render_plain(body):
+    """
+    Escaped paragraphs (separated by blank lines) and ``` fenced code
+    """
+    out = []
+    paragraph = []
+    code = None
+
+    def close_paragraph():
+        if paragraph:
+            out.append(u"<p>{}</p>".format(u"<br>".join(paragraph)))
+            del paragraph[:]
+
+    def close_code():
+        out.append(u"{}{}</code></pre>".format(code[0], u"\n".join(code[1:])))
+
+    for line in body.splitlines():
+        fence = FENCE_RE.match(line)
+        if code is not None:
+            if fence and not fence.group(2):
+                close_code()
+                code = None
+            else:
+                code.append(escape(line))
+        elif fence:
+            close_paragraph()
+            language = fence.group(2)
+            code = [
+                u'<pre><code class="language-{}">'.format(language)
+                if language else u"<pre><code>"
+            ]
+        elif line.strip():
+            paragraph.append(escape(line))
+        else:
+            close_paragraph()
+
+    if code is not None:
+        close_code()
+    close_paragraph()
+
+    return u"\n".join(out)
+
+
+def render(body):
+    """
+    HTML of the body and version of the renderer which made it
+    """
+    body = body or u""
+    if markdown is not None and len(body) <= MARKDOWN_MAX_LENGTH:
+        return render_markdown(body), RENDERER_VERSION
+
+    return render_plain(body), RENDERER_VERSION
@@ -0,0 +1,106 @@
+"""
+Middleware of the blog
+"""
+import logging
+
+from django.utils.cache import cc_delim_re, patch_cache_control
+from google.appengine.api import users
+
+from lib import rpcstats
+
+
+def remove_vary_cookie(response):
+    if not response.has_header("Vary"):
+        return
+
+    vary = [
+        header for header in cc_delim_re.split(response["Vary"])
+        if header.lower() != "cookie"
+    ]
+
+    if vary:
+        response["Vary"] = ", ".join(vary)
+    else:
+        del response["Vary"]
+
+
+class CachePolicyMiddleware(object):
+    """
+    Set Cache-Control of responses marked by CachePolicyMixin.
+
+    A response is made public only when it is the same for everybody:
+    nobody is logged in, no CSRF token was rendered, the session was not
+    touched and no cookie is being set. Such a response does not depend on
+    cookies, so `Vary: Cookie` is dropped and shared caches can store it.
+    Everything else is private.
+    """
+
+    def is_public(self, request, response):
+        if users.get_current_user():
+            return False
+
+        if request.META.get("CSRF_COOKIE_USED"):
+            return False
+
+        session = getattr(request, "session", None)
+        if session is not None and session.accessed:
+            return False
+
+        return not response.cookies
+
+    def process_response(self, request, response):
+        max_age = getattr(response, "public_cache_max_age", None)
+        if max_age is None:
+            return response
+
+        if self.is_public(request, response):
+            patch_cache_control(response, public=True, max_age=max_age)
+            remove_vary_cookie(response)
+        else:
+            patch_cache_control(response, private=True, max_age=0)
+
+        return response
+
+
+def rpc_header_name(service):
+    """
+    Header for the calls of a service, e.g. X-RPC-Datastore-V3
+    """
+    return "X-RPC-" + "-".join(
+        part.capitalize() for part in service.replace("_", "-").split("-"))
+
+
+class RPCAccountingMiddleware(object):
+    """
+    Count RPCs made while handling a request (see lib.rpcstats), logged as
+    a one line summary. Responses to admins get them as X-RPC-* headers:
+    calls and their time in total, calls per service and estimated
+    datastore operations.
+
+    Put it first, so RPCs of other middleware are counted too.
+    """
+
+    def process_request(self, request):
+        request.rpc_stats = rpcstats.start()
+
+    def process_response(self, request, response):
+        stats = getattr(request, "rpc_stats", None)
+        if stats is None:
+            # process_request didn't run
+            return response
+
+        rpcstats.stop(stats)
+
+        logging.info("RPCs of %s %s: %s", request.method, request.path, stats.summary())
+
+        if users.is_current_user_admin():
+            response["X-RPC-Calls"] = str(stats.total_calls)
+            response["X-RPC-Time"] = "{:.1f}ms".format(stats.total_time * 1000)
+            for service, count in sorted(stats.by_service().iteritems()):
+                response[rpc_header_name(service)] = str(count)
+            if stats.ops:
+                response["X-RPC-Ops"] = " ".join(
+                    "{}={}".format(name, count)
+                    for name, count in sorted(stats.ops.iteritems()))
+
+        return response
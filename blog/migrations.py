@@ -0,0 +1,207 @@
+"""
+Data migrations for blog models.
+
+Start them from the remote or local shell, e.g.:
+
+    from blog.migrations import ReindexPostsMapper
+    ReindexPostsMapper().start()
+"""
+import datetime
+import logging
+
+from appengine_sessions.mapper import Mapper
+from google.appengine.ext import deferred, ndb
+
+from blog.cache import bump_generation
+from blog.markup import RENDERER_VERSION, render
+from blog.models import (
+    ArchiveMonth, Post, PostArchive, PostCollection, PostSlug, PostSummary,
+    DuplicateSlugError
+)
+from blog.search import index_posts
+
+
+class ReindexPostsMapper(Mapper):
+    """
+    Backfill what is derived from every post (slug index, summary, search
+    index and the archive) for posts stored before it existed.
+
+    Posts aren't put again, that would change their `updated_at` and bump
+    the version of every post and cached pages once per post. The slug
+    index and summary of each post are written in a transaction of their
+    own, posts of a batch are indexed for search by a single task, and the
+    archive is replaced by the counts of all posts once they are done.
+    Posts stored before `updated_at` existed get their `created_at` as it.
+
+    Posts created or deleted while it runs may be counted wrong in the
+    archive, run RebuildArchiveMapper afterwards if the blog is being edited.
+    """
+    model = Post
+    batch_size = 50
+
+    def reindex(self, key):
+        """
+        Write the slug index and summary of the post, returns the post (None
+        if it's gone). Raises DuplicateSlugError when another post has the slug.
+        """
+        post = key.get()
+        if post is None:
+            return None
+
+        if post.slug:
+            index = PostSlug.get_by_id(post.slug)
+            if index is not None and index.post != post.key:
+                raise DuplicateSlugError(post.slug)
+
+        entities = []
+        if post.updated_at is None:
+            post.updated_at = post.created_at
+            # A plain put, Post.put would write everything derived again
+            entities.append(post)
+
+        entities.append(PostSummary.from_post(post))
+        if post.slug:
+            entities.append(PostSlug(
+                id=post.slug, post=post.key,
+                version=post.version, updated_at=post.updated_at))
+
+        ndb.put_multi(entities)
+        return post
+
+    def map(self, posts):
+        counters = {'reindexed': 0, 'duplicates': 0}
+        post_ids = []
+        for post in posts:
+            try:
+                stored = ndb.transaction(lambda: self.reindex(post.key), xg=True)
+            except DuplicateSlugError:
+                counters['duplicates'] += 1
+                logging.warning(
+                    'Post %s not indexed, slug "%s" is already taken',
+                    post.key.id(), post.slug)
+                continue
+
+            if stored is not None:
+                counters['reindexed'] += 1
+                month = archive_month(stored.created_at)
+                counters[month] = counters.get(month, 0) + 1
+                post_ids.append(post.key.id())
+
+        if post_ids:
+            deferred.defer(index_posts, post_ids)
+
+        return counters
+
+    def reduce(self, job):
+        months = dict(job.counters or {})
+        result = {
+            'reindexed': months.pop('reindexed', 0),
+            'duplicates': months.pop('duplicates', 0),
+        }
+        archive = replace_archive(months)
+        result.update(total=archive.total, months=len(archive.months))
+
+        logging.info("Posts reindexed: %s", result)
+        return result
+
+
+class RerenderPostsMapper(Mapper):
+    """
+    Render again bodies of posts rendered by another version of the
+    renderer (see blog.markup).
+
+    Only the HTML (and the version, for ETags) of a post is written, each
+    post and its slug index in a transaction of their own, so shards don't
+    contend and `updated_at` of posts stays, as feeds and sitemaps show it.
+    Cached pages and feeds are invalidated once, when all posts are done.
+    """
+    model = Post
+    batch_size = 20
+
+    def rerender(self, key):
+        post = key.get()
+        if post is None or post.renderer_version == RENDERER_VERSION:
+            return False
+
+        post.body_html, post.renderer_version = render(post.body)
+        post.version += 1
+        entities = [post]
+
+        index = PostSlug.get_by_id(post.slug) if post.slug else None
+        if index is not None and index.post == post.key:
+            index.version = post.version
+            # For Last-Modified of the page, the post itself didn't change
+            index.updated_at = datetime.datetime.utcnow()
+            entities.append(index)
+
+        # Post.put would write everything derived from the post again
+        ndb.put_multi(entities)
+        return True
+
+    def map(self, posts):
+        rendered = 0
+        for post in posts:
+            if post.renderer_version != RENDERER_VERSION:
+                if ndb.transaction(lambda: self.rerender(post.key), xg=True):
+                    rendered += 1
+
+        return {'rendered': rendered, 'current': len(posts) - rendered}
+
+    def reduce(self, job):
+        ndb.transaction(PostCollection.touch)
+        bump_generation()
+
+        logging.info("Posts rendered again: %s", job.counters)
+        return job.counters
+
+
+def archive_month(created_at):
+    return created_at.strftime("%Y-%m")
+
+
+def replace_archive(counters):
+    """
+    Replace PostArchive with the counts of posts by month ("YYYY-MM")
+    """
+    months = [
+        ArchiveMonth(year=int(name[:4]), month=int(name[5:]), count=count)
+        for name, count in sorted(counters.iteritems(), reverse=True)
+    ]
+    archive = PostArchive(
+        id=PostArchive.SINGLETON_ID,
+        total=sum(month.count for month in months), months=months)
+
+    def txn():
+        archive.put()
+        # Page numbers and archive links change with the archive
+        PostCollection.touch()
+
+    ndb.transaction(txn, xg=True)
+    bump_generation()
+    return archive
+
+
+class RebuildArchiveMapper(Mapper):
+    """
+    Count posts of every month from scratch and replace PostArchive with
+    the result, in case it drifted from the posts.
+
+    Posts created or deleted while it runs may be counted wrong, run it
+    again if the blog is being edited.
+    """
+    model = PostSummary
+
+    def map(self, summaries):
+        counters = {}
+        for summary in summaries:
+            month = archive_month(summary.created_at)
+            counters[month] = counters.get(month, 0) + 1
+
+        return counters
+
+    def reduce(self, job):
+        archive = replace_archive(job.counters or {})
+
+        logging.info("Archive rebuilt, %d posts in %d months",
+                     archive.total, len(archive.months))
+        return {"total": archive.total, "months": len(archive.months)}
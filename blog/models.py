@@ -1,5 +1,11 @@
+import datetime
+
 from django.core.urlresolvers import reverse
-from google.appengine.ext import ndb
+from django.utils.text import Truncator
+from google.appengine.ext import deferred, ndb
+
+from blog.cache import bump_generation
+from blog.markup import render
 
 try:
     # Slugify in Django 1.5+
@@ -8,25 +14,621 @@ except ImportError:
     # Local copy
     from lib.slugify import slugify
 
+# Length of post excerpts shown on list pages
+EXCERPT_LENGTH = 100
+
+# Most recent posts of a tag kept in its index
+TAG_INDEX_SIZE = 1000
+
+
+def make_excerpt(body):
+    return Truncator(body or u"").chars(EXCERPT_LENGTH)
+
+
+def normalize_tags(tags):
+    """
+    Slugified tags without duplicates, in the given order
+    """
+    normalized = []
+    for tag in tags or []:
+        tag = slugify(tag)
+        if tag and tag not in normalized:
+            normalized.append(tag)
+
+    return normalized
+
+
+class DuplicateSlugError(Exception):
+    """
+    Raised when a post would take a slug that already belongs to another post
+    """
+
+
+class PostSlug(ndb.Model):
+    """
+    Slug index for posts, keyed by the slug itself.
+
+    Written in the same transaction as the post, so a lookup by slug is a
+    single (cacheable) get instead of a query. Carries the version of the
+    post, so conditional requests can be answered without loading it.
+    """
+    post = ndb.KeyProperty(kind="Post", indexed=False)
+    version = ndb.IntegerProperty(indexed=False)
+    updated_at = ndb.DateTimeProperty(indexed=False)
+
+
+class PostCollection(ndb.Model):
+    """
+    Version of the whole collection of posts, changed by every write.
+
+    `updated_at` is the time of the last write, for writes of posts exactly
+    their `updated_at`, so a query result can be checked to include it.
+    """
+    SINGLETON_ID = "posts"
+
+    # Seconds after the last write after which queries are taken to see it
+    CONSISTENCY_DELAY = 10
+
+    version = ndb.IntegerProperty(default=0, indexed=False)
+    updated_at = ndb.DateTimeProperty(indexed=False)
+
+    @classmethod
+    @ndb.tasklet
+    def get_current_async(cls):
+        collection = yield cls.get_by_id_async(cls.SINGLETON_ID)
+        raise ndb.Return(collection or cls(id=cls.SINGLETON_ID))
+
+    @classmethod
+    def get_current(cls):
+        return cls.get_current_async().get_result()
+
+    def is_complete(self, posts):
+        """
+        Whether the posts (or summaries, a query result) include the last
+        write of the collection
+        """
+        if self.updated_at is None:
+            return True
+
+        if any(post.updated_at and post.updated_at >= self.updated_at
+               for post in posts):
+            return True
+
+        # Deleted posts, or posts written last which don't belong to the
+        # result, are never in it, it's trusted once the query had time to
+        # catch up
+        age = datetime.datetime.utcnow() - self.updated_at
+        return age > datetime.timedelta(seconds=self.CONSISTENCY_DELAY)
+
+    @classmethod
+    def touch(cls, updated_at=None):
+        """
+        Mark the collection as changed (at `updated_at` of the post written,
+        now by default), must run inside a transaction
+        """
+        collection = cls.get_current()
+        collection.version += 1
+        collection.updated_at = updated_at or datetime.datetime.utcnow()
+        collection.put()
+
+
+class PostSummary(ndb.Model):
+    """
+    Small copy of a post used by list pages, keyed by the id of the post.
+
+    Lists read these instead of posts, so they never load full bodies.
+    """
+    title = ndb.StringProperty(indexed=False)
+    author = ndb.StringProperty(indexed=False)
+    slug = ndb.StringProperty(indexed=False)
+    excerpt = ndb.StringProperty(indexed=False)
+    created_at = ndb.DateTimeProperty()
+    updated_at = ndb.DateTimeProperty(indexed=False)
+
+    @property
+    def url(self):
+        return reverse("blog_post", args=[self.slug])
+
+    @classmethod
+    def from_post(cls, post):
+        return cls(
+            id=post.key.id(),
+            title=post.title,
+            author=post.author,
+            slug=post.slug,
+            excerpt=post.excerpt,
+            created_at=post.created_at,
+            updated_at=post.updated_at,
+        )
+
+
+class PostViews(ndb.Model):
+    """
+    Total views of a post (keyed by its id) as of the last flush, written
+    only by flushes, see blog.counters
+    """
+    count = ndb.IntegerProperty(default=0, indexed=False)
+    updated_at = ndb.DateTimeProperty(auto_now=True, indexed=False)
+
+
+class PopularPost(ndb.Model):
+    post_id = ndb.IntegerProperty()
+    title = ndb.StringProperty()
+    slug = ndb.StringProperty()
+    views = ndb.IntegerProperty()
+
+    @property
+    def url(self):
+        return reverse("blog_post", args=[self.slug])
+
+
+class PopularPosts(ndb.Model):
+    """
+    Most read posts, with everything needed to list them.
+
+    The version changes only when the posts or their order change (not with
+    every view), so it can be a part of ETags.
+    """
+    SINGLETON_ID = "popular"
+
+    posts = ndb.LocalStructuredProperty(PopularPost, repeated=True)
+    version = ndb.IntegerProperty(default=0, indexed=False)
+
+    @classmethod
+    @ndb.tasklet
+    def get_current_async(cls):
+        popular = yield cls.get_by_id_async(cls.SINGLETON_ID)
+        raise ndb.Return(popular or cls(id=cls.SINGLETON_ID))
+
+    @classmethod
+    def get_current(cls):
+        return cls.get_current_async().get_result()
+
+    def update(self, post_id, views, title=None, slug=None, size=None):
+        """
+        Set views of the post (None removes it), keeping `size` most read.
+
+        Title and slug of the post are kept if not given. Returns True if
+        the entity changed, the version is changed only if what is listed
+        changed.
+        """
+        before = [(p.post_id, p.title, p.slug) for p in self.posts]
+        current = dict((p.post_id, p) for p in self.posts).get(post_id)
+
+        posts = [p for p in self.posts if p.post_id != post_id]
+        if views is not None and (current or title is not None):
+            posts.append(PopularPost(
+                post_id=post_id,
+                title=title if title is not None else current.title,
+                slug=slug if slug is not None else current.slug,
+                views=views,
+            ))
+
+        posts.sort(key=lambda p: -p.views)
+        if size is not None:
+            posts = posts[:size]
+
+        changed = [(p.post_id, p.title, p.slug) for p in posts] != before
+        if not changed and (current is None or current.views == views):
+            return False
+
+        self.posts = posts
+        if changed:
+            self.version += 1
+        return True
+
+    def rename(self, post_id, title, slug):
+        for post in self.posts:
+            if post.post_id == post_id:
+                return self.update(post_id, post.views, title, slug)
+
+        return False
+
+
+class SearchTerm(ndb.Model):
+    """
+    Part of the posting list of a search term, keyed by "<term> <shard>".
+
+    Posts are spread over shards by their id. Postings are encoded by
+    blog.search.encode_postings.
+    """
+    postings = ndb.BlobProperty()
+
+
+class SearchDocument(ndb.Model):
+    """
+    Terms of a post (keyed by its id) as they are in the search index
+    """
+    terms = ndb.PickleProperty()
+    length = ndb.IntegerProperty(default=0, indexed=False)
+
+
+class SearchStats(ndb.Model):
+    """
+    Number and total length of indexed posts, and version of the index
+    changed by every update
+    """
+    SINGLETON_ID = "search"
+
+    documents = ndb.IntegerProperty(default=0, indexed=False)
+    length = ndb.IntegerProperty(default=0, indexed=False)
+    version = ndb.IntegerProperty(default=0, indexed=False)
+    updated_at = ndb.DateTimeProperty(auto_now=True, indexed=False)
+
+    @classmethod
+    def get_current(cls):
+        return cls.get_by_id(cls.SINGLETON_ID) or cls(id=cls.SINGLETON_ID)
+
+
+class ArchiveMonth(ndb.Model):
+    year = ndb.IntegerProperty()
+    month = ndb.IntegerProperty()
+    count = ndb.IntegerProperty(default=0)
+
+    @property
+    def start(self):
+        return datetime.datetime(self.year, self.month, 1)
+
+    @property
+    def end(self):
+        if self.month == 12:
+            return datetime.datetime(self.year + 1, 1, 1)
+        return datetime.datetime(self.year, self.month + 1, 1)
+
+    @property
+    def url(self):
+        return reverse("blog_month", args=[self.year, "%02d" % self.month])
+
+
+class PostArchive(ndb.Model):
+    """
+    Number of posts in every month (newest first) and in total.
+
+    Updated in the transactions creating and deleting posts, so archive
+    navigation and page numbers never count posts at read time. Rebuilt
+    from scratch by blog.migrations.RebuildArchiveMapper.
+    """
+    SINGLETON_ID = "archive"
+
+    total = ndb.IntegerProperty(default=0, indexed=False)
+    months = ndb.LocalStructuredProperty(ArchiveMonth, repeated=True)
+
+    @classmethod
+    @ndb.tasklet
+    def get_current_async(cls):
+        archive = yield cls.get_by_id_async(cls.SINGLETON_ID)
+        raise ndb.Return(archive or cls(id=cls.SINGLETON_ID))
+
+    @classmethod
+    def get_current(cls):
+        return cls.get_current_async().get_result()
+
+    def get_month(self, year, month):
+        for bucket in self.months:
+            if (bucket.year, bucket.month) == (year, month):
+                return bucket
+
+        return None
+
+    def add(self, created_at, count=1):
+        """
+        Add `count` (may be negative) posts created at the given time
+        """
+        bucket = self.get_month(created_at.year, created_at.month)
+        if bucket is None:
+            bucket = ArchiveMonth(year=created_at.year, month=created_at.month)
+            self.months.append(bucket)
+
+        bucket.count += count
+        self.total += count
+
+        self.months = sorted(
+            (m for m in self.months if m.count > 0),
+            key=lambda m: (m.year, m.month), reverse=True)
+
+    def years(self):
+        """
+        List of (year, number of posts, months) newest first
+        """
+        years = []
+        for bucket in self.months:
+            if not years or years[-1][0] != bucket.year:
+                years.append((bucket.year, 0, []))
+            year, count, months = years[-1]
+            years[-1] = (year, count + bucket.count, months + [bucket])
+
+        return years
+
+    def locate(self, offset):
+        """
+        Month holding the post at `offset` of all posts (newest first), and
+        the offset of that post within its month. None if there is no such
+        post.
+        """
+        for bucket in self.months:
+            if offset < bucket.count:
+                return bucket, offset
+            offset -= bucket.count
+
+        return None
+
+
+class TagCount(ndb.Model):
+    name = ndb.StringProperty()
+    count = ndb.IntegerProperty()
+
+    @property
+    def url(self):
+        return reverse("blog_tag", args=[self.name])
+
+
+class TagCloud(ndb.Model):
+    """
+    All tags with number of their posts.
+
+    Root of all TagIndex entities, so any number of tags is updated in a
+    transaction touching a single entity group.
+    """
+    SINGLETON_ID = "tags"
+
+    tags = ndb.LocalStructuredProperty(TagCount, repeated=True)
+
+    @classmethod
+    def root_key(cls):
+        return ndb.Key(cls, cls.SINGLETON_ID)
+
+    @classmethod
+    @ndb.tasklet
+    def get_current_async(cls):
+        cloud = yield cls.root_key().get_async()
+        raise ndb.Return(cloud or cls(key=cls.root_key()))
+
+    @classmethod
+    def get_current(cls):
+        return cls.get_current_async().get_result()
+
+    def set_count(self, name, count):
+        tags = [tag for tag in self.tags if tag.name != name]
+        if count:
+            tags.append(TagCount(name=name, count=count))
+
+        self.tags = sorted(tags, key=lambda tag: tag.name)
+
+
+class TaggedPost(ndb.Model):
+    post_id = ndb.IntegerProperty()
+    created_at = ndb.DateTimeProperty()
+
+
+class TagIndex(ndb.Model):
+    """
+    Number of posts with the tag (keyed by the tag) and ids of the most
+    recent of them (TAG_INDEX_SIZE at most), newest first.
+
+    Ids are the same as of PostSummary entities, so a page of a tag is
+    a get of the index and a get_multi of summaries.
+    """
+    count = ndb.IntegerProperty(default=0, indexed=False)
+    posts = ndb.LocalStructuredProperty(TaggedPost, repeated=True)
+
+    @classmethod
+    def make_key(cls, tag):
+        return ndb.Key(cls, tag, parent=TagCloud.root_key())
+
+    @classmethod
+    def get_by_tag_async(cls, tag):
+        return cls.make_key(tag).get_async()
+
+    def add(self, post_id, created_at):
+        self.count += 1
+        self.posts.append(TaggedPost(post_id=post_id, created_at=created_at))
+        self.posts.sort(key=lambda post: post.created_at, reverse=True)
+        del self.posts[TAG_INDEX_SIZE:]
+
+    def remove(self, post_id):
+        self.count -= 1
+        self.posts = [post for post in self.posts if post.post_id != post_id]
+
+    def summary_keys(self, offset, limit):
+        return [
+            ndb.Key(PostSummary, post.post_id)
+            for post in self.posts[offset:offset + limit]
+        ]
+
+
+def update_tags(post_id, created_at, old_tags, new_tags):
+    """
+    Move the post from its old to new tags, must run inside a transaction
+    """
+    update_tags_multi([(post_id, created_at, old_tags, new_tags)])
+
+
+def update_tags_multi(changes):
+    """
+    Apply a list of (post id, created at, old tags, new tags) changes, must
+    run inside a transaction
+    """
+    moves = []
+    for post_id, created_at, old_tags, new_tags in changes:
+        moves.extend(
+            (tag, post_id, created_at, True)
+            for tag in new_tags if tag not in old_tags)
+        moves.extend(
+            (tag, post_id, created_at, False)
+            for tag in old_tags if tag not in new_tags)
+    if not moves:
+        return
+
+    changed = sorted(set(move[0] for move in moves))
+    cloud, indexes = TagCloud.get_current(), ndb.get_multi(
+        [TagIndex.make_key(tag) for tag in changed])
+    indexes = dict(
+        (tag, index or TagIndex(key=TagIndex.make_key(tag)))
+        for tag, index in zip(changed, indexes))
+
+    for tag, post_id, created_at, added in moves:
+        if added:
+            indexes[tag].add(post_id, created_at)
+        else:
+            indexes[tag].remove(post_id)
+
+    to_put, to_delete = [cloud], []
+    for tag in changed:
+        index = indexes[tag]
+        cloud.set_count(tag, index.count)
+        if index.count > 0:
+            to_put.append(index)
+        else:
+            to_delete.append(index.key)
+
+    ndb.put_multi(to_put)
+    ndb.delete_multi(to_delete)
+
+
+class ImportCheckpoint(ndb.Model):
+    """
+    Progress of an import of posts (see blog.bulk), keyed by its name
+    """
+    line = ndb.IntegerProperty(default=0, indexed=False)
+    imported = ndb.IntegerProperty(default=0, indexed=False)
+    skipped = ndb.IntegerProperty(default=0, indexed=False)
+    updated_at = ndb.DateTimeProperty(auto_now=True, indexed=False)
+
+
+def defer_indexing(post_id):
+    """
+    Update the search index after the current transaction commits
+    """
+    # blog.search depends on the models
+    from blog.search import index_post
+    deferred.defer(index_post, post_id, _transactional=True)
+
 
 class Post(ndb.Model):
     title = ndb.StringProperty()
     body = ndb.TextProperty()
+    # Rendered by blog.markup when the post is stored
+    body_html = ndb.TextProperty()
+    renderer_version = ndb.StringProperty(indexed=False)
     author = ndb.StringProperty()
     created_at = ndb.DateTimeProperty(auto_now_add=True)
+    # Set by put, not by migrations which don't change what the post says
+    updated_at = ndb.DateTimeProperty()
+    version = ndb.IntegerProperty(default=0, indexed=False)
     slug = ndb.ComputedProperty(lambda self: slugify(self.title))
+    tags = ndb.StringProperty(repeated=True)
 
     @property
     def url(self):
         return reverse("blog_post", args=[self.slug])
 
+    @property
+    def excerpt(self):
+        return make_excerpt(self.body)
+
     @classmethod
-    def get_by_slug(cls, slug):
+    @ndb.tasklet
+    def get_by_slug_async(cls, slug):
         if not slug:
-            return None
+            raise ndb.Return(None)
+
+        index = yield PostSlug.get_by_id_async(slug)
+        if index is None:
+            raise ndb.Return(None)
+
+        post = yield index.post.get_async()
+        raise ndb.Return(post)
+
+    @classmethod
+    def get_by_slug(cls, slug):
+        return cls.get_by_slug_async(slug).get_result()
+
+    def _put(self, **ctx_options):
+        """
+        Render the body and store the post, keeping its slug index, summary,
+        tag indexes, the archive and the version of the collection up to
+        date. Cached pages are invalidated after commit.
+
+        Raises DuplicateSlugError when another post already uses the slug.
+        """
+        # Outside of the transaction, it may take a while
+        self.body_html, self.renderer_version = render(self.body)
+
+        key = ndb.transaction(
+            lambda: self._put_in_transaction(**ctx_options), xg=True)
+        bump_generation()
+
+        return key
+    put = _put
+
+    def _put_in_transaction(self, **ctx_options):
+        previous = self.key.get() if self.key else None
+
+        index = PostSlug.get_by_id(self.slug) if self.slug else None
+        if index and index.post != self.key:
+            raise DuplicateSlugError(self.slug)
+
+        self.version = previous.version + 1 if previous else 1
+        self.tags = normalize_tags(self.tags)
+        self.updated_at = datetime.datetime.utcnow()
+        key = super(Post, self)._put(**ctx_options)
+
+        previous_created_at = previous.created_at if previous else None
+        if previous_created_at != self.created_at:
+            archive = PostArchive.get_current()
+            if previous_created_at:
+                archive.add(previous_created_at, -1)
+            archive.add(self.created_at)
+            archive.put()
+
+        if previous and previous.slug and previous.slug != self.slug:
+            ndb.Key(PostSlug, previous.slug).delete()
+
+        entities = [PostSummary.from_post(self)]
+        if self.slug:
+            entities.append(PostSlug(
+                id=self.slug, post=key,
+                version=self.version, updated_at=self.updated_at))
+        ndb.put_multi(entities)
+        PostCollection.touch(self.updated_at)
+
+        if previous:
+            popular = PopularPosts.get_current()
+            if popular.rename(key.id(), self.title, self.slug):
+                popular.put()
+
+        update_tags(
+            key.id(), self.created_at, previous.tags if previous else [],
+            self.tags)
+        defer_indexing(key.id())
+
+        return key
+
+    def _delete(self):
+        """
+        Delete the post together with its slug index and summary (and from
+        tags, the archive, popular posts and the search index), changing the
+        version of the collection and invalidating cached pages
+        """
+        keys = [self.key, ndb.Key(PostSummary, self.key.id())]
+        if self.slug:
+            keys.append(ndb.Key(PostSlug, self.slug))
+
+        def txn():
+            ndb.delete_multi(keys)
+            PostCollection.touch()
+            update_tags(self.key.id(), self.created_at, self.tags, [])
+
+            archive = PostArchive.get_current()
+            archive.add(self.created_at, -1)
+            archive.put()
+
+            popular = PopularPosts.get_current()
+            if popular.update(self.key.id(), None):
+                popular.put()
 
-        posts = cls.query(cls.slug == slug)
-        if posts.count() != 1:
-            return None
+            defer_indexing(self.key.id())
 
-        return posts.fetch(1)[0]
+        ndb.transaction(txn, xg=True)
+        bump_generation()
+    delete = _delete
@@ -0,0 +1,251 @@
+"""
+Full-text search over posts.
+
+The index is inverted: every term has a posting list of (post id, term
+frequency, post length) entries, split over SHARD_COUNT SearchTerm entities
+by post id, so writes of different posts rarely touch the same entity.
+Postings are sorted by post id and stored as varint encoded deltas.
+
+Posts are (re)indexed by a deferred task enqueued in the transaction writing
+or deleting the post, indexing reads the post again so it is idempotent and
+only terms that really changed are written. Posts stored before the index
+existed are indexed by blog.migrations.ReindexPostsMapper.
+
+A search is a single get_multi of all shards of the query terms (served by
+the ndb caches most of the time), ranked by BM25.
+"""
+import collections
+import logging
+import math
+import re
+
+from google.appengine.ext import ndb
+
+from blog.cache import bump_generation
+from blog.models import Post, PostSummary, SearchDocument, SearchStats, SearchTerm
+from lib.slugify import fold
+
+SHARD_COUNT = 4
+
+# Terms shorter or longer than that are not indexed
+MIN_TERM_LENGTH = 2
+MAX_TERM_LENGTH = 64
+
+# Query terms taken into account
+MAX_QUERY_TERMS = 10
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+# Single transaction per term, that many at once
+TERM_WRITE_BATCH = 50
+
+
+def tokenize(text):
+    """
+    Terms of the text, folded the same way slugs are
+    """
+    return [
+        term for term in re.findall(r"[a-z0-9]+", fold(text or u""))
+        if MIN_TERM_LENGTH <= len(term) <= MAX_TERM_LENGTH
+    ]
+
+
+def post_terms(post):
+    terms = tokenize(post.title) + tokenize(post.body)
+    return dict(collections.Counter(terms)), len(terms)
+
+
+def term_key(term, shard):
+    return ndb.Key(SearchTerm, "{} {}".format(term, shard))
+
+
+def shard_of(post_id):
+    return post_id % SHARD_COUNT
+
+
+def _encode_varint(value, out):
+    while value > 0x7f:
+        out.append(chr(0x80 | (value & 0x7f)))
+        value >>= 7
+    out.append(chr(value))
+
+
+def _decode_varints(data):
+    value = shift = 0
+    for byte in data:
+        byte = ord(byte)
+        value |= (byte & 0x7f) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            yield value
+            value = shift = 0
+
+
+def encode_postings(postings):
+    """
+    Encode a list of (post id, frequency, length) sorted by post id
+    """
+    out = []
+    previous = 0
+    for post_id, frequency, length in postings:
+        _encode_varint(post_id - previous, out)
+        _encode_varint(frequency, out)
+        _encode_varint(length, out)
+        previous = post_id
+
+    return "".join(out)
+
+
+def decode_postings(data):
+    values = _decode_varints(data or "")
+    postings = []
+    post_id = 0
+    for delta in values:
+        post_id += delta
+        postings.append((post_id, next(values), next(values)))
+
+    return postings
+
+
+@ndb.tasklet
+def update_term_async(term, post_id, frequency, length):
+    """
+    Set the posting of the post in the posting list of the term (remove it
+    if frequency is 0)
+    """
+    key = term_key(term, shard_of(post_id))
+
+    @ndb.tasklet
+    def txn():
+        entity = yield key.get_async()
+        postings = dict(
+            (p[0], p[1:]) for p in decode_postings(entity and entity.postings))
+
+        if frequency:
+            postings[post_id] = (frequency, length)
+        else:
+            postings.pop(post_id, None)
+
+        if postings:
+            data = encode_postings(
+                (i, f, l) for i, (f, l) in sorted(postings.iteritems()))
+            yield SearchTerm(key=key, postings=data).put_async()
+        elif entity is not None:
+            yield key.delete_async()
+
+    yield ndb.transaction_async(txn)
+
+
+def index_post(post_id):
+    """
+    Bring the index in line with the post as it is now (deleted posts are
+    removed from the index)
+    """
+    post, document = ndb.get_multi([
+        ndb.Key(Post, post_id), ndb.Key(SearchDocument, post_id)])
+    if post is None and document is None:
+        return
+
+    terms, length = post_terms(post) if post else ({}, 0)
+    old_terms = document.terms if document else {}
+    old_length = document.length if document else 0
+
+    changed = [
+        term for term in set(terms) | set(old_terms)
+        if terms.get(term) != old_terms.get(term) or length != old_length
+    ]
+    if post and document and not changed:
+        return
+
+    for start in range(0, len(changed), TERM_WRITE_BATCH):
+        ndb.Future.wait_all([
+            update_term_async(term, post_id, terms.get(term, 0), length)
+            for term in changed[start:start + TERM_WRITE_BATCH]
+        ])
+
+    def txn():
+        current = SearchDocument.get_by_id(post_id)
+        stats = SearchStats.get_current()
+        stats.version += 1
+        if current:
+            stats.documents -= 1
+            stats.length -= current.length
+
+        if post:
+            stats.documents += 1
+            stats.length += length
+            ndb.put_multi([SearchDocument(id=post_id, terms=terms, length=length), stats])
+        else:
+            stats.put()
+            if current:
+                current.key.delete()
+
+    ndb.transaction(txn, xg=True)
+    # Cached search pages are out of date
+    bump_generation()
+
+    logging.info("Indexed post %s, %d terms written", post_id, len(changed))
+
+
+def index_posts(post_ids):
+    for post_id in post_ids:
+        index_post(post_id)
+
+
+def rank(terms, shards, stats):
+    """
+    List of (score, post id) by BM25, best first
+    """
+    if not stats or not stats.documents:
+        return []
+
+    average_length = float(stats.length) / stats.documents or 1.0
+    scores = collections.defaultdict(float)
+    for term in terms:
+        postings = []
+        for shard in shards[term]:
+            postings.extend(decode_postings(shard.postings) if shard else [])
+        if not postings:
+            continue
+
+        frequency = len(postings)
+        idf = math.log(1 + (stats.documents - frequency + 0.5) / (frequency + 0.5))
+        for post_id, tf, length in postings:
+            norm = K1 * (1 - B + B * length / average_length)
+            scores[post_id] += idf * tf * (K1 + 1) / (tf + norm)
+
+    return sorted(((score, post_id) for post_id, score in scores.iteritems()),
+                  key=lambda result: (-result[0], result[1]))
+
+
+@ndb.tasklet
+def search_async(query, offset=0, limit=10):
+    """
+    PostSummary of matching posts (`limit` of them from `offset`) and the
+    number of all matching posts
+    """
+    terms = list(collections.OrderedDict.fromkeys(tokenize(query)))[:MAX_QUERY_TERMS]
+    if not terms:
+        raise ndb.Return([], 0)
+
+    keys = [term_key(term, shard) for term in terms for shard in range(SHARD_COUNT)]
+    entities = yield ndb.get_multi_async(
+        keys + [ndb.Key(SearchStats, SearchStats.SINGLETON_ID)])
+
+    shards = dict(
+        (term, entities[i * SHARD_COUNT:(i + 1) * SHARD_COUNT])
+        for i, term in enumerate(terms))
+    results = rank(terms, shards, entities[-1])
+
+    page = results[offset:offset + limit]
+    summaries = yield ndb.get_multi_async(
+        [ndb.Key(PostSummary, post_id) for _, post_id in page])
+
+    raise ndb.Return([s for s in summaries if s is not None], len(results))
+
+
+def search(query, offset=0, limit=10):
+    return search_async(query, offset, limit).get_result()
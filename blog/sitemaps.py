@@ -0,0 +1,149 @@
+"""
+sitemap.xml of the blog.
+
+Posts are read in batches (a keys-only query page, then a get_multi of
+their summaries, kept out of the context cache), and the XML of a section
+is built under the request, so its RPCs run in the request's context and
+an error is an error response, not a truncated sitemap.
+
+Sitemaps are limited to URL_LIMIT URLs. Above that /sitemap.xml is a
+sitemap index of sections, each a range of whole months taken from the
+PostArchive, so a section is a query of a created_at range and nothing is
+counted.
+
+Every section is compressed and cached in memcache under the version of
+the collection of posts, so any change of posts invalidates them. Sections
+built right after a write which the query may not see yet aren't cached.
+"""
+import hashlib
+import zlib
+from xml.sax.saxutils import escape
+
+from django.conf import settings
+from django.core.urlresolvers import reverse
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+from blog.models import PostSummary
+
+URL_LIMIT = 50000
+
+SITEMAP_KEY_PREFIX = "blog.sitemaps:"
+
+CONTENT_TYPE = "application/xml; charset=utf-8"
+
+XML_HEADER = '<?xml version="1.0" encoding="UTF-8"?>\n'
+URLSET_START = '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n'
+URLSET_END = '</urlset>\n'
+INDEX_START = '<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n'
+INDEX_END = '</sitemapindex>\n'
+
+# Pages other than posts, listed in the first section
+STATIC_PAGES = ("home", "blog", "about_me")
+
+
+def sitemap_cache_key(version, base_url, section):
+    url_hash = hashlib.md5(base_url.encode("utf-8")).hexdigest()
+    return "{}{}:{}:{}".format(SITEMAP_KEY_PREFIX, version, url_hash, section)
+
+
+def split_sections(archive, limit=None):
+    """
+    List of (start, end) ranges of created_at (None for unbounded), oldest
+    first, each with at most `limit` URLs (unless a single month has more)
+    """
+    limit = limit or URL_LIMIT
+    if archive.total + len(STATIC_PAGES) <= limit:
+        return [(None, None)]
+
+    sections = []
+    start, count = None, len(STATIC_PAGES)
+    for month in reversed(archive.months):
+        if count and count + month.count > limit:
+            sections.append((start, month.start))
+            start, count = month.start, 0
+        count += month.count
+
+    sections.append((start, None))
+    return sections
+
+
+def iter_posts(start=None, end=None, batch_size=None):
+    """
+    PostSummary entities created in the range, oldest first
+    """
+    batch_size = batch_size or settings.SITEMAP_BATCH_SIZE
+
+    query = PostSummary.query()
+    if start is not None:
+        query = query.filter(PostSummary.created_at >= start)
+    if end is not None:
+        query = query.filter(PostSummary.created_at < end)
+    query = query.order(PostSummary.created_at)
+
+    cursor, more = None, True
+    while more:
+        keys, cursor, more = query.fetch_page(
+            batch_size, start_cursor=cursor, keys_only=True)
+
+        # Don't keep all posts in the context cache
+        for summary in ndb.get_multi(keys, use_cache=False):
+            if summary is not None:
+                yield summary
+
+
+def url_element(loc, lastmod=None):
+    element = "<url><loc>{}</loc>".format(escape(loc))
+    if lastmod is not None:
+        element += "<lastmod>{}</lastmod>".format(lastmod.strftime("%Y-%m-%d"))
+    return (element + "</url>\n").encode("utf-8")
+
+
+def build_urlset(base_url, collection, start=None, end=None, first=True):
+    """
+    Sitemap of the posts created in the range (and other pages, in the
+    `first` section), at most URL_LIMIT URLs, and whether it is complete
+    (includes the last write of the collection, see PostCollection.is_complete)
+    """
+    base_url = base_url.rstrip("/")
+
+    parts = [XML_HEADER + URLSET_START]
+    if first:
+        for name in STATIC_PAGES:
+            parts.append(url_element(base_url + reverse(name)))
+
+    # Only the most recently updated post tells if the section is complete
+    newest = None
+    for summary in iter_posts(start, end):
+        parts.append(url_element(
+            base_url + summary.url, summary.updated_at or summary.created_at))
+        if summary.updated_at and (
+                newest is None or summary.updated_at > newest.updated_at):
+            newest = summary
+
+    parts.append(URLSET_END)
+    complete = collection.is_complete([newest] if newest else [])
+    return "".join(parts), complete
+
+
+def generate_index(base_url, sections):
+    base_url = base_url.rstrip("/")
+
+    parts = [XML_HEADER, INDEX_START]
+    for number in range(len(sections)):
+        loc = base_url + reverse("sitemap_section", args=[number])
+        parts.append("<sitemap><loc>{}</loc></sitemap>\n".format(escape(loc)))
+    parts.append(INDEX_END)
+
+    return "".join(parts).encode("utf-8")
+
+
+def set_cached(key, content):
+    data = zlib.compress(content)
+    if len(data) < memcache.MAX_VALUE_SIZE:
+        memcache.set(key, data, time=settings.PAGE_CACHE_TIMEOUT)
+
+
+def get_cached(key):
+    data = memcache.get(key)
+    return zlib.decompress(data) if data is not None else None
@@ -20,7 +20,12 @@ function toggle_form() {
         form.find(":input").each(function() {
             var article_field = article.find(".post_" + this.name);
             if (article_field.length == 1) {
-                this.value = article_field.text().trim();
+                // Fields shown formatted keep their raw value in data-value
+                var value = article_field.attr("data-value");
+                if (value === undefined) {
+                    value = article_field.text().trim();
+                }
+                this.value = value;
             }
         })
     }
@@ -1,3 +1,18 @@
 from blog.tests.test_models import *
 from blog.tests.test_list_views import *
 from blog.tests.test_post_views import *
+from blog.tests.test_page_cache import *
+from blog.tests.test_conditional_get import *
+from blog.tests.test_warmup import *
+from blog.tests.test_templates import *
+from blog.tests.test_cache_policy import *
+from blog.tests.test_counters import *
+from blog.tests.test_search import *
+from blog.tests.test_tags import *
+from blog.tests.test_archive import *
+from blog.tests.test_feeds import *
+from blog.tests.test_sitemaps import *
+from blog.tests.test_markup import *
+from blog.tests.test_bulk import *
+from blog.tests.test_benchmarks import *
+from blog.tests.test_rpc_accounting import *
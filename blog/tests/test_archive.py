@@ -0,0 +1,129 @@
+import datetime
+
+from appengine_sessions.models import MapperJob
+from django.core.urlresolvers import reverse
+from django.test.utils import override_settings
+from ndbtestcase import AppEngineTestCase
+
+from blog.migrations import RebuildArchiveMapper
+from blog.models import Post, PostArchive
+from blog.views import PostListView
+
+
+def make_post(title, created_at):
+    post = Post(title=title, created_at=created_at)
+    post.put()
+    return post
+
+
+class TestPostArchive(AppEngineTestCase):
+
+    def months(self):
+        archive = PostArchive.get_current()
+        return [(m.year, m.month, m.count) for m in archive.months], archive.total
+
+    def test_counted_on_create(self):
+        make_post(u"Post 1", datetime.datetime(2014, 1, 5))
+        make_post(u"Post 2", datetime.datetime(2014, 1, 20))
+        make_post(u"Post 3", datetime.datetime(2014, 3, 1))
+
+        self.assertEquals(self.months(), ([(2014, 3, 1), (2014, 1, 2)], 3))
+
+    def test_not_counted_on_update(self):
+        post = make_post(u"Post 1", datetime.datetime(2014, 1, 5))
+        post.title = u"Post 1 renamed"
+        post.put()
+
+        self.assertEquals(self.months(), ([(2014, 1, 1)], 1))
+
+    def test_counted_on_delete(self):
+        make_post(u"Post 1", datetime.datetime(2014, 1, 5))
+        post = make_post(u"Post 2", datetime.datetime(2014, 3, 1))
+        post.delete()
+
+        self.assertEquals(self.months(), ([(2014, 1, 1)], 1))
+
+    def test_years(self):
+        make_post(u"Post 1", datetime.datetime(2013, 12, 5))
+        make_post(u"Post 2", datetime.datetime(2014, 1, 5))
+        make_post(u"Post 3", datetime.datetime(2014, 2, 5))
+
+        years = [
+            (year, count, len(months))
+            for year, count, months in PostArchive.get_current().years()
+        ]
+        self.assertEquals(years, [(2014, 2, 2), (2013, 1, 1)])
+
+    def test_rebuilt(self):
+        make_post(u"Post 1", datetime.datetime(2014, 1, 5))
+        make_post(u"Post 2", datetime.datetime(2014, 3, 1))
+        PostArchive(id=PostArchive.SINGLETON_ID, total=10).put()
+
+        job = RebuildArchiveMapper().start()
+        self.run_deferred_tasks()
+
+        self.assertEquals(job.key.get().status, MapperJob.DONE)
+        self.assertEquals(self.months(), ([(2014, 3, 1), (2014, 1, 1)], 2))
+
+
+class TestArchivePages(AppEngineTestCase):
+
+    def setUp(self):
+        for day in range(1, 4):
+            make_post(u"January -{}-".format(day), datetime.datetime(2014, 1, day))
+        for day in range(1, 3):
+            make_post(u"February -{}-".format(day), datetime.datetime(2014, 2, day))
+
+    @override_settings(BLOG_PAGE_SIZE=2)
+    def test_month_page(self):
+        url = reverse("blog_month", args=[2014, "01"])
+        response = self.client.get(url)
+
+        self.assertEquals(
+            [p.title for p in response.context["posts"]],
+            [u"January -3-", u"January -2-"])
+        self.assertEquals(response.context["next_page"], 2)
+
+        response = self.client.get(url, {"page": 2})
+        self.assertEquals(
+            [p.title for p in response.context["posts"]], [u"January -1-"])
+        self.assertIsNone(response.context["next_page"])
+
+    def test_empty_month(self):
+        response = self.client.get(reverse("blog_month", args=[2014, "05"]))
+
+        self.assertEquals(response.status_code, 404)
+
+    @override_settings(BLOG_PAGE_SIZE=2)
+    def test_numbered_pages(self):
+        response = self.client.get(reverse("blog"), {"page": 2})
+
+        self.assertEquals(
+            [p.title for p in response.context["posts"]],
+            [u"January -3-", u"January -2-"])
+        self.assertEquals(response.context["page_numbers"], [1, 2, 3])
+        self.assertEquals(response.context["prev_page"], 1)
+        self.assertEquals(response.context["next_page"], 3)
+
+    @override_settings(BLOG_PAGE_SIZE=1)
+    def test_page_numbers_around_current_page(self):
+        PostListView.page_numbers_around = 1
+        try:
+            response = self.client.get(reverse("blog"), {"page": 4})
+        finally:
+            PostListView.page_numbers_around = 5
+
+        self.assertEquals(response.context["page_numbers"], [1, None, 3, 4, 5])
+        self.assertContains(response, "&hellip;")
+
+    @override_settings(BLOG_PAGE_SIZE=2)
+    def test_page_out_of_range(self):
+        response = self.client.get(reverse("blog"), {"page": 4})
+
+        self.assertEquals(response.status_code, 404)
+
+    def test_archive_links(self):
+        response = self.client.get(reverse("blog"))
+
+        self.assertContains(response, reverse("blog_month", args=[2014, "01"]))
+        self.assertContains(response, reverse("blog_month", args=[2014, "02"]))
@@ -0,0 +1,90 @@
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+from ndbtestcase import AppEngineTestCase
+
+from blog import benchmarks
+from blog.models import Post
+from lib import rpcstats
+
+
+class TestRPCStats(AppEngineTestCase):
+
+    def test_calls_counted_by_service(self):
+        with rpcstats.recording() as stats:
+            memcache.get("key")
+            memcache.get_multi(["a", "b"])
+
+        self.assertEquals(stats.by_service(), {"memcache": 2})
+        self.assertEquals(stats.total_calls, 2)
+        self.assertIn("memcache: 2 calls", stats.summary())
+
+    def test_writes_estimated(self):
+        with rpcstats.recording() as stats:
+            Post(title=u"Counted").put()
+
+        self.assertGreaterEqual(stats.by_service()["datastore_v3"], 1)
+        self.assertGreater(stats.ops["writes"], 2)
+
+    def test_reads_estimated(self):
+        keys = ndb.put_multi([Post(title=u"Post {}".format(x)) for x in range(3)])
+
+        with rpcstats.recording() as stats:
+            ndb.get_multi(keys, use_cache=False, use_memcache=False)
+
+        self.assertEquals(stats.ops["reads"], 3)
+
+    def test_nothing_counted_outside_recording(self):
+        stats = rpcstats.start()
+        rpcstats.stop()
+        memcache.get("key")
+
+        self.assertEquals(stats.total_calls, 0)
+        self.assertIsNone(rpcstats.current())
+
+
+class TestBenchmarks(AppEngineTestCase):
+
+    def test_corpus_is_deterministic(self):
+        self.assertEquals(
+            list(benchmarks.corpus_records(5)), list(benchmarks.corpus_records(5)))
+        self.assertNotEquals(
+            list(benchmarks.corpus_records(5)),
+            list(benchmarks.corpus_records(5, seed=1)))
+
+    def test_all_scenarios_run(self):
+        results = benchmarks.run("10", 1)
+
+        self.assertEquals(
+            sorted(results), sorted(s.name for s in benchmarks.SCENARIOS))
+        for name, result in results.iteritems():
+            self.assertLessEqual(result["p50"], result["p99"], name)
+            self.assertGreater(result["bytes"], 0, name)
+        self.assertGreater(results["post update"]["ops"]["writes"], 0)
+        self.assertGreater(results["home (cold)"]["calls"]["datastore_v3"], 0)
+
+    def test_regressions_found(self):
+        baseline = {
+            "home": {
+                "p50": 10.0, "calls": {"datastore_v3": 2.0, "memcache": 1.0},
+                "ops": {"reads": 2.0}, "bytes": 1000.0,
+            },
+        }
+        same = {
+            "home": {
+                "p50": 12.0, "calls": {"datastore_v3": 2.0, "memcache": 1.0},
+                "ops": {"reads": 2.0}, "bytes": 1050.0,
+            },
+        }
+        worse = {
+            "home": {
+                "p50": 20.0, "calls": {"datastore_v3": 3.0, "memcache": 1.0},
+                "ops": {"reads": 2.0}, "bytes": 1000.0,
+            },
+        }
+
+        self.assertEquals(benchmarks.compare(same, baseline), [])
+        failures = benchmarks.compare(worse, baseline)
+        self.assertEquals(len(failures), 2)
+        self.assertIn("datastore_v3", failures[1])
+        self.assertEquals(benchmarks.compare(worse, baseline, rpc_threshold=0.5,
+                                             latency_threshold=2.0), [])
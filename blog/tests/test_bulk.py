@@ -0,0 +1,121 @@
+import datetime
+import json
+import os
+import shutil
+import StringIO
+import tempfile
+
+from django.core.management import call_command
+from google.appengine.api import memcache
+from ndbtestcase import AppEngineTestCase
+
+from blog.bulk import export_posts, import_posts
+from blog.models import (
+    ImportCheckpoint, Post, PostArchive, PostSlug, PostSummary, TagIndex
+)
+from blog.search import search
+
+
+def make_record(number, **kwargs):
+    record = {
+        "id": number,
+        "title": u"Post {}".format(number),
+        "body": u"Body {}".format(number),
+        "author": u"Owner",
+        "tags": [u"python"],
+        "created_at": "2014-01-{:02d}T10:00:00.000000".format(number),
+    }
+    record.update(kwargs)
+    return json.dumps(record) + "\n"
+
+
+class TestExport(AppEngineTestCase):
+
+    def test_all_posts_exported(self):
+        for x in range(5):
+            Post(title=u"Post {}".format(x), tags=[u"python"]).put()
+
+        out = StringIO.StringIO()
+        rows = export_posts(out, batch_size=2)
+
+        records = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEquals(rows, 5)
+        self.assertEquals(
+            sorted(r["title"] for r in records),
+            [u"Post {}".format(x) for x in range(5)])
+        self.assertEquals(records[0]["tags"], [u"python"])
+
+
+class TestImport(AppEngineTestCase):
+
+    def test_posts_imported(self):
+        checkpoint = import_posts(
+            [make_record(x) for x in range(1, 6)], "test", batch_size=2)
+        self.run_deferred_tasks()
+
+        self.assertEquals((checkpoint.imported, checkpoint.skipped), (5, 0))
+        self.assertEquals(Post.get_by_slug("post-3").body, u"Body 3")
+        self.assertIn(u"Body 3", Post.get_by_id(3).body_html)
+        self.assertEquals(PostSummary.get_by_id(3).title, u"Post 3")
+        self.assertEquals(PostArchive.get_current().total, 5)
+        self.assertEquals(TagIndex.make_key(u"python").get().count, 5)
+        self.assertEquals(search(u"body")[1], 5)
+
+    def test_resumed(self):
+        lines = [make_record(x) for x in range(1, 6)]
+        import_posts(lines[:2], "test", batch_size=2)
+
+        checkpoint = import_posts(lines, "test", batch_size=2)
+
+        self.assertEquals(checkpoint.line, 5)
+        self.assertEquals(checkpoint.imported, 5)
+        self.assertEquals(PostArchive.get_current().total, 5)
+
+    def test_reimported(self):
+        import_posts([make_record(1)], "test")
+        import_posts([make_record(1, title=u"Renamed")], "test", restart=True)
+
+        self.assertIsNone(PostSlug.get_by_id("post-1"))
+        self.assertEquals(Post.get_by_slug("renamed").key.id(), 1)
+        self.assertEquals(PostArchive.get_current().total, 1)
+        self.assertEquals(TagIndex.make_key(u"python").get().count, 1)
+
+    def test_taken_slug_skipped(self):
+        Post(title=u"Post 1").put()
+
+        checkpoint = import_posts([make_record(1), make_record(2)], "test")
+
+        self.assertEquals((checkpoint.imported, checkpoint.skipped), (1, 1))
+        self.assertIsNone(Post.get_by_id(1))
+
+    def test_empty_slug_skipped(self):
+        checkpoint = import_posts(
+            [make_record(1, title=u"?!"), make_record(2)], "test")
+
+        self.assertEquals((checkpoint.imported, checkpoint.skipped), (1, 1))
+        self.assertIsNone(Post.get_by_id(1))
+
+
+class TestCommands(AppEngineTestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "posts.jsonl")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_round_trip(self):
+        Post(title=u"Post 1", body=u"Body", tags=[u"python"],
+             created_at=datetime.datetime(2014, 1, 1)).put()
+        call_command("export_posts", self.path)
+        self.clear_datastore()
+        memcache.flush_all()
+
+        call_command("import_posts", self.path, stdout=StringIO.StringIO())
+
+        post = Post.get_by_slug("post-1")
+        self.assertEquals(post.tags, [u"python"])
+        self.assertEquals(post.created_at, datetime.datetime(2014, 1, 1))
+        self.assertEquals(ImportCheckpoint.get_by_id("posts.jsonl").imported, 1)
+        self.assertEquals(search(u"body")[1], 1)
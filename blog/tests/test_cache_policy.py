@@ -0,0 +1,82 @@
+from django.core.urlresolvers import reverse
+from django.http import HttpResponse
+from django.test.client import RequestFactory
+from ndbtestcase import AppEngineTestCase
+
+from blog.middleware import CachePolicyMiddleware
+from blog.models import Post
+
+
+class TestCachePolicy(AppEngineTestCase):
+
+    def setUp(self):
+        self.post = Post(title=u"Post 1", body="Body")
+        self.post.put()
+
+    def test_anonymous_pages_public(self):
+        for url in [reverse("home"), reverse("blog"), self.post.url]:
+            response = self.client.get(url)
+
+            self.assertEquals(response["Cache-Control"], "public, max-age=60")
+            self.assertNotIn("Cookie", response.get("Vary", ""))
+
+    def test_not_modified_public(self):
+        response = self.client.get(self.post.url)
+        response = self.client.get(
+            self.post.url, HTTP_IF_NONE_MATCH=response["ETag"])
+
+        self.assertEquals(response.status_code, 304)
+        self.assertEquals(response["Cache-Control"], "public, max-age=60")
+
+    def test_logged_in_user_private(self):
+        self.users_login('someone@localhost', is_admin=False)
+        response = self.client.get(reverse("home"))
+
+        self.assertEquals(response["Cache-Control"], "private, max-age=0")
+
+    def test_missing_page_not_marked(self):
+        response = self.client.get(reverse("blog_post", args=["missing"]))
+
+        self.assertEquals(response.status_code, 404)
+        self.assertFalse(response.has_header("Cache-Control"))
+
+    def test_other_views_not_marked(self):
+        response = self.client.get(reverse("about_me"))
+
+        self.assertFalse(response.has_header("Cache-Control"))
+
+
+class TestCachePolicyMiddleware(AppEngineTestCase):
+
+    def setUp(self):
+        self.middleware = CachePolicyMiddleware()
+        self.request = RequestFactory().get("/")
+        self.response = HttpResponse()
+        self.response.public_cache_max_age = 60
+        self.response["Vary"] = "Accept-Encoding, Cookie"
+
+    def test_public(self):
+        response = self.middleware.process_response(self.request, self.response)
+
+        self.assertEquals(response["Cache-Control"], "public, max-age=60")
+        self.assertEquals(response["Vary"], "Accept-Encoding")
+
+    def test_csrf_token_rendered(self):
+        self.request.META["CSRF_COOKIE_USED"] = True
+        response = self.middleware.process_response(self.request, self.response)
+
+        self.assertEquals(response["Cache-Control"], "private, max-age=0")
+        self.assertEquals(response["Vary"], "Accept-Encoding, Cookie")
+
+    def test_session_accessed(self):
+        self.request.session = self.client.session
+        self.request.session.get("key")
+        response = self.middleware.process_response(self.request, self.response)
+
+        self.assertEquals(response["Cache-Control"], "private, max-age=0")
+
+    def test_cookie_set(self):
+        self.response.set_cookie("name", "value")
+        response = self.middleware.process_response(self.request, self.response)
+
+        self.assertEquals(response["Cache-Control"], "private, max-age=0")
@@ -0,0 +1,109 @@
+from django.core.urlresolvers import reverse
+from google.appengine.ext import ndb
+from ndbtestcase import AppEngineTestCase
+
+from blog.models import Post, PostCollection
+
+
+class TestPostConditionalGet(AppEngineTestCase):
+
+    def setUp(self):
+        self.post = Post(title=u"Post 1", body="Body")
+        self.post.put()
+
+    def test_headers_present(self):
+        response = self.client.get(self.post.url)
+
+        self.assertTrue(response.has_header("ETag"))
+        self.assertTrue(response.has_header("Last-Modified"))
+
+    def test_not_modified(self):
+        response = self.client.get(self.post.url)
+
+        response = self.client.get(
+            self.post.url, HTTP_IF_NONE_MATCH=response["ETag"])
+
+        self.assertEquals(response.status_code, 304)
+        self.assertEquals(response.content, "")
+
+    def test_not_modified_since(self):
+        response = self.client.get(self.post.url)
+
+        response = self.client.get(
+            self.post.url, HTTP_IF_MODIFIED_SINCE=response["Last-Modified"])
+
+        self.assertEquals(response.status_code, 304)
+
+    def test_modified(self):
+        response = self.client.get(self.post.url)
+
+        self.post.body = "New body"
+        self.post.put()
+        response = self.client.get(
+            self.post.url, HTTP_IF_NONE_MATCH=response["ETag"])
+
+        self.assertEquals(response.status_code, 200)
+
+    def test_logged_in_user(self):
+        response = self.client.get(self.post.url)
+
+        self.users_login('owner@localhost', is_admin=True)
+        response = self.client.get(
+            self.post.url, HTTP_IF_NONE_MATCH=response["ETag"])
+
+        self.assertEquals(response.status_code, 200)
+        self.assertFalse(response.has_header("ETag"))
+
+    def test_unexisting_post(self):
+        response = self.client.get(reverse("blog_post", args=["a-slug"]))
+
+        self.assertEquals(response.status_code, 404)
+        self.assertFalse(response.has_header("ETag"))
+
+
+class TestListConditionalGet(AppEngineTestCase):
+
+    def test_not_modified(self):
+        Post(title=u"Post 1").put()
+        for url in (reverse("home"), reverse("blog")):
+            response = self.client.get(url)
+
+            response = self.client.get(
+                url, HTTP_IF_NONE_MATCH=response["ETag"])
+
+            self.assertEquals(response.status_code, 304)
+
+    def test_new_post(self):
+        Post(title=u"Post 1").put()
+        for url in (reverse("home"), reverse("blog")):
+            response = self.client.get(url)
+
+            Post(title=u"Post for {}".format(url)).put()
+            response = self.client.get(
+                url, HTTP_IF_NONE_MATCH=response["ETag"])
+
+            self.assertEquals(response.status_code, 200)
+
+    def test_deleted_post(self):
+        post = Post(title=u"Post 1")
+        post.put()
+        response = self.client.get(reverse("home"))
+
+        post.delete()
+        response = self.client.get(
+            reverse("home"), HTTP_IF_NONE_MATCH=response["ETag"])
+
+        self.assertEquals(response.status_code, 200)
+
+    def test_incomplete_list_not_tagged(self):
+        Post(title=u"Post 1").put()
+        # A write the queries don't see (yet)
+        ndb.transaction(PostCollection.touch)
+
+        for url in (reverse("home"), reverse("blog")):
+            response = self.client.get(url)
+
+            self.assertContains(response, "Post 1")
+            self.assertFalse(response.has_header("ETag"))
+            self.assertFalse(response.has_header("Last-Modified"))
+            self.assertNotIn("public", response.get("Cache-Control", ""))
@@ -0,0 +1,135 @@
+from django.core.urlresolvers import reverse
+from django.test.utils import override_settings
+from google.appengine.api import memcache
+from google.appengine.ext import testbed
+from ndbtestcase import AppEngineTestCase
+
+from blog.counters import buffer_key, flush_views
+from blog.models import Post, PopularPosts, PostViews
+
+
+class TestViewCounters(AppEngineTestCase):
+
+    def setUp(self):
+        self.post = Post(title=u"Post 1", body="Body")
+        self.post.put()
+
+    def view(self, post, times=1):
+        for _ in range(times):
+            self.client.get(post.url)
+
+    def test_view_buffered(self):
+        self.view(self.post, 2)
+
+        self.assertEquals(memcache.get(buffer_key(self.post.key.id())), 2)
+        self.assertIsNone(PostViews.get_by_id(self.post.key.id()))
+
+    def test_views_flushed(self):
+        self.view(self.post, 3)
+        self.run_deferred_tasks()
+
+        self.assertEquals(PostViews.get_by_id(self.post.key.id()).count, 3)
+        self.assertFalse(memcache.get(buffer_key(self.post.key.id())))
+
+    def test_views_added_to_total(self):
+        self.view(self.post, 3)
+        flush_views(self.post.key.id())
+        self.view(self.post, 2)
+        flush_views(self.post.key.id())
+
+        self.assertEquals(PostViews.get_by_id(self.post.key.id()).count, 5)
+        self.assertFalse(memcache.get(buffer_key(self.post.key.id())))
+
+    def test_views_shown(self):
+        self.view(self.post, 2)
+        self.run_deferred_tasks()
+
+        response = self.client.get(self.post.url)
+
+        self.assertContains(response, "Read 2 times.")
+
+    def test_cached_page_changes_with_views(self):
+        response = self.client.get(self.post.url)
+        self.run_deferred_tasks()
+        self.view(self.post, 2)
+        self.run_deferred_tasks()
+
+        response = self.client.get(
+            self.post.url, HTTP_IF_NONE_MATCH=response["ETag"])
+
+        self.assertEquals(response.status_code, 200)
+        self.assertContains(response, "Read 3 times.")
+
+    def test_missing_post_not_counted(self):
+        # Indexing of the post
+        self.run_deferred_tasks()
+        self.client.get(reverse("blog_post", args=["missing"]))
+
+        taskqueue = self.testbed.get_stub(testbed.TASKQUEUE_SERVICE_NAME)
+        self.assertEquals(taskqueue.GetTasks("default"), [])
+
+
+class TestPopularPosts(AppEngineTestCase):
+
+    def setUp(self):
+        self.post1 = Post(title=u"Post 1")
+        self.post1.put()
+        self.post2 = Post(title=u"Post 2")
+        self.post2.put()
+
+    def view(self, post, times=1):
+        for _ in range(times):
+            self.client.get(post.url)
+        self.run_deferred_tasks()
+
+    def popular_titles(self):
+        return [post.title for post in PopularPosts.get_current().posts]
+
+    def test_most_read_first(self):
+        self.view(self.post1)
+        self.view(self.post2, 2)
+
+        self.assertEquals(self.popular_titles(), [u"Post 2", u"Post 1"])
+
+    def test_version_changes_with_order(self):
+        self.view(self.post1, 2)
+        self.view(self.post2)
+        version = PopularPosts.get_current().version
+
+        self.view(self.post1)
+        self.assertEquals(PopularPosts.get_current().version, version)
+
+        self.view(self.post2, 3)
+        self.assertNotEquals(PopularPosts.get_current().version, version)
+
+    @override_settings(BLOG_POPULAR_POSTS=1)
+    def test_size_limited(self):
+        self.view(self.post1)
+        self.view(self.post2, 2)
+
+        self.assertEquals(self.popular_titles(), [u"Post 2"])
+
+    def test_renamed_post(self):
+        self.view(self.post1)
+
+        self.post1.title = u"New title"
+        self.post1.put()
+
+        popular = PopularPosts.get_current().posts
+        self.assertEquals(popular[0].title, u"New title")
+        self.assertEquals(popular[0].slug, "new-title")
+
+    def test_deleted_post(self):
+        self.view(self.post1)
+
+        self.post1.delete()
+
+        self.assertEquals(self.popular_titles(), [])
+
+    def test_listed_on_home_page(self):
+        self.view(self.post2)
+
+        response = self.client.get(reverse("home"))
+
+        self.assertContains(response, 'id="popular_posts"')
+        self.assertContains(response, self.post2.url)
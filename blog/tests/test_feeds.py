@@ -0,0 +1,83 @@
+from django.core.urlresolvers import reverse
+from django.test.utils import override_settings
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+from ndbtestcase import AppEngineTestCase
+
+from blog.feeds import feed_cache_key
+from blog.models import Post, PostCollection
+
+
+class TestFeed(AppEngineTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.url = reverse("blog_feed")
+
+    def test_latest_posts(self):
+        Post(title=u"Post 1", body=u"Body 1").put()
+        post = Post(title=u"Post 2", body=u"Body 2")
+        post.put()
+
+        response = self.client.get(self.url)
+
+        self.assertEquals(response["Content-Type"], "application/atom+xml; charset=utf-8")
+        self.assertContains(response, "<title>Post 2</title>")
+        # Rendered HTML, escaped in the XML
+        self.assertContains(response, "&lt;p&gt;Body 1&lt;/p&gt;")
+        self.assertContains(response, "http://testserver" + post.url)
+
+    @override_settings(BLOG_FEED_SIZE=2)
+    def test_feed_size(self):
+        for x in range(3):
+            Post(title=u"Post -{}-".format(x)).put()
+
+        response = self.client.get(self.url)
+
+        self.assertNotContains(response, "Post -0-")
+        self.assertContains(response, "Post -2-")
+
+    def test_cached(self):
+        Post(title=u"Post 1").put()
+        self.client.get(self.url)
+
+        version = PostCollection.get_current().version
+        key = feed_cache_key(version, "http://testserver/")
+        memcache.set(key, "cached feed")
+
+        response = self.client.get(self.url)
+        self.assertEquals(response.content, "cached feed")
+
+    def test_invalidated_by_new_post(self):
+        Post(title=u"Post 1").put()
+        self.client.get(self.url)
+        Post(title=u"Post 2").put()
+
+        response = self.client.get(self.url)
+
+        self.assertContains(response, "Post 2")
+
+    def test_not_modified(self):
+        Post(title=u"Post 1").put()
+        response = self.client.get(self.url)
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEquals(response.status_code, 304)
+
+        response = self.client.get(
+            self.url, HTTP_IF_MODIFIED_SINCE=response["Last-Modified"])
+        self.assertEquals(response.status_code, 304)
+
+    def test_incomplete_feed_not_kept(self):
+        Post(title=u"Post 1").put()
+        # A write the query doesn't see (yet)
+        ndb.transaction(PostCollection.touch)
+
+        response = self.client.get(self.url)
+
+        self.assertContains(response, "Post 1")
+        self.assertFalse(response.has_header("ETag"))
+        self.assertFalse(response.has_header("Last-Modified"))
+        key = feed_cache_key(
+            PostCollection.get_current().version, "http://testserver/")
+        self.assertIsNone(memcache.get(key))
@@ -1,4 +1,5 @@
 from django.core.urlresolvers import reverse
+from django.test.utils import override_settings
 from ndbtestcase import AppEngineTestCase
 
 from blog.models import Post
@@ -108,7 +109,7 @@ class TestBlogPage(TestHomePage):
 
     def test_visible_posts(self):
         """
-        On blog page show all posts
+        On blog page show all posts, page by page
         """
 
         # choose titles that are predictible and easy to verify
@@ -122,5 +123,48 @@ class TestBlogPage(TestHomePage):
 
         response = self.client.get(self.url)
 
-        for title in titles:
+        for title in titles[5:]:
+            self.assertContains(response, title)
+        for title in titles[:5]:
+            self.assertNotContains(response, title)
+
+        self.assertEquals(response.context["prev_cursor"], None)
+        self.assertNotContains(response, "Newer posts")
+        self.assertContains(response, "Older posts")
+
+        # Second (last) page
+        next_cursor = response.context["next_cursor"]
+        response = self.client.get(self.url, {"after": next_cursor})
+
+        for title in titles[:5]:
             self.assertContains(response, title)
+        for title in titles[5:]:
+            self.assertNotContains(response, title)
+
+        self.assertEquals(response.context["next_cursor"], None)
+        self.assertContains(response, "Newer posts")
+        self.assertNotContains(response, "Older posts")
+
+        # And back to the first one
+        prev_cursor = response.context["prev_cursor"]
+        response = self.client.get(self.url, {"before": prev_cursor})
+
+        for title in titles[5:]:
+            self.assertContains(response, title)
+        for title in titles[:5]:
+            self.assertNotContains(response, title)
+
+    @override_settings(BLOG_PAGE_SIZE=2)
+    def test_page_size(self):
+        for x in xrange(3):
+            Post(title=u"Post -{}-".format(x)).put()
+
+        response = self.client.get(self.url)
+
+        self.assertEquals(len(response.context["posts"]), 2)
+        self.assertNotContains(response, "Post -0-")
+
+    def test_incorrect_cursor(self):
+        response = self.client.get(self.url, {"after": "not a cursor"})
+
+        self.assertEquals(response.status_code, 404)
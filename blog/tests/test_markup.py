@@ -0,0 +1,98 @@
+import unittest
+
+from ndbtestcase import AppEngineTestCase
+
+from blog import markup
+from blog.markup import render, render_plain, RENDERER_VERSION
+from blog.migrations import RerenderPostsMapper
+from blog.models import Post, PostCollection, PostSlug
+
+
+class TestPlainRenderer(AppEngineTestCase):
+
+    def test_paragraphs(self):
+        self.assertEquals(
+            render_plain(u"First\nline\n\nSecond"),
+            u"<p>First<br>line</p>\n<p>Second</p>")
+
+    def test_escaped(self):
+        self.assertEquals(
+            render_plain(u"<script>"), u"<p>&lt;script&gt;</p>")
+
+    def test_fenced_code(self):
+        self.assertEquals(
+            render_plain(u"```python\nif a < b:\n\n    pass\n```"),
+            u'<pre><code class="language-python">if a &lt; b:\n\n    pass</code></pre>')
+
+    def test_unclosed_fence(self):
+        self.assertEquals(
+            render_plain(u"```\ncode"), u"<pre><code>code</code></pre>")
+
+
+class TestRender(AppEngineTestCase):
+
+    @unittest.skipIf(markup.markdown is None, "markdown is not installed")
+    def test_markdown(self):
+        html, version = render(u"Some *markdown*")
+
+        self.assertEquals(html, u"<p>Some <em>markdown</em></p>")
+
+    @unittest.skipIf(markup.markdown is None, "markdown is not installed")
+    def test_markdown_html_escaped(self):
+        html, version = render(u"<div>Block</div>\n\nSome <b>inline</b>")
+
+        self.assertNotIn(u"<div>", html)
+        self.assertNotIn(u"<b>", html)
+        self.assertIn(u"&lt;b&gt;inline&lt;/b&gt;", html)
+
+    def test_long_body_rendered_plain(self):
+        body = u"*long* " * markup.MARKDOWN_MAX_LENGTH
+
+        html, version = render(body)
+
+        self.assertTrue(html.startswith(u"<p>*long*"))
+
+    def test_rendered_on_put(self):
+        post = Post(title=u"Post 1", body=u"<b>")
+        post.put()
+
+        post = post.key.get()
+        self.assertIn(u"&lt;b&gt;", post.body_html)
+        self.assertEquals(post.renderer_version, RENDERER_VERSION)
+
+    def test_html_shown(self):
+        post = Post(title=u"Post 1", body=u"First\n\nSecond")
+        post.put()
+
+        response = self.client.get(post.url)
+
+        self.assertContains(response, u"<p>Second</p>")
+
+    def test_raw_body_kept_for_editing(self):
+        post = Post(title=u"Post 1", body=u"Some *markdown*")
+        post.put()
+
+        response = self.client.get(post.url)
+
+        self.assertContains(response, u'data-value="Some *markdown*"')
+
+    def test_rerendered_by_mapper(self):
+        post = Post(title=u"Post 1", body=u"Body")
+        post.put()
+        post.body_html = u"old"
+        post.renderer_version = u"0-old"
+        super(Post, post)._put()
+        collection_version = PostCollection.get_current().version
+
+        RerenderPostsMapper().start()
+        self.run_deferred_tasks()
+
+        rendered = post.key.get()
+        self.assertEquals(rendered.renderer_version, RENDERER_VERSION)
+        self.assertNotEquals(rendered.body_html, u"old")
+        # What the post says didn't change
+        self.assertEquals(rendered.updated_at, post.updated_at)
+        # Its page and lists did
+        self.assertEquals(rendered.version, post.version + 1)
+        self.assertEquals(PostSlug.get_by_id(post.slug).version, rendered.version)
+        self.assertEquals(PostCollection.get_current().version, collection_version + 1)
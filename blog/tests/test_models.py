@@ -1,6 +1,15 @@
+import datetime
+
+from appengine_sessions.models import MapperJob
+from google.appengine.ext import ndb
 from ndbtestcase import AppEngineTestCase
 
-from blog.models import Post
+from blog.migrations import ReindexPostsMapper
+from blog.models import (
+    Post, PostArchive, PostCollection, PostSlug, PostSummary,
+    DuplicateSlugError
+)
+from blog.search import search
 
 
 class TestPostModel(AppEngineTestCase):
@@ -13,6 +22,14 @@ class TestPostModel(AppEngineTestCase):
 
         self.assertEquals(by_slug, post)
 
+    def test_post_by_slug_async(self):
+        post = Post(title=u"New post")
+        post.put()
+
+        future = Post.get_by_slug_async("new-post")
+
+        self.assertEquals(future.get_result(), post)
+
     def test_post_by_slug_no_slug(self):
         by_slug = Post.get_by_slug(None)
 
@@ -24,9 +41,162 @@ class TestPostModel(AppEngineTestCase):
         self.assertEquals(by_slug, None)
 
     def test_post_by_slug_duplidate_post(self):
-        Post(title=u"New post").put()
-        Post(title=u"New post").put()
+        post = Post(title=u"New post")
+        post.put()
+
+        self.assertRaises(DuplicateSlugError, Post(title=u"New post").put)
 
         by_slug = Post.get_by_slug("new-post")
 
-        self.assertEquals(by_slug, None)
+        self.assertEquals(by_slug, post)
+        self.assertEquals(Post.query().count(), 1)
+
+    def test_post_by_slug_after_title_change(self):
+        post = Post(title=u"New post")
+        post.put()
+
+        post.title = u"Renamed post"
+        post.put()
+
+        self.assertEquals(Post.get_by_slug("new-post"), None)
+        self.assertEquals(Post.get_by_slug("renamed-post"), post)
+
+    def test_post_by_slug_after_delete(self):
+        post = Post(title=u"New post")
+        post.put()
+
+        post.delete()
+
+        self.assertEquals(Post.get_by_slug("new-post"), None)
+        self.assertEquals(PostSlug.get_by_id("new-post"), None)
+
+    def test_post_without_slug_deleted(self):
+        post = Post(title=u"?!")
+        post.put()
+
+        post.delete()
+
+        self.assertIsNone(post.key.get())
+        self.assertIsNone(PostSummary.get_by_id(post.key.id()))
+
+    def test_reindex_backfills_slug_index(self):
+        post = Post(title=u"New post")
+        post.put()
+        ndb.Key(PostSlug, "new-post").delete()
+
+        job = ReindexPostsMapper().start()
+        self.run_deferred_tasks()
+
+        self.assertEquals(Post.get_by_slug("new-post"), post)
+
+        job = job.key.get()
+        self.assertEquals(job.status, MapperJob.DONE)
+        self.assertEquals(job.result["reindexed"], 1)
+        self.assertEquals(job.result["duplicates"], 0)
+
+    def test_reindex_backfills_stored_post(self):
+        # Stored before slug indexes, summaries, the archive and search
+        post = Post(title=u"Old post", body=u"Unusual words",
+                    created_at=datetime.datetime(2013, 5, 1))
+        super(Post, post)._put()
+
+        ReindexPostsMapper().start()
+        self.run_deferred_tasks()
+
+        self.assertEquals(Post.get_by_slug("old-post").key, post.key)
+        self.assertEquals(
+            PostSummary.get_by_id(post.key.id()).title, u"Old post")
+        stored = post.key.get()
+        self.assertEquals(stored.updated_at, post.created_at)
+        self.assertEquals(stored.version, post.version)
+        archive = PostArchive.get_current()
+        self.assertEquals(archive.total, 1)
+        self.assertEquals(archive.get_month(2013, 5).count, 1)
+        summaries, total = search(u"unusual")
+        self.assertEquals(total, 1)
+        # Changed once, not once per post
+        self.assertEquals(PostCollection.get_current().version, 1)
+
+    def test_reindex_keeps_updated_at(self):
+        post = Post(title=u"New post")
+        post.put()
+        updated_at = post.updated_at
+        version = post.version
+
+        ReindexPostsMapper().start()
+        self.run_deferred_tasks()
+
+        stored = post.key.get()
+        self.assertEquals(stored.updated_at, updated_at)
+        self.assertEquals(stored.version, version)
+        self.assertEquals(PostArchive.get_current().total, 1)
+
+    def test_version_changes_with_post(self):
+        post = Post(title=u"New post")
+        post.put()
+        self.assertEquals(post.version, 1)
+
+        post.put()
+        self.assertEquals(post.version, 2)
+        self.assertEquals(PostSlug.get_by_id("new-post").version, 2)
+
+    def test_collection_version_changes(self):
+        post = Post(title=u"New post")
+        post.put()
+        self.assertEquals(PostCollection.get_current().version, 1)
+
+        post.delete()
+        self.assertEquals(PostCollection.get_current().version, 2)
+
+
+class TestPostCollection(AppEngineTestCase):
+
+    def test_complete_with_last_write(self):
+        post = Post(title=u"New post")
+        post.put()
+        collection = PostCollection.get_current()
+
+        self.assertTrue(collection.is_complete([post]))
+        self.assertFalse(collection.is_complete([]))
+
+    def test_complete_after_delay(self):
+        delay = datetime.timedelta(seconds=PostCollection.CONSISTENCY_DELAY + 1)
+        collection = PostCollection(
+            updated_at=datetime.datetime.utcnow() - delay)
+
+        self.assertTrue(collection.is_complete([]))
+        self.assertTrue(PostCollection().is_complete([]))
+
+
+class TestPostSummary(AppEngineTestCase):
+
+    def test_summary_stored_with_post(self):
+        post = Post(title=u"New post", author="Owner", body="ABC " * 123)
+        post.put()
+
+        summary = PostSummary.get_by_id(post.key.id())
+
+        self.assertEquals(summary.title, post.title)
+        self.assertEquals(summary.author, post.author)
+        self.assertEquals(summary.created_at, post.created_at)
+        self.assertEquals(summary.url, post.url)
+        self.assertEquals(len(summary.excerpt), 100)
+        self.assertTrue(summary.excerpt.endswith("..."))
+
+    def test_summary_updated_with_post(self):
+        post = Post(title=u"New post", body="short body")
+        post.put()
+
+        post.body = "new body"
+        post.put()
+
+        summary = PostSummary.get_by_id(post.key.id())
+        self.assertEquals(summary.excerpt, "new body")
+
+    def test_summary_deleted_with_post(self):
+        post = Post(title=u"New post")
+        post.put()
+
+        post.delete()
+
+        self.assertEquals(PostSummary.query().count(), 0)
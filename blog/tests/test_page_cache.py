@@ -0,0 +1,103 @@
+from django.core.urlresolvers import reverse
+from google.appengine.ext import ndb
+from ndbtestcase import AppEngineTestCase
+
+from blog.cache import bump_generation, get_generation
+from blog.models import Post, PostCollection, PostSummary
+
+
+class TestPageCache(AppEngineTestCase):
+
+    def test_anonymous_page_cached(self):
+        post = Post(title=u"Post 1")
+        post.put()
+        self.client.get(reverse("home"))
+
+        # Not visible until the generation changes
+        ndb.Key(PostSummary, post.key.id()).delete()
+        response = self.client.get(reverse("home"))
+
+        self.assertContains(response, "Post 1")
+
+        bump_generation()
+        response = self.client.get(reverse("home"))
+
+        self.assertNotContains(response, "Post 1")
+
+    def test_incomplete_page_not_cached(self):
+        post = Post(title=u"Post 1")
+        post.put()
+        # A write the query doesn't see (yet)
+        ndb.transaction(PostCollection.touch)
+        self.client.get(reverse("blog"))
+
+        ndb.Key(PostSummary, post.key.id()).delete()
+        response = self.client.get(reverse("blog"))
+
+        self.assertNotContains(response, "Post 1")
+
+    def test_post_change_invalidates_pages(self):
+        Post(title=u"Post 1").put()
+        self.client.get(reverse("home"))
+
+        Post(title=u"Post 2").put()
+        response = self.client.get(reverse("home"))
+
+        self.assertContains(response, "Post 2")
+
+    def test_pages_cached_separately(self):
+        post = Post(title=u"Post 1", body="Body of post 1")
+        post.put()
+
+        self.client.get(reverse("home"))
+        response = self.client.get(post.url)
+
+        self.assertContains(response, "Body of post 1")
+
+    def test_logged_in_user_not_cached(self):
+        self.users_login('someone@localhost', is_admin=False)
+        post = Post(title=u"Post 1")
+        post.put()
+        self.client.get(reverse("home"))
+
+        ndb.Key(PostSummary, post.key.id()).delete()
+        response = self.client.get(reverse("home"))
+
+        self.assertNotContains(response, "Post 1")
+
+    def test_admin_page_not_leaked(self):
+        self.users_login('owner@localhost', is_admin=True)
+        Post(title=u"Post 1").put()
+        self.client.get(reverse("home"))
+
+        self.users_login('', is_admin=False)
+        response = self.client.get(reverse("home"))
+
+        self.assertNotContains(response, "Add post")
+
+    def test_not_found_not_cached(self):
+        url = reverse("blog_post", args=["post-1"])
+        self.client.get(url)
+
+        Post(title=u"Post 1").put()
+        response = self.client.get(url)
+
+        self.assertEquals(response.status_code, 200)
+
+    def test_new_post_bumps_generation(self):
+        self.users_login('owner@localhost', is_admin=True)
+        generation = get_generation()
+
+        self.client.post(reverse("new_post"), {"title": "A", "body": "B"})
+
+        self.assertNotEquals(get_generation(), generation)
+
+    def test_deleted_post_bumps_generation(self):
+        self.users_login('owner@localhost', is_admin=True)
+        post = Post(title=u"Post 1")
+        post.put()
+        generation = get_generation()
+
+        self.client.delete(post.url)
+
+        self.assertNotEquals(get_generation(), generation)
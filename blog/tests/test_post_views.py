@@ -147,6 +147,19 @@ class TestCreatePostApi(AppEngineTestCase):
         self.assertContains(response, "Title is required", status_code=400)
         self.assertContains(response, "Body is required", status_code=400)
 
+    def test_duplicate_title(self):
+        self.users_login('owner@localhost', is_admin=True)
+        Post(title=u"Some title").put()
+        data = {
+            "title": "some title",
+            "body": "some body",
+        }
+
+        response = self.client.post(self.url, data)
+
+        self.assertEquals(response.status_code, 400)
+        self.assertEquals(Post.query().count(), 1)
+
 
 class TestUpdatePostApi(AppEngineTestCase):
 
@@ -202,6 +215,19 @@ class TestUpdatePostApi(AppEngineTestCase):
         self.assertContains(response, "Written by owner2@localhost")
         self.assertEquals(updated_post.created_at, self.post.created_at)
 
+    def test_admin_user_duplicate_title(self):
+        self.users_login('owner@localhost', is_admin=True)
+        Post(title=u"Other post").put()
+        data = {
+            "title": "other post",
+            "body": "ABC",
+        }
+
+        response = self.client.post(self.post.url, data)
+
+        self.assertEquals(response.status_code, 400)
+        self.assertEquals(Post.get_by_slug(self.post.slug).title, self.post.title)
+
     def test_admin_user_incorrect_url(self):
         self.users_login('owner@localhost', is_admin=True)
         data = {
@@ -0,0 +1,46 @@
+from django.core.urlresolvers import reverse
+from google.appengine.api import memcache
+from ndbtestcase import AppEngineTestCase
+
+from blog.middleware import rpc_header_name
+from blog.models import Post
+from lib import rpcstats
+
+
+class TestRPCAccounting(AppEngineTestCase):
+
+    def setUp(self):
+        self.post = Post(title=u"Post 1", body="Body")
+        self.post.put()
+
+    def test_admin_gets_headers(self):
+        self.users_login('owner@localhost', is_admin=True)
+        memcache.flush_all()
+        response = self.client.get(self.post.url)
+
+        self.assertGreater(int(response["X-RPC-Calls"]), 0)
+        self.assertGreater(int(response["X-RPC-Datastore-V3"]), 0)
+        self.assertIn("reads=", response["X-RPC-Ops"])
+        self.assertTrue(response["X-RPC-Time"].endswith("ms"))
+
+    def test_no_headers_for_others(self):
+        for url in [reverse("home"), self.post.url]:
+            response = self.client.get(url)
+
+            self.assertFalse(response.has_header("X-RPC-Calls"))
+
+        self.users_login('someone@localhost', is_admin=False)
+        response = self.client.get(reverse("home"))
+
+        self.assertFalse(response.has_header("X-RPC-Calls"))
+
+    def test_outer_recording_counts_request(self):
+        with rpcstats.recording() as stats:
+            self.client.get(reverse("home"))
+
+        self.assertGreater(stats.total_calls, 0)
+        self.assertIsNone(rpcstats.current())
+
+    def test_header_names(self):
+        self.assertEquals(rpc_header_name("datastore_v3"), "X-RPC-Datastore-V3")
+        self.assertEquals(rpc_header_name("memcache"), "X-RPC-Memcache")
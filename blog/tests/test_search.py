@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+from django.core.urlresolvers import reverse
+from django.test.utils import override_settings
+from google.appengine.ext import ndb
+from ndbtestcase import AppEngineTestCase
+
+from blog.models import Post, SearchDocument, SearchStats
+from blog.search import (
+    decode_postings, encode_postings, index_post, search, term_key, tokenize,
+    SHARD_COUNT
+)
+
+
+class TestTokenize(AppEngineTestCase):
+
+    def test_folded(self):
+        self.assertEquals(
+            tokenize(u"Zażółć Gęślą Jaźń!"),
+            ["zazoc", "gesla", "jazn"])
+
+    def test_short_terms_skipped(self):
+        self.assertEquals(tokenize(u"a cat, a dog"), ["cat", "dog"])
+
+    def test_empty(self):
+        self.assertEquals(tokenize(None), [])
+
+
+class TestPostings(AppEngineTestCase):
+
+    def test_round_trip(self):
+        postings = [(3, 1, 10), (200, 2, 5), (5629499534213120, 300, 70000)]
+
+        self.assertEquals(decode_postings(encode_postings(postings)), postings)
+
+    def test_compact(self):
+        postings = [(1000 + i, 1, 100) for i in range(100)]
+
+        self.assertLess(len(encode_postings(postings)), 4 * len(postings) + 2)
+
+    def test_empty(self):
+        self.assertEquals(decode_postings(None), [])
+
+
+class TestIndex(AppEngineTestCase):
+
+    def make_post(self, title, body=""):
+        post = Post(title=title, body=body)
+        post.put()
+        self.run_deferred_tasks()
+        return post
+
+    def postings(self, term):
+        postings = []
+        for shard in ndb.get_multi([term_key(term, s) for s in range(SHARD_COUNT)]):
+            postings.extend(decode_postings(shard.postings) if shard else [])
+        return postings
+
+    def test_post_indexed(self):
+        post = self.make_post(u"Apples", u"Apples and pears")
+
+        self.assertEquals(self.postings("apples"), [(post.key.id(), 2, 4)])
+        self.assertEquals(self.postings("pears"), [(post.key.id(), 1, 4)])
+
+        stats = SearchStats.get_current()
+        self.assertEquals((stats.documents, stats.length), (1, 4))
+
+    def test_post_reindexed(self):
+        post = self.make_post(u"Apples", u"Apples and pears")
+        post.body = u"Plums"
+        post.put()
+        self.run_deferred_tasks()
+
+        self.assertEquals(self.postings("pears"), [])
+        self.assertEquals(self.postings("apples"), [(post.key.id(), 1, 2)])
+        self.assertEquals(SearchStats.get_current().length, 2)
+
+    def test_indexing_idempotent(self):
+        post = self.make_post(u"Apples", u"Apples and pears")
+        index_post(post.key.id())
+
+        self.assertEquals(self.postings("apples"), [(post.key.id(), 2, 4)])
+        self.assertEquals(SearchStats.get_current().documents, 1)
+
+    def test_deleted_post_removed(self):
+        post = self.make_post(u"Apples")
+        post.delete()
+        self.run_deferred_tasks()
+
+        self.assertEquals(self.postings("apples"), [])
+        self.assertIsNone(SearchDocument.get_by_id(post.key.id()))
+        self.assertEquals(SearchStats.get_current().documents, 0)
+
+
+class TestSearch(AppEngineTestCase):
+
+    def make_post(self, title, body=""):
+        post = Post(title=title, body=body)
+        post.put()
+        return post
+
+    def test_ranked(self):
+        self.make_post(u"Cooking", u"Soup with a little garlic")
+        best = self.make_post(u"Garlic", u"Garlic bread with more garlic")
+        self.make_post(u"Gardening", u"Nothing to see")
+        self.run_deferred_tasks()
+
+        posts, total = search(u"garlic")
+
+        self.assertEquals(total, 2)
+        self.assertEquals(posts[0].key.id(), best.key.id())
+
+    def test_folded_query(self):
+        post = self.make_post(u"Crème brûlée")
+        self.run_deferred_tasks()
+
+        posts, total = search(u"CREME")
+
+        self.assertEquals([p.key.id() for p in posts], [post.key.id()])
+
+    def test_paged(self):
+        for i in range(5):
+            self.make_post(u"Post {}".format(i), u"Words " * (i + 1))
+        self.run_deferred_tasks()
+
+        first, total = search(u"words", 0, 3)
+        second, total = search(u"words", 3, 3)
+
+        self.assertEquals(total, 5)
+        self.assertEquals((len(first), len(second)), (3, 2))
+        self.assertFalse(set(p.key for p in first) & set(p.key for p in second))
+
+    def test_no_terms(self):
+        self.assertEquals(search(u"?!"), ([], 0))
+
+
+class TestSearchView(AppEngineTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.url = reverse("search")
+
+    @override_settings(BLOG_PAGE_SIZE=2)
+    def test_results_paged(self):
+        for i in range(3):
+            Post(title=u"Recipe {}".format(i)).put()
+        Post(title=u"Other").put()
+        self.run_deferred_tasks()
+
+        response = self.client.get(self.url, {"q": "recipe"})
+
+        self.assertContains(response, "3 posts found.")
+        self.assertEquals(len(response.context["posts"]), 2)
+        self.assertEquals(response.context["next_page"], 2)
+        self.assertNotContains(response, "Other")
+
+        response = self.client.get(self.url, {"q": "recipe", "page": 2})
+        self.assertEquals(len(response.context["posts"]), 1)
+        self.assertEquals(response.context["prev_page"], 1)
+        self.assertIsNone(response.context["next_page"])
+
+    def test_invalid_page(self):
+        response = self.client.get(self.url, {"q": "recipe", "page": "x"})
+
+        self.assertEquals(response.status_code, 404)
+
+    def test_not_modified(self):
+        response = self.client.get(self.url, {"q": "recipe"})
+
+        response = self.client.get(
+            self.url, {"q": "recipe"}, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEquals(response.status_code, 304)
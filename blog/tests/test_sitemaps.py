@@ -0,0 +1,79 @@
+import datetime
+
+from django.core.urlresolvers import reverse
+from django.test.utils import override_settings
+from ndbtestcase import AppEngineTestCase
+
+from blog import sitemaps
+from blog.models import Post, PostArchive, PostSummary
+
+
+def make_post(title, created_at):
+    post = Post(title=title, created_at=created_at)
+    post.put()
+    return post
+
+
+class TestSitemap(AppEngineTestCase):
+
+    def setUp(self):
+        self.posts = [
+            make_post(u"January", datetime.datetime(2014, 1, 5)),
+            make_post(u"February", datetime.datetime(2014, 2, 5)),
+            make_post(u"March", datetime.datetime(2014, 3, 5)),
+        ]
+
+    def tearDown(self):
+        sitemaps.URL_LIMIT = 50000
+
+    @override_settings(SITEMAP_BATCH_SIZE=2)
+    def test_all_posts_listed(self):
+        response = self.client.get(reverse("sitemap"))
+
+        self.assertEquals(response["Content-Type"], sitemaps.CONTENT_TYPE)
+        self.assertContains(response, "<urlset")
+        self.assertContains(response, "<loc>http://testserver/about_me/</loc>")
+        for post in self.posts:
+            self.assertContains(
+                response, "<loc>http://testserver{}</loc>".format(post.url))
+
+    def test_cached(self):
+        self.client.get(reverse("sitemap"))
+        # Not seen until posts change
+        PostSummary.query().get().key.delete()
+
+        response = self.client.get(reverse("sitemap"))
+
+        self.assertContains(response, "<url>", 6)
+
+    def test_invalidated_by_post_change(self):
+        self.client.get(reverse("sitemap"))
+        post = make_post(u"April", datetime.datetime(2014, 4, 5))
+
+        response = self.client.get(reverse("sitemap"))
+
+        self.assertContains(response, post.url)
+
+    def test_split_sections(self):
+        sections = sitemaps.split_sections(PostArchive.get_current(), limit=5)
+
+        self.assertEquals(sections, [
+            (None, datetime.datetime(2014, 3, 1)),
+            (datetime.datetime(2014, 3, 1), None),
+        ])
+
+    def test_index(self):
+        sitemaps.URL_LIMIT = 5
+
+        response = self.client.get(reverse("sitemap"))
+        self.assertContains(response, "<sitemapindex")
+        self.assertContains(response, reverse("sitemap_section", args=[1]))
+        self.assertNotContains(response, reverse("sitemap_section", args=[2]))
+
+        response = self.client.get(reverse("sitemap_section", args=[1]))
+        self.assertContains(response, self.posts[2].url)
+        self.assertNotContains(response, self.posts[0].url)
+        self.assertNotContains(response, "about_me")
+
+        response = self.client.get(reverse("sitemap_section", args=[2]))
+        self.assertEquals(response.status_code, 404)
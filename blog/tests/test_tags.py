@@ -0,0 +1,133 @@
+import datetime
+
+from django.core.urlresolvers import reverse
+from django.test.utils import override_settings
+from ndbtestcase import AppEngineTestCase
+
+from blog.forms import PostForm
+from blog.models import Post, TagCloud, TagIndex, normalize_tags
+
+
+class TestTagIndex(AppEngineTestCase):
+
+    def cloud(self):
+        return [(tag.name, tag.count) for tag in TagCloud.get_current().tags]
+
+    def test_tags_normalized(self):
+        self.assertEquals(
+            normalize_tags([u"Google App Engine", u" python", u"Python", u""]),
+            [u"google-app-engine", u"python"])
+
+    def test_post_indexed(self):
+        post1 = Post(title=u"Post 1", tags=[u"python", u"ndb"])
+        post1.put()
+        post2 = Post(title=u"Post 2", tags=[u"python"])
+        post2.put()
+
+        index = TagIndex.make_key(u"python").get()
+        self.assertEquals(index.count, 2)
+        self.assertEquals(
+            [p.post_id for p in index.posts], [post2.key.id(), post1.key.id()])
+        self.assertEquals(self.cloud(), [(u"ndb", 1), (u"python", 2)])
+
+    def test_tags_changed(self):
+        post = Post(title=u"Post 1", tags=[u"python", u"ndb"])
+        post.put()
+        post.tags = [u"python", u"django"]
+        post.put()
+
+        self.assertIsNone(TagIndex.make_key(u"ndb").get())
+        self.assertEquals(TagIndex.make_key(u"python").get().count, 1)
+        self.assertEquals(self.cloud(), [(u"django", 1), (u"python", 1)])
+
+    def test_post_deleted(self):
+        post1 = Post(title=u"Post 1", tags=[u"python"])
+        post1.put()
+        post2 = Post(title=u"Post 2", tags=[u"python", u"ndb"])
+        post2.put()
+        post2.delete()
+
+        index = TagIndex.make_key(u"python").get()
+        self.assertEquals([p.post_id for p in index.posts], [post1.key.id()])
+        self.assertEquals(self.cloud(), [(u"python", 1)])
+
+    def test_older_post_sorted(self):
+        post1 = Post(title=u"Post 1", tags=[u"python"])
+        post1.put()
+        post2 = Post(title=u"Post 2")
+        post2.put()
+        post2.created_at = post1.created_at - datetime.timedelta(days=1)
+        post2.tags = [u"python"]
+        post2.put()
+
+        index = TagIndex.make_key(u"python").get()
+        self.assertEquals(
+            [p.post_id for p in index.posts], [post1.key.id(), post2.key.id()])
+
+
+class TestTagForm(AppEngineTestCase):
+
+    def test_tags_parsed(self):
+        self.users_login('owner@localhost', is_admin=True)
+        self.client.post(reverse("new_post"), {
+            "title": "Post 1",
+            "body": "Body",
+            "tags": "Python, App Engine,,python",
+        })
+
+        post = Post.query().get()
+        self.assertEquals(post.tags, [u"python", u"app-engine"])
+
+    def test_tags_shown(self):
+        post = Post(title=u"Post 1", tags=[u"python", u"ndb"])
+
+        form = PostForm(obj=post)
+
+        self.assertEquals(form.tags._value(), u"python, ndb")
+
+
+class TestTagView(AppEngineTestCase):
+
+    def test_raw_tags_on_post_page(self):
+        post = Post(title=u"Tagged post", tags=[u"python", u"ndb"])
+        post.put()
+
+        response = self.client.get(post.url)
+
+        self.assertContains(response, 'data-value="python, ndb"')
+
+    def test_posts_listed(self):
+        Post(title=u"Tagged post", tags=[u"python"]).put()
+        Post(title=u"Other post", tags=[u"ndb"]).put()
+
+        response = self.client.get(reverse("blog_tag", args=["python"]))
+
+        self.assertContains(response, "Tagged post")
+        self.assertNotContains(response, "Other post")
+
+    @override_settings(BLOG_PAGE_SIZE=2)
+    def test_paged(self):
+        for i in range(3):
+            Post(title=u"Post {}".format(i), tags=[u"python"]).put()
+
+        url = reverse("blog_tag", args=["python"])
+        response = self.client.get(url)
+        self.assertEquals(
+            [p.title for p in response.context["posts"]], [u"Post 2", u"Post 1"])
+        self.assertEquals(response.context["next_page"], 2)
+
+        response = self.client.get(url, {"page": 2})
+        self.assertEquals([p.title for p in response.context["posts"]], [u"Post 0"])
+        self.assertIsNone(response.context["next_page"])
+
+    def test_unknown_tag(self):
+        response = self.client.get(reverse("blog_tag", args=["missing"]))
+
+        self.assertEquals(response.status_code, 404)
+
+    def test_tag_cloud_on_home_page(self):
+        Post(title=u"Post 1", tags=[u"python"]).put()
+
+        response = self.client.get(reverse("home"))
+
+        self.assertContains(response, reverse("blog_tag", args=["python"]))
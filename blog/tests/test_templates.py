@@ -0,0 +1,98 @@
+import os
+import shutil
+import tempfile
+import time
+
+from django.template import Context
+from django.template.loader import get_template
+from django.template.loader_tags import ConstantIncludeNode
+from django.test.utils import override_settings
+from ndbtestcase import AppEngineTestCase
+
+from cachedloader import Loader
+
+
+class TestCachedLoader(AppEngineTestCase):
+
+    def setUp(self):
+        self.template_dir = tempfile.mkdtemp()
+        self.loader = Loader(["django.template.loaders.filesystem.Loader"])
+
+    def tearDown(self):
+        shutil.rmtree(self.template_dir)
+
+    def write_template(self, name, content):
+        path = os.path.join(self.template_dir, name)
+        with open(path, "w") as f:
+            f.write(content)
+
+        # Make sure modification time changes between writes
+        mtime = time.time() + len(content)
+        os.utime(path, (mtime, mtime))
+
+    def load(self, name):
+        template, origin = self.loader.load_template(name, [self.template_dir])
+        return template
+
+    def test_includes_flattened(self):
+        template = get_template("posts/list.html")
+
+        self.assertEquals(
+            template.nodelist.get_nodes_by_type(ConstantIncludeNode), [])
+
+    def test_flattened_template_renders(self):
+        self.write_template("item.html", "<{{ item }}>")
+        self.write_template(
+            "list.html",
+            '{% for item in items %}{% include "item.html" %}{% endfor %}')
+
+        with override_settings(TEMPLATE_DIRS=(self.template_dir,)):
+            template = self.load("list.html")
+            content = template.render(Context({"items": [1, 2]}))
+
+        self.assertEquals(content, "<1><2>")
+
+    def test_include_with_context_not_flattened(self):
+        self.write_template("item.html", "<{{ item }}>")
+        self.write_template(
+            "list.html", '{% include "item.html" with item=1 %}')
+
+        with override_settings(TEMPLATE_DIRS=(self.template_dir,)):
+            template = self.load("list.html")
+            content = template.render(Context({}))
+
+        self.assertEquals(content, "<1>")
+        self.assertEquals(
+            len(template.nodelist.get_nodes_by_type(ConstantIncludeNode)), 1)
+
+    def test_template_cached(self):
+        self.write_template("page.html", "old")
+
+        with override_settings(TEMPLATE_DEBUG=False):
+            self.load("page.html")
+            self.write_template("page.html", "new content")
+            template = self.load("page.html")
+
+        self.assertEquals(template.render(Context({})), "old")
+
+    def test_changed_template_reloaded_in_debug(self):
+        self.write_template("page.html", "old")
+
+        with override_settings(TEMPLATE_DEBUG=True):
+            self.load("page.html")
+            self.write_template("page.html", "new content")
+            template = self.load("page.html")
+
+        self.assertEquals(template.render(Context({})), "new content")
+
+    def test_changed_include_reloaded_in_debug(self):
+        self.write_template("item.html", "old")
+        self.write_template("page.html", '{% include "item.html" %}')
+
+        with override_settings(TEMPLATE_DEBUG=True,
+                               TEMPLATE_DIRS=(self.template_dir,)):
+            self.load("page.html")
+            self.write_template("item.html", "new content")
+            template = self.load("page.html")
+
+            self.assertEquals(template.render(Context({})), "new content")
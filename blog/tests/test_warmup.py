@@ -0,0 +1,37 @@
+import logging
+
+from ndbtestcase import AppEngineTestCase
+
+from blog.models import Post
+
+
+class RecordingHandler(logging.Handler):
+
+    def __init__(self):
+        logging.Handler.__init__(self, logging.WARNING)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+class TestWarmup(AppEngineTestCase):
+
+    def test_warmup(self):
+        Post(title=u"Post 1").put()
+
+        response = self.client.get("/_ah/warmup")
+
+        self.assertEquals(response.status_code, 200)
+        for phase in ("imports", "templates", "urls", "forms", "home page"):
+            self.assertContains(response, "{}: ".format(phase))
+
+    def test_no_warnings(self):
+        handler = RecordingHandler()
+        logging.getLogger().addHandler(handler)
+        try:
+            self.client.get("/_ah/warmup")
+        finally:
+            logging.getLogger().removeHandler(handler)
+
+        self.assertEquals([r.getMessage() for r in handler.records], [])
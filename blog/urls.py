@@ -1,5 +1,8 @@
 from django.conf.urls.defaults import url, patterns
-from blog.views import HomeView, PostListView, PostView, LoginView, AboutMe
+from blog.views import (
+    HomeView, PostListView, MonthArchiveView, FeedView, PostView, SearchView,
+    TagView, SitemapView, LoginView, AboutMe
+)
 
 
 urlpatterns = patterns(
@@ -8,7 +11,15 @@ urlpatterns = patterns(
     url(r'^login/$', LoginView.as_view(), {"login": True}, name='login'),
     url(r'^logout/$', LoginView.as_view(), {"login": False}, name='logout'),
     url(r'^blog/$', PostListView.as_view(), name='blog'),
+    url(r'^blog/archive/(?P<year>\d{4})/(?P<month>\d{2})/$',
+        MonthArchiveView.as_view(), name='blog_month'),
+    url(r'^blog/feed/$', FeedView.as_view(), name='blog_feed'),
+    url(r'^blog/tag/(?P<tag>[\w-]+)/$', TagView.as_view(), name='blog_tag'),
+    url(r'^blog/search/$', SearchView.as_view(), name='search'),
     url(r'^blog/post/$', PostView.as_view(), name='new_post'),
     url(r'^blog/post/(?P<slug>[\w-]+)/$', PostView.as_view(), name='blog_post'),
+    url(r'^sitemap\.xml$', SitemapView.as_view(), name='sitemap'),
+    url(r'^sitemap-(?P<section>\d+)\.xml$', SitemapView.as_view(),
+        name='sitemap_section'),
     url(r'^about_me/$', AboutMe.as_view(), name='about_me'),
 )
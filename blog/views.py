@@ -1,5 +1,6 @@
 import itertools
 
+from django.conf import settings
 from django.core.urlresolvers import reverse
 from django.http import (
     Http404, HttpResponse, HttpResponseRedirect,
@@ -9,15 +10,33 @@ from django.views.generic import ListView, View
 from django.views.generic import TemplateView
 from django.views.generic.base import TemplateResponseMixin
 from google.appengine.api import users
+from google.appengine.api.datastore_errors import BadValueError
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import ndb
 
-from blog.models import Post, slugify
+from blog.cache import (
+    CachedPageMixin, CachePolicyMixin, ConditionalPageMixin, make_etag
+)
+from blog.counters import record_view
+from blog.feeds import get_feed, CONTENT_TYPE as FEED_CONTENT_TYPE
+from blog import sitemaps
+from blog.models import (
+    Post, PostArchive, PostCollection, PostSlug, PostSummary, PostViews,
+    PopularPosts, SearchStats, TagCloud, TagIndex, DuplicateSlugError
+)
 from blog.forms import PostForm
+from blog.search import search_async
 
 
 class UserMixin(object):
     admin_required = False
 
-    def get_context_data(self, **kwargs):
+    @ndb.tasklet
+    def get_context_data_async(self, **kwargs):
+        """
+        Views extend the context here, yielding all the RPCs they need
+        together with the parent's future, so they are sent in parallel.
+        """
         context = kwargs
 
         context.update({
@@ -25,7 +44,10 @@ class UserMixin(object):
             "is_admin": users.is_current_user_admin(),
         })
 
-        return context
+        raise ndb.Return(context)
+
+    def get_context_data(self, **kwargs):
+        return self.get_context_data_async(**kwargs).get_result()
 
     def dispatch(self, request, *args, **kwargs):
         if self.admin_required and not users.is_current_user_admin():
@@ -34,51 +56,442 @@ class UserMixin(object):
         return super(UserMixin, self).dispatch(request, *args, **kwargs)
 
 
-class PostListView(UserMixin, ListView):
+class PostCollectionConditionalMixin(ConditionalPageMixin):
+    """
+    Lists of posts change only with the version of the collection.
+
+    Views set `page_complete` to False when the list may miss the last
+    write, then the page doesn't get the ETag of the new version.
+    """
+
+    def get_etag(self, request, *args, **kwargs):
+        return make_etag("posts", PostCollection.get_current().version)
+
+    def get_last_modified(self, request, *args, **kwargs):
+        return PostCollection.get_current().updated_at
+
+
+class PageNumberMixin(object):
+
+    def get_page_number(self):
+        try:
+            page = int(self.request.GET.get("page") or 1)
+        except ValueError:
+            raise Http404()
+
+        if page < 1:
+            raise Http404()
+
+        return page
+
+    def get_page_links(self, page, total):
+        return {
+            "prev_page": page - 1 if page > 1 else None,
+            "next_page": page + 1 if page * settings.BLOG_PAGE_SIZE < total else None,
+        }
+
+
+class PostListView(CachePolicyMixin, PostCollectionConditionalMixin,
+                   CachedPageMixin, PageNumberMixin, UserMixin, ListView):
+    """
+    All posts, newest first. Pages are addressed by cursors (`after` and
+    `before`) or by number (`page`).
+    """
     template_name = "post_list.html"
-    queryset = Post.query().order(-Post.created_at)
+    page_numbers_around = 5
+    queryset = PostSummary.query().order(-PostSummary.created_at)
+    reverse_queryset = PostSummary.query().order(PostSummary.created_at)
 
-    def get_context_data(self, **kwargs):
-        context = super(PostListView, self).get_context_data(**kwargs)
-        context["posts"] = self.object_list
-        context["form"] = PostForm()
+    def get_paginate_by(self, queryset):
+        return settings.BLOG_PAGE_SIZE
 
-        return context
+    def get_cursor(self, name):
+        value = self.request.GET.get(name)
+        if not value:
+            return None
 
+        try:
+            return Cursor(urlsafe=value)
+        except BadValueError:
+            raise Http404()
 
-class HomeView(UserMixin, ListView):
-    template_name = "home.html"
-    queryset = Post.query().order(-Post.created_at)
+    @ndb.tasklet
+    def get_page_async(self):
+        """
+        Fetch one page of posts starting at the `after` or `before` cursor.
+
+        Returns list of posts with cursors pointing to previous and next page
+        (None if there is no such page).
+        """
+        page_size = self.get_paginate_by(self.object_list)
+
+        before = self.get_cursor("before")
+        if before:
+            posts, cursor, more = yield self.reverse_queryset.fetch_page_async(
+                page_size, start_cursor=before)
+            posts.reverse()
+            raise ndb.Return(posts, cursor if more else None, before)
+
+        after = self.get_cursor("after")
+        posts, cursor, more = yield self.object_list.fetch_page_async(
+            page_size, start_cursor=after)
+        raise ndb.Return(posts, after, cursor if more else None)
+
+    @ndb.tasklet
+    def get_numbered_page_async(self, archive, page):
+        """
+        Fetch the page by number. The archive tells in which month the page
+        starts, so the query skips only posts of that month.
+        """
+        page_size = self.get_paginate_by(self.object_list)
+        located = archive.locate((page - 1) * page_size)
+        if located is None:
+            if page > 1:
+                raise Http404()
+            raise ndb.Return([])
+
+        month, offset = located
+        query = self.object_list.filter(PostSummary.created_at < month.end)
+        posts = yield query.fetch_async(page_size, offset=offset)
+        raise ndb.Return(posts)
+
+    def get_page_numbers(self, archive, page):
+        """
+        Numbers of the pages linked: the first, the last and up to
+        `page_numbers_around` on both sides of the current one, with None for
+        the gaps, so the links don't grow with the archive
+        """
+        page_size = self.get_paginate_by(self.object_list)
+        pages = (archive.total + page_size - 1) // page_size
+        if pages < 2:
+            return []
+
+        current = page or 1
+        shown = set([1, pages]) | set(range(
+            max(1, current - self.page_numbers_around),
+            min(pages, current + self.page_numbers_around) + 1))
+
+        numbers, previous = [], 0
+        for number in sorted(shown):
+            if number > previous + 1:
+                numbers.append(None)
+            numbers.append(number)
+            previous = number
+
+        return numbers
+
+    @ndb.tasklet
+    def get_context_data_async(self, **kwargs):
+        parent = super(PostListView, self)
+        context, archive, collection = yield (
+            parent.get_context_data_async(**kwargs),
+            PostArchive.get_current_async(),
+            PostCollection.get_current_async(),
+        )
+
+        if "page" in self.request.GET:
+            page = self.get_page_number()
+            posts = yield self.get_numbered_page_async(archive, page)
+            context.update(self.get_page_links(page, archive.total))
+        else:
+            # Number of a page reached by a cursor is not known
+            by_cursor = self.request.GET.get("after") or self.request.GET.get("before")
+            page = None if by_cursor else 1
+            posts, prev_cursor, next_cursor = yield self.get_page_async()
+            context.update({
+                "prev_cursor": prev_cursor and prev_cursor.urlsafe(),
+                "next_cursor": next_cursor and next_cursor.urlsafe(),
+            })
+
+        self.page_complete = collection.is_complete(posts)
+        context.update({
+            "posts": posts,
+            "page": page,
+            "page_numbers": self.get_page_numbers(archive, page),
+            "archive": archive.years(),
+            "form": PostForm(),
+        })
 
-    def get_context_data(self, **kwargs):
-        context = super(HomeView, self).get_context_data(**kwargs)
-        context["posts"] = self.object_list.fetch(3)
+        raise ndb.Return(context)
+
+
+class MonthArchiveView(CachePolicyMixin, PostCollectionConditionalMixin,
+                       CachedPageMixin, PageNumberMixin, UserMixin,
+                       TemplateResponseMixin, View):
+    """
+    Posts of a month, newest first, numbered pages counted by the archive
+    """
+    template_name = "month_archive.html"
+
+    @ndb.tasklet
+    def get_context_data_async(self, **kwargs):
+        parent = super(MonthArchiveView, self)
+        context, archive, collection = yield (
+            parent.get_context_data_async(**kwargs),
+            PostArchive.get_current_async(),
+            PostCollection.get_current_async(),
+        )
+
+        month = archive.get_month(kwargs["year"], kwargs["month"])
+        page = kwargs["page"]
+        page_size = settings.BLOG_PAGE_SIZE
+        if month is None or (page - 1) * page_size >= month.count:
+            raise Http404()
+
+        query = PostSummary.query(
+            PostSummary.created_at >= month.start,
+            PostSummary.created_at < month.end,
+        ).order(-PostSummary.created_at)
+        posts = yield query.fetch_async(page_size, offset=(page - 1) * page_size)
+
+        self.page_complete = collection.is_complete(posts)
+        context.update(self.get_page_links(page, month.count))
+        context.update({
+            "posts": posts,
+            "month": month,
+            "archive": archive.years(),
+        })
+
+        raise ndb.Return(context)
+
+    def get(self, request, year, month, *args, **kwargs):
+        context = self.get_context_data(
+            year=int(year), month=int(month), page=self.get_page_number())
+        return self.render_to_response(context)
+
+
+class HomeView(CachePolicyMixin, PostCollectionConditionalMixin,
+               CachedPageMixin, UserMixin, ListView):
+    template_name = "home.html"
+    queryset = PostSummary.query().order(-PostSummary.created_at)
+
+    def get_etag(self, request, *args, **kwargs):
+        # Lists popular posts too
+        return make_etag(
+            super(HomeView, self).get_etag(request, *args, **kwargs),
+            PopularPosts.get_current().version)
+
+    @ndb.tasklet
+    def get_context_data_async(self, **kwargs):
+        parent = super(HomeView, self)
+        context, posts, popular, tag_cloud, collection = yield (
+            parent.get_context_data_async(**kwargs),
+            self.object_list.fetch_async(3),
+            PopularPosts.get_current_async(),
+            TagCloud.get_current_async(),
+            PostCollection.get_current_async(),
+        )
+
+        self.page_complete = collection.is_complete(posts)
+        context["posts"] = posts
+        context["popular_posts"] = popular.posts
+        context["tags"] = tag_cloud.tags
         context["form"] = PostForm()
 
-        return context
+        raise ndb.Return(context)
+
+
+class TagView(CachePolicyMixin, PostCollectionConditionalMixin,
+              CachedPageMixin, PageNumberMixin, UserMixin,
+              TemplateResponseMixin, View):
+    """
+    Most recent posts with the tag, read from its TagIndex
+    """
+    template_name = "tag.html"
 
+    @ndb.tasklet
+    def get_context_data_async(self, **kwargs):
+        parent = super(TagView, self)
+        page = kwargs["page"]
+        page_size = settings.BLOG_PAGE_SIZE
 
-class PostView(UserMixin, TemplateResponseMixin, View):
+        context, index = yield (
+            parent.get_context_data_async(**kwargs),
+            TagIndex.get_by_tag_async(kwargs["tag"]),
+        )
+        if index is None:
+            raise Http404()
+
+        posts = yield ndb.get_multi_async(
+            index.summary_keys((page - 1) * page_size, page_size))
+        if not posts and page > 1:
+            raise Http404()
+
+        context.update(self.get_page_links(page, len(index.posts)))
+        context.update({
+            "posts": [post for post in posts if post is not None],
+            "total": index.count,
+        })
+
+        raise ndb.Return(context)
+
+    def get(self, request, tag, *args, **kwargs):
+        context = self.get_context_data(tag=tag, page=self.get_page_number())
+        return self.render_to_response(context)
+
+
+class SearchView(CachePolicyMixin, ConditionalPageMixin, CachedPageMixin,
+                 PageNumberMixin, UserMixin, TemplateResponseMixin, View):
+    """
+    Posts matching the `q` parameter, best first, `page` by page
+    """
+    template_name = "search.html"
+
+    def get_etag(self, request, *args, **kwargs):
+        return make_etag("search", SearchStats.get_current().version)
+
+    def get_last_modified(self, request, *args, **kwargs):
+        return SearchStats.get_current().updated_at
+
+    @ndb.tasklet
+    def get_context_data_async(self, **kwargs):
+        parent = super(SearchView, self)
+        query = kwargs["query"]
+        page = kwargs["page"]
+        page_size = settings.BLOG_PAGE_SIZE
+
+        context, (posts, total) = yield (
+            parent.get_context_data_async(**kwargs),
+            search_async(query, (page - 1) * page_size, page_size),
+        )
+
+        context.update(self.get_page_links(page, total))
+        context.update({
+            "posts": posts,
+            "total": total,
+        })
+
+        raise ndb.Return(context)
+
+    def get(self, request, *args, **kwargs):
+        query = request.GET.get("q", u"").strip()
+        context = self.get_context_data(query=query, page=self.get_page_number())
+        return self.render_to_response(context)
+
+
+class FeedView(CachePolicyMixin, PostCollectionConditionalMixin, View):
+    """
+    Atom feed of the latest posts, see blog.feeds
+    """
+
+    def get(self, request, *args, **kwargs):
+        content, self.page_complete = get_feed(
+            PostCollection.get_current(), request.build_absolute_uri("/"))
+        return HttpResponse(content, content_type=FEED_CONTENT_TYPE)
+
+
+class SitemapView(CachePolicyMixin, PostCollectionConditionalMixin, View):
+    """
+    sitemap.xml, or its section when it's split, see blog.sitemaps
+    """
+
+    def get(self, request, section=None, *args, **kwargs):
+        collection, archive = ndb.get_multi([
+            ndb.Key(PostCollection, PostCollection.SINGLETON_ID),
+            ndb.Key(PostArchive, PostArchive.SINGLETON_ID),
+        ])
+        collection = collection or PostCollection(id=PostCollection.SINGLETON_ID)
+        version = collection.version
+        sections = sitemaps.split_sections(
+            archive or PostArchive(id=PostArchive.SINGLETON_ID))
+        base_url = request.build_absolute_uri("/")
+
+        if section is None and len(sections) > 1:
+            content = sitemaps.generate_index(base_url, sections)
+            return HttpResponse(content, content_type=sitemaps.CONTENT_TYPE)
+
+        number = int(section or 0)
+        if number >= len(sections):
+            raise Http404()
+
+        key = sitemaps.sitemap_cache_key(version, base_url, number)
+        content = sitemaps.get_cached(key)
+        if content is None:
+            start, end = sections[number]
+            content, self.page_complete = sitemaps.build_urlset(
+                base_url, collection, start, end, first=number == 0)
+            if self.page_complete:
+                sitemaps.set_cached(key, content)
+
+        return HttpResponse(content, content_type=sitemaps.CONTENT_TYPE)
+
+
+class PostView(CachePolicyMixin, ConditionalPageMixin, CachedPageMixin,
+               UserMixin, TemplateResponseMixin, View):
     template_name = "posts/view.html"
 
     def get_object(self):
         slug = self.kwargs.get("slug")
         return Post.get_by_slug(slug)
 
+    def get_slug_index(self, slug):
+        index = PostSlug.get_by_id(slug) if slug else None
+        if index is None or index.version is None:
+            return None
+
+        return index
+
+    def get_views(self, index):
+        """
+        PostViews of the post, its count is shown on the page so it's part
+        of ETags and cache keys of the page
+        """
+        views = PostViews.get_by_id(index.post.id())
+        return views or PostViews(id=index.post.id())
+
+    def get_etag(self, request, slug=None, *args, **kwargs):
+        index = self.get_slug_index(slug)
+        if index:
+            return make_etag(
+                "post", index.post.id(), index.version,
+                self.get_views(index).count)
+
+    def get_last_modified(self, request, slug=None, *args, **kwargs):
+        index = self.get_slug_index(slug)
+        if index:
+            views = self.get_views(index)
+            if views.updated_at and views.updated_at > index.updated_at:
+                return views.updated_at
+            return index.updated_at
+
+    def get_page_cache_parts(self, request, slug=None, *args, **kwargs):
+        index = self.get_slug_index(slug)
+        if index:
+            return (self.get_views(index).count,)
+        return ()
+
     def get_template_names(self):
         if self.request.method == "POST":
             return ["posts/post.html"]
 
         return super(PostView, self).get_template_names()
 
-    def get_context_data(self, **kwargs):
-        context = super(PostView, self).get_context_data(**kwargs)
+    def dispatch(self, request, *args, **kwargs):
+        response = super(PostView, self).dispatch(request, *args, **kwargs)
+
+        # Pages served from caches (or not modified) were read as well
+        if request.method == "GET" and response.status_code in (200, 304):
+            index = self.get_slug_index(kwargs.get("slug"))
+            if index:
+                record_view(index.post.id())
+
+        return response
+
+    @ndb.tasklet
+    def get_context_data_async(self, **kwargs):
+        parent = super(PostView, self)
+        post = kwargs.get("post")
+        context, views = yield (
+            parent.get_context_data_async(**kwargs),
+            PostViews.get_by_id_async(post.key.id()),
+        )
         context.update({
-            "post": kwargs.get("post"),
+            "post": post,
+            "views": views.count if views else 0,
             "form": PostForm(),
         })
 
-        return context
+        raise ndb.Return(context)
 
     def get(self, request, slug=None, *args, **kwargs):
         self.object = self.get_object()
@@ -106,11 +519,6 @@ class PostView(UserMixin, TemplateResponseMixin, View):
 
             return HttpResponseBadRequest("<br/>".join(error_msg))
 
-        # title has to exit at that point due to the validators
-        new_slug = slugify(form.data["title"])
-        if slug is None and Post.get_by_slug(new_slug):
-            return HttpResponseBadRequest("Post with this title alread exit")
-
         created = False
         if not post:
             created = True
@@ -118,7 +526,11 @@ class PostView(UserMixin, TemplateResponseMixin, View):
 
         form.populate_obj(post)
         post.author = users.get_current_user().nickname()
-        post.put()
+
+        try:
+            post.put()
+        except DuplicateSlugError:
+            return HttpResponseBadRequest("Post with this title alread exit")
 
         context = self.get_context_data(post=post, short=created)
         return self.render_to_response(context)
@@ -131,9 +543,7 @@ class PostView(UserMixin, TemplateResponseMixin, View):
         if not post:
             raise Http404()
 
-        post.key.delete()
-        post.key.delete(use_datastore=False)
-
+        post.delete()
         return HttpResponse(status=204)
 
 
@@ -146,8 +556,10 @@ class PostFormView(UserMixin, TemplateResponseMixin, View):
     def get_object(self):
         return Post.get_by_slug(self.kwargs.get("slug"))
 
-    def get_context_data(self, **kwargs):
-        context = super(PostFormView, self).get_context_data(**kwargs)
+    @ndb.tasklet
+    def get_context_data_async(self, **kwargs):
+        parent = super(PostFormView, self)
+        context = yield parent.get_context_data_async(**kwargs)
 
         form = PostForm(obj=kwargs.get("post"))
 
@@ -155,7 +567,7 @@ class PostFormView(UserMixin, TemplateResponseMixin, View):
             "form": form,
         })
 
-        return context
+        raise ndb.Return(context)
 
     def get(self, request, *args, **kwargs):
         self.object = self.get_object()
@@ -0,0 +1,96 @@
+"""
+Warmup request handler.
+
+App Engine sends /_ah/warmup to a new instance before it gets any user
+traffic, so everything expensive on the first request is done here instead.
+"""
+import logging
+import os
+import time
+
+from django.conf import settings
+from django.core.urlresolvers import (
+    get_resolver, resolve, reverse, NoReverseMatch
+)
+from django.http import HttpResponse
+from django.template.loader import get_template
+from django.utils.importlib import import_module
+from django.views.generic import View
+
+from blog.forms import PostForm
+from blog.models import PopularPosts, PostCollection, TagCloud
+from blog.views import HomeView
+
+TEMPLATES_DIR = os.path.join(os.path.dirname(__file__), "templates")
+
+
+def import_dependencies():
+    # main itself is already imported, it serves this request
+    modules = ["django.core.handlers.wsgi", settings.ROOT_URLCONF]
+    modules.extend(path.rsplit(".", 1)[0] for path in settings.MIDDLEWARE_CLASSES)
+    for app in settings.INSTALLED_APPS:
+        modules.extend([app, app + ".models", app + ".views"])
+
+    for module in modules:
+        try:
+            import_module(module)
+        except ImportError:
+            pass
+
+
+def compile_templates():
+    for root, dirs, files in os.walk(TEMPLATES_DIR):
+        for filename in files:
+            if filename.endswith(".html"):
+                path = os.path.join(root, filename)
+                get_template(os.path.relpath(path, TEMPLATES_DIR))
+
+
+def resolve_urls():
+    resolver = get_resolver(None)
+
+    for name in resolver.reverse_dict.keys():
+        if not isinstance(name, basestring):
+            continue
+
+        for possibility, pattern, defaults in resolver.reverse_dict.getlist(name):
+            for result, params in possibility:
+                kwargs = dict((param, "warmup") for param in params)
+                try:
+                    resolve(reverse(name, kwargs=kwargs))
+                except NoReverseMatch:
+                    # Arguments limited to e.g. digits don't take the sample
+                    # value, the resolver is built by the other urls anyway
+                    pass
+
+
+def build_forms():
+    for field in PostForm():
+        unicode(field)
+
+
+def prefetch_home_page():
+    HomeView.queryset.fetch(3)
+    PostCollection.get_current()
+    PopularPosts.get_current()
+    TagCloud.get_current()
+
+
+class WarmupView(View):
+    phases = [
+        ("imports", import_dependencies),
+        ("templates", compile_templates),
+        ("urls", resolve_urls),
+        ("forms", build_forms),
+        ("home page", prefetch_home_page),
+    ]
+
+    def get(self, request, *args, **kwargs):
+        report = []
+        for name, phase in self.phases:
+            start = time.time()
+            phase()
+            report.append("{}: {:.1f}ms".format(name, (time.time() - start) * 1000))
+
+        logging.info("Warmup done, %s", ", ".join(report))
+        return HttpResponse("\n".join(report), content_type="text/plain")
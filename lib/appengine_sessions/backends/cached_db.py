@@ -1,14 +1,55 @@
+"""
+Cached (memcache in front of the datastore) session backend.
+
+Sessions are read from the cache, and the datastore is written only when it
+has to be:
+
+- when the session data really changed, not just `modified` was set
+- when the expiry date moved by at least SESSION_EXPIRY_REFRESH_FRACTION of
+  SESSION_COOKIE_AGE (0.1 by default), so sessions saved on every request
+  don't write on every request
+
+Refreshes of the expiry in between are skipped, not deferred: until one is
+persisted, the session may end that much earlier than its cookie says.
+
+New sessions are guarded against key collisions by memcache add, so creating
+one is a single datastore put.
+
+In front of memcache is a small LRU cache of every instance. Its entries are
+used only after the version of the session in memcache (changed by every
+write, on any instance) is checked to be the same, so a load served by it
+is a single small memcache get instead of the whole entry, and never stale.
+"""
+import copy
+import uuid
+from datetime import datetime, timedelta
+
 from django.conf import settings
+from django.contrib.sessions.backends.base import CreateError
 from django.core.cache import cache
 
 from appengine_sessions.backends.db import SessionStore as DBStore
+from appengine_sessions.lru import LRUCache
 
-KEY_PREFIX = "appengine_sessions.cached_db"
+# Entries hold the data together with the stored expiry date, the prefix
+# changed with that so entries of the old format are never read
+KEY_PREFIX = "appengine_sessions.cached_db.v2:"
+VERSION_KEY_PREFIX = "appengine_sessions.cached_db.version:"
+
+# (data, expire date) of recently used sessions
+local_cache = LRUCache(getattr(settings, "SESSION_LOCAL_CACHE_SIZE", 1000))
+
+
+def expiry_refresh_interval():
+    fraction = getattr(settings, "SESSION_EXPIRY_REFRESH_FRACTION", 0.1)
+    return timedelta(seconds=settings.SESSION_COOKIE_AGE * fraction)
 
 
 class SessionStore(DBStore):
     def __init__(self, session_key=None):
         super(SessionStore, self).__init__(session_key)
+        # Copy of the data as it is in the datastore, None if unknown
+        self._stored_data = None
 
     @property
     def cache_key(self):
@@ -18,19 +59,129 @@ class SessionStore(DBStore):
         """
         return KEY_PREFIX + self._get_or_create_session_key()
 
+    @property
+    def version_key(self):
+        return VERSION_KEY_PREFIX + self._get_or_create_session_key()
+
+    def get_cached(self):
+        """
+        (data, expire date) of the session from the local cache or memcache,
+        None if neither has it
+        """
+        version = None
+        if self.session_key in local_cache:
+            # The version is fetched only to check a local entry, so a hit is
+            # one small memcache get and a miss a single get_many
+            version = cache.get(self.version_key)
+            cached = local_cache.get(self.session_key, version)
+            if cached is not None:
+                data, expire_date = cached
+                return copy.deepcopy(data), expire_date
+
+        if version is None:
+            values = cache.get_many([self.cache_key, self.version_key])
+            entry = values.get(self.cache_key)
+            version = values.get(self.version_key)
+        else:
+            # Stale local entry, the current version is known already
+            entry = cache.get(self.cache_key)
+
+        if entry is None:
+            return None
+
+        if version is None:
+            version = uuid.uuid4().hex
+            cache.set(self.version_key, version, self.cache_timeout(entry["expire_date"]))
+
+        local_cache.set(
+            self.session_key,
+            (copy.deepcopy(entry["data"]), entry["expire_date"]), version)
+        return entry["data"], entry["expire_date"]
+
+    def set_cached(self, data, expire_date):
+        """
+        Store a new version of the session in memcache and the local cache
+        """
+        entry, timeout = self.cache_entry(data, expire_date)
+        version = uuid.uuid4().hex
+
+        cache.set_many({self.cache_key: entry, self.version_key: version}, timeout)
+        local_cache.set(self.session_key, (copy.deepcopy(data), expire_date), version)
+
     def load(self):
-        data = cache.get(self.cache_key, None)
-        if data is None:
+        cached = self.get_cached()
+        if cached is not None and cached[1] > datetime.utcnow():
+            data, self._stored_expire_date = cached
+        else:
+            session_key = self.session_key
             data = super(SessionStore, self).load()
-            cache.set(self.cache_key, data, settings.SESSION_COOKIE_AGE)
+            # Otherwise a new session was created, and cached by insert()
+            if self.session_key == session_key:
+                self.set_cached(data, self._stored_expire_date)
+
+        self._stored_data = copy.deepcopy(data)
         return data
 
     def exists(self, session_key):
+        if session_key and cache.get(KEY_PREFIX + session_key) is not None:
+            return True
+
         return super(SessionStore, self).exists(session_key)
 
+    def needs_write(self):
+        """
+        Whether the datastore is behind this session
+        """
+        if self._stored_data is None or self._stored_expire_date is None:
+            return True
+
+        if self._session != self._stored_data:
+            return True
+
+        moved = self.get_expiry_date() - self._stored_expire_date
+        return moved >= expiry_refresh_interval()
+
+    def cache_timeout(self, expire_date):
+        timeout = expire_date - datetime.utcnow()
+        return max(timeout.days * 86400 + timeout.seconds, 1)
+
+    def cache_entry(self, data, expire_date=None):
+        """
+        Cache entry of the session and its timeout
+        """
+        expire_date = expire_date or self._stored_expire_date
+        return {"data": data, "expire_date": expire_date}, self.cache_timeout(expire_date)
+
+    def insert(self, s, session_data):
+        """
+        Session keys are random, so a collision is practically impossible:
+        memcache add guards against it instead of a datastore transaction.
+        """
+        entry, timeout = self.cache_entry(session_data, s.expire_date)
+        if not cache.add(self.cache_key, entry, timeout):
+            raise CreateError()
+
+        try:
+            s.put()
+        except Exception:
+            cache.delete(self.cache_key)
+            raise
+
+        version = uuid.uuid4().hex
+        cache.set(self.version_key, version, timeout)
+        local_cache.set(self.session_key, (copy.deepcopy(session_data), s.expire_date), version)
+
+    def update(self, s, session_data):
+        s.put()
+        self.set_cached(session_data, s.expire_date)
+
     def save(self, must_create=False):
+        if self.session_key is not None and not must_create:
+            if not self.needs_write():
+                return
+
         super(SessionStore, self).save(must_create)
-        cache.set(self.cache_key, self._session, settings.SESSION_COOKIE_AGE)
+        self._stored_data = copy.deepcopy(self._get_session(no_load=True))
 
     def delete(self, session_key=None):
         super(SessionStore, self).delete(session_key)
@@ -38,7 +189,8 @@ class SessionStore(DBStore):
             if self.session_key is None:
                 return
             session_key = self.session_key
-        cache.delete(KEY_PREFIX + session_key)
+        cache.delete_many([KEY_PREFIX + session_key, VERSION_KEY_PREFIX + session_key])
+        local_cache.delete(session_key)
 
     def flush(self):
         self.clear()
@@ -0,0 +1,90 @@
+"""
+Codecs turning session data into bytes stored in the datastore and back.
+
+The codec is chosen by the SESSION_CODEC setting (a dotted path), the
+compact BinaryCodec is the default. Data encoded by Django itself (base64
+text) still decodes, see SessionStore.decode.
+"""
+import cPickle as pickle
+import zlib
+
+from django.conf import settings
+from django.utils.crypto import constant_time_compare, salted_hmac
+from django.utils.importlib import import_module
+
+DEFAULT_CODEC = "appengine_sessions.backends.codec.BinaryCodec"
+
+
+class BinaryCodec(object):
+    """
+    Binary session format:
+
+        version (1 byte) | flags (1 byte) | HMAC-SHA1 (20 bytes) | payload
+
+    The payload is the pickled session data, compressed with zlib when it is
+    longer than `compress_threshold` and compression actually helps. The
+    HMAC covers the header and the payload.
+    """
+    VERSION = "\x01"
+    FLAG_ZLIB = 0x01
+
+    HEADER_SIZE = 2
+    MAC_SIZE = 20
+
+    key_salt = "appengine_sessions.backends.codec.BinaryCodec"
+    compress_threshold = 256
+
+    def can_decode(self, data):
+        return data[:1] == self.VERSION
+
+    def sign(self, value):
+        return salted_hmac(self.key_salt, value).digest()
+
+    def encode(self, session_dict):
+        payload = pickle.dumps(session_dict, pickle.HIGHEST_PROTOCOL)
+
+        flags = 0
+        if len(payload) > self.compress_threshold:
+            compressed = zlib.compress(payload)
+            if len(compressed) < len(payload):
+                payload = compressed
+                flags |= self.FLAG_ZLIB
+
+        header = self.VERSION + chr(flags)
+        return header + self.sign(header + payload) + payload
+
+    def decode(self, data):
+        """
+        Session data, or an empty dict if the data is corrupted (same as
+        Django does)
+        """
+        header = data[:self.HEADER_SIZE]
+        mac = data[self.HEADER_SIZE:self.HEADER_SIZE + self.MAC_SIZE]
+        payload = data[self.HEADER_SIZE + self.MAC_SIZE:]
+
+        if len(header) != self.HEADER_SIZE or not self.can_decode(header):
+            return {}
+
+        if not constant_time_compare(mac, self.sign(header + payload)):
+            return {}
+
+        try:
+            if ord(header[1]) & self.FLAG_ZLIB:
+                payload = zlib.decompress(payload)
+            return pickle.loads(payload)
+        except Exception:
+            return {}
+
+
+_codec = None
+
+
+def get_codec():
+    global _codec
+
+    path = getattr(settings, "SESSION_CODEC", DEFAULT_CODEC)
+    if _codec is None or _codec[0] != path:
+        module, name = path.rsplit(".", 1)
+        _codec = (path, getattr(import_module(module), name)())
+
+    return _codec[1]
@@ -8,12 +8,13 @@ a look there for definitive docs.
 """
 
 from google.appengine.ext import ndb
+from appengine_sessions.backends.codec import get_codec
 from appengine_sessions.models import Session
 
 from django.contrib.sessions.backends.base import CreateError
 from django.contrib.sessions.backends.db import SessionStore as DBStore
 from django.core.exceptions import SuspiciousOperation
-from django.utils.encoding import force_unicode
+from django.utils.crypto import get_random_string
 from django.conf import settings
 from datetime import datetime, timedelta
 
@@ -26,6 +27,8 @@ class SessionStore(DBStore):
     """
     def __init__(self, session_key=None):
         super(SessionStore, self).__init__(session_key)
+        # Expiry date of the session as it is in the datastore
+        self._stored_expire_date = None
 
     def get_ndb_session_key(self, session_key=None):
         return ndb.Key(Session, session_key and session_key or self._get_or_create_session_key())
@@ -88,14 +91,26 @@ class SessionStore(DBStore):
             value = datetime.utcnow() + value
         self['_session_expiry'] = value
 
+    def encode(self, session_dict):
+        return get_codec().encode(session_dict)
+
+    def decode(self, session_data):
+        codec = get_codec()
+        if codec.can_decode(session_data):
+            return codec.decode(session_data)
+
+        # Stored before the codec was used
+        return super(SessionStore, self).decode(str(session_data))
+
     def load(self):
         s = self.get_ndb_session_key().get()
 
         if s:
             # Make sure you compare UTC datetime now for NDB.
             if s.expire_date > datetime.utcnow():
+                self._stored_expire_date = s.expire_date
                 try:
-                    return self.decode(force_unicode(s.session_data))
+                    return self.decode(s.session_data)
                 except SuspiciousOperation:
                     return {}
         self.create()
@@ -104,46 +119,65 @@ class SessionStore(DBStore):
     def exists(self, session_key):
         # If session key is None then False
         if session_key:
-            ndb_session_key = ndb.Key(Session, session_key)
-            s = ndb_session_key.get()
-            return s is not None
+            # A lookup by key, unlike a query, sees sessions just created
+            return ndb.Key(Session, session_key).get() is not None
         return False
 
-    def save(self, must_create=False):
+    def _get_new_session_key(self):
         """
-        Create and save a Session object using db.run_in_transaction, with
-        key_name = session_key, raising CreateError if
-        unsuccessful.
+        Random session key, not looked up in the datastore: the chance of a
+        collision is negligible and insert() still catches it.
         """
+        return get_random_string(32, '1234567890abcdef')
 
-        if must_create:
-            s = self.get_ndb_session_key().get()
-            if s:
-                raise CreateError()
-
-        session_data = self._get_session(no_load=must_create)
-        #ed = self.get_expiry_date()
-        #print datetime.datetime.utcoffset(ed)
+    def insert(self, s, session_data):
+        """
+        Put a new session, raising CreateError if the key is already taken.
 
+        The check and the put are a single transaction.
+        """
         def txn():
-            s = Session(
-                id=self._get_or_create_session_key(),
-                session_key=self.session_key,
-                session_data=self.encode(session_data),
-                expire_date=self.get_expiry_date()
-            )
+            if s.key.get() is not None:
+                return False
             s.put()
+            return True
 
         # This is tricky and probably needs some sanity checking, because
         # TransactionFailedError can be raised, but the transaction can still
         # go on to be committed to the datastore. As far as I can see there's
         # no way to manually roll it back at that point. No idea how to test
         # this either.
-        try:
-            ndb.transaction(txn)
-        except (ndb.Rollback):
+        if not ndb.transaction(txn):
             raise CreateError()
 
+    def update(self, s, session_data):
+        s.put()
+
+    def save(self, must_create=False):
+        """
+        Save the Session entity with key_name = session_key.
+
+        With must_create, raise CreateError if the session already exists.
+        A session without a key is created (with a new key) instead.
+        """
+        if self.session_key is None:
+            return self.create()
+
+        session_data = self._get_session(no_load=must_create)
+        s = Session(
+            id=self.session_key,
+            session_key=self.session_key,
+            session_data=self.encode(session_data),
+            expire_date=self.get_expiry_date()
+        )
+
+        if must_create:
+            self.insert(s, session_data)
+        else:
+            self.update(s, session_data)
+
+        self._stored_expire_date = s.expire_date
+
     def delete(self, session_key=None):
         if session_key is None:
             if self._session_key is None:
@@ -0,0 +1,85 @@
+"""
+In-process LRU cache, shared by all threads of an instance.
+
+Entries carry a version and are served only when the caller gives the same
+version as the current one, so the cache can sit in front of a shared cache
+(memcache) holding the versions without serving data changed by other
+instances.
+"""
+import collections
+import threading
+
+
+class LRUCache(object):
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.entries = collections.OrderedDict()
+        self.counters = collections.defaultdict(int)
+
+    def count(self, name):
+        with self.lock:
+            self.counters[name] += 1
+
+    def __contains__(self, key):
+        """
+        Whether the key has an entry (at any version), doesn't count as a use
+        """
+        with self.lock:
+            return key in self.entries
+
+    def get(self, key, version):
+        """
+        Cached value of the key, or None when it isn't cached or the entry
+        isn't at `version` (None never matches)
+        """
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is not None:
+                # Most recently used go last
+                self.entries[key] = entry
+
+        if entry is None:
+            self.count('misses')
+            return None
+
+        value, entry_version = entry
+        if version is None or version != entry_version:
+            self.delete(key, entry_version)
+            self.count('stale')
+            return None
+
+        self.count('hits')
+        return value
+
+    def set(self, key, value, version):
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = (value, version)
+
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def delete(self, key, version=None):
+        """
+        Remove the key (only if it's still at `version`, when given)
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and version in (None, entry[1]):
+                del self.entries[key]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.counters.clear()
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters)
+            stats['size'] = len(self.entries)
+
+        requests = stats.get('hits', 0) + stats.get('misses', 0) + stats.get('stale', 0)
+        stats['hit_rate'] = float(stats.get('hits', 0)) / requests if requests else 0.0
+        return stats
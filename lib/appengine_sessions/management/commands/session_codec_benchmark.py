@@ -0,0 +1,70 @@
+"""
+Compare the session codec against Django's own (pickle + base64) format:
+
+    python manage.py session_codec_benchmark --iterations=10000
+"""
+import time
+from datetime import datetime
+from optparse import make_option
+
+from django.contrib.sessions.backends.base import SessionBase
+from django.core.management.base import BaseCommand
+
+from appengine_sessions.backends.codec import get_codec
+
+SAMPLES = [
+    ("empty", {}),
+    ("anonymous", {
+        "_session_expiry": 1209600,
+        "testcookie": "worked",
+    }),
+    ("logged in", {
+        "_auth_user_id": 42,
+        "_auth_user_backend": "django.contrib.auth.backends.ModelBackend",
+        "_session_expiry": datetime(2014, 1, 1, 12, 0),
+        "django_language": "en-gb",
+    }),
+    ("with messages", {
+        "_auth_user_id": 42,
+        "_auth_user_backend": "django.contrib.auth.backends.ModelBackend",
+        "_messages": [(20, u"Post number %d was saved" % i) for i in range(20)],
+        "recent_posts": [u"post-title-number-%d" % i for i in range(50)],
+    }),
+]
+
+
+def measure(function, argument, iterations):
+    start = time.time()
+    for _ in xrange(iterations):
+        function(argument)
+    return (time.time() - start) * 1000000 / iterations
+
+
+class Command(BaseCommand):
+    help = "Compare encode/decode time and size of session codecs"
+
+    option_list = BaseCommand.option_list + (
+        make_option("--iterations", type="int", default=5000,
+                    help="Encode/decode calls per sample"),
+    )
+
+    def handle(self, *args, **options):
+        iterations = options["iterations"]
+        codecs = [
+            ("django", SessionBase()),
+            (get_codec().__class__.__name__, get_codec()),
+        ]
+
+        self.stdout.write("%-14s %-12s %8s %12s %12s\n" % (
+            "sample", "codec", "bytes", "encode (us)", "decode (us)"))
+
+        for sample_name, data in SAMPLES:
+            for codec_name, codec in codecs:
+                encoded = codec.encode(data)
+                assert codec.decode(encoded) == data
+
+                self.stdout.write("%-14s %-12s %8d %12.1f %12.1f\n" % (
+                    sample_name, codec_name, len(encoded),
+                    measure(codec.encode, data, iterations),
+                    measure(codec.decode, encoded, iterations),
+                ))
@@ -1,96 +1,371 @@
-import operator
+"""
+Sharded mappers over ndb queries.
+
+A job splits the entities matched by a query into shards. Every shard is
+processed by its own chain of deferred tasks (slices), so shards run in
+parallel. Progress of a shard (cursor, counters) is checkpointed after every
+batch to a MapperShard entity, and a slice hands over to the next task before
+the task deadline. A failed task is retried by the task queue and carries on
+from the last checkpoint, so at most the batches in flight are mapped again.
+
+Mappers doing their work with async RPCs override `map_async`, then up to
+`batches_in_flight` batches are mapped while the next one is fetched. The
+cursor only moves past a batch once its future got its result.
+
+When all shards are done, `reduce` is called once with the MapperJob, which
+holds the sum of the counters returned by `map`.
+
+    from appengine_sessions.mapper import DeleteMapper
+    DeleteMapper(Session, filters={'lt': ('expire_date', now)}).start()
+
+Status of jobs is served by appengine_sessions.views.MapperStatusView.
+"""
+import collections
 import logging
+import operator
+import time
 
+from google.appengine.api import datastore, taskqueue
+from google.appengine.datastore.datastore_query import Cursor
 from google.appengine.ext import ndb, deferred
-from google.appengine.runtime import DeadlineExceededError
-from google.appengine.api.datastore_errors import TransactionFailedError
 
-# Number of entities fetched in a deferred task
-DEFERRED_BATCH_SIZE = 250
+from appengine_sessions.models import MapperJob, MapperShard
+
+# Number of entities passed to a single `map` call
+BATCH_SIZE = 250
+
+SHARD_COUNT = 8
+
+# Seconds a slice runs before handing over to the next task, tasks get 10
+# minutes and the last batch has to fit in the rest
+SLICE_TIME_BUDGET = 5 * 60
 
 
-class QueryMapper(object):
+class KeyRangeSplitter(object):
     """
-    Iterates over an ndb filtered query. Runs iterations in a deferred task.
+    Split the key space into ranges of about the same size, using the
+    __scatter__ property (set on a random sample of all entities).
 
-    If mapping needs to scale, mapreduce should be used instead. We'll need to
-    make that work with ndb.  Start here:
-    http://code.google.com/p/appengine-mapreduce/wiki/UserGuidePython
+    Shards filter on the key, so the query can't have an inequality filter.
+    """
+    # Samples per shard
+    oversampling = 32
+
+    def split(self, query, model, shard_count):
+        sample = datastore.Query(model._get_kind(), keys_only=True)
+        sample.Order("__scatter__")
+        keys = sorted(
+            ndb.Key.from_old_key(key)
+            for key in sample.Get(shard_count * self.oversampling))
+
+        points = []
+        for i in range(1, shard_count):
+            point = keys[i * len(keys) // shard_count] if keys else None
+            if point is not None and point not in points:
+                points.append(point)
+
+        bounds = [None] + points + [None]
+        return zip(bounds[:-1], bounds[1:])
+
+    def filter(self, query, model, start, end):
+        if start is not None:
+            query = query.filter(model._key >= start)
+        if end is not None:
+            query = query.filter(model._key < end)
 
-    Query and filters are passed into `map` and evaluated in a way that looks
-    strange, but is necessary to keep deferred happy when pickling arguments.
+        return query.order(model._key)
 
-    todo: mock, test.
+
+class PropertyRangeSplitter(object):
     """
+    Split the range of values of a property (datetime or number) into
+    intervals of the same length.
 
-    def __init__(self, model, filters=None, ancestor=None, queue='default', deferred_batch_size=DEFERRED_BATCH_SIZE):
+    For queries with an inequality filter, which has to be on this property.
+    """
 
-        self.model = model
-        self.filters = filters
-        self.ancestor = ancestor
-        self.queue = queue
-        self.cursor = None
-        self.deferred_batch_size = deferred_batch_size
+    def __init__(self, name):
+        self.name = name
 
-        logging.info('Mapper `%s` created' % self.__class__.__name__)
+    def split(self, query, model, shard_count):
+        prop = model._properties[self.name]
+        first = query.order(prop).get()
+        last = query.order(-prop).get()
+        if first is None or shard_count < 2:
+            return [(None, None)]
 
-    def process_key(self, key):
-        """
-        Specialise this no-op.
-        """
-        logging.info('processing key %s' % str(key))
+        low, high = getattr(first, self.name), getattr(last, self.name)
+        step = (high - low) / shard_count
+        if not step:
+            return [(None, None)]
 
-    def transaction(self):
-        # Build up the query in iteration, to keep deferred happy
-        query = self.model.query(ancestor=self.ancestor)
+        points = [low + step * i for i in range(1, shard_count)]
+        bounds = [None] + points + [None]
+        return zip(bounds[:-1], bounds[1:])
 
-        if self.filters:
-            for operator_str, operands in self.filters.iteritems():
-                query = query.filter(getattr(operator, operator_str)(self.model._properties[operands[0]], operands[1]))
+    def filter(self, query, model, start, end):
+        prop = model._properties[self.name]
+        if start is not None:
+            query = query.filter(prop >= start)
+        if end is not None:
+            query = query.filter(prop < end)
 
-        # Attempt to process an entire batch
-        if query.count(self.deferred_batch_size) > 0:
-            keys, cursor, more = query.fetch_page(
-                self.deferred_batch_size, keys_only=True,
-                start_cursor=self.cursor)
+        return query.order(prop)
 
-            for i, key in enumerate(keys):
-                self.process_key(key)
 
-                # Simulate a deadline exceeded
-                # if i == 10: raise DeadlineExceededError()
+class Mapper(object):
+    """
+    Base of sharded mappers.
 
-            # If there are more entities, defer another process
-            if more:
-                self.cursor = cursor
-                deferred.defer(self.map, _queue=self.queue)
+    Specialise `map` (and `reduce` if needed), and set `model` or override
+    `get_query`. Mappers are pickled into every task, keep them small.
+    """
+    model = None
+    keys_only = False
+    batch_size = BATCH_SIZE
+    shard_count = SHARD_COUNT
+    time_budget = SLICE_TIME_BUDGET
+    batches_in_flight = 1
+    queue = 'default'
+
+    def get_query(self):
+        return self.model.query()
+
+    def get_splitter(self):
+        return KeyRangeSplitter()
+
+    def map(self, batch):
+        """
+        Process a list of entities (or keys, with `keys_only`). May return a
+        dict of counters to add up.
+        """
+        raise NotImplementedError()
+
+    def map_async(self, batch):
+        """
+        Future of the counters of `map`, override it with a tasklet to map
+        several batches at once (see `batches_in_flight`).
+        """
+        future = ndb.Future()
+        future.set_result(self.map(batch))
+        return future
 
-        elif self.cursor is None:
-            logging.info('No entities to map over.')
+    def reduce(self, job):
+        """
+        Called once all shards are done, the result is stored in the job.
+        """
+        logging.info('%s processed %d entities, counters: %s' % (
+            job.name, job.processed, job.counters))
 
     def start(self):
         """
-        Don't do anything in a time constrained view. Kick of the first
-        deferred task.
+        Create the job and split it in a deferred task, so nothing is done
+        in a time constrained view.
         """
-        deferred.defer(self.map, _queue=self.queue)
+        job = MapperJob(name=self.__class__.__name__)
+        job.put()
+        deferred.defer(self.split, job.key.id(), _queue=self.queue)
 
-    def map(self):
+        logging.info('Mapper `%s` started as job %s' % (job.name, job.key.id()))
+        return job
 
+    def defer_first_slice(self, shard):
         try:
-            self.transaction()
+            deferred.defer(
+                self.run_slice, shard.key.id(), 0, _queue=self.queue,
+                _name='mapper-%s' % shard.key.id())
+        except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+            # Enqueued already by a previous attempt of this task
+            pass
+
+    def split(self, job_id):
+        job = MapperJob.get_by_id(job_id)
+        if job is None:
+            return
 
-        except (DeadlineExceededError, TransactionFailedError):
-            # We ran out of time, or the transaction failed
-            deferred.defer(self.map, _queue=self.queue)
+        if job.shard_count is None:
+            query = self.get_query()
+            bounds = self.get_splitter().split(query, self.model, self.shard_count)
+
+            shards = [
+                MapperShard(
+                    id=MapperShard.make_id(job_id, number), job=job.key,
+                    number=number, bounds=shard_bounds)
+                for number, shard_bounds in enumerate(bounds)
+            ]
+            job.shard_count = len(shards)
+            ndb.put_multi(shards + [job])
+        else:
+            # Retry, not all shards might have been started
+            shards = ndb.get_multi([
+                ndb.Key(MapperShard, MapperShard.make_id(job_id, number))
+                for number in range(job.shard_count)
+            ])
+
+        for shard in shards:
+            if shard.slice == 0:
+                self.defer_first_slice(shard)
+
+    def run_slice(self, shard_id, slice_number):
+        shard = MapperShard.get_by_id(shard_id)
+        if shard is None or shard.status != MapperJob.RUNNING:
+            return
+
+        if shard.slice != slice_number:
+            # Retry of a slice that handed over to the next one already
+            return
+
+        # Entities of a batch are not needed any more after it, don't let
+        # the context cache grow with every batch
+        context = ndb.get_context()
+        cache_policy = context.get_cache_policy()
+        context.set_cache_policy(False)
+        try:
+            done = self.process(shard)
+        finally:
+            context.set_cache_policy(cache_policy)
+
+        if done:
+            self.finish_shard(shard)
+        else:
+            self.hand_over(shard)
+
+    def hand_over(self, shard):
+        """
+        Checkpoint the shard and enqueue its next slice, both or neither
+        """
+        shard.slice += 1
+
+        def txn():
+            shard.put()
+            deferred.defer(
+                self.run_slice, shard.key.id(), shard.slice,
+                _queue=self.queue, _transactional=True)
+
+        ndb.transaction(txn)
+
+    def process(self, shard):
+        """
+        Map batches of the shard until it's done (returns True) or out of time
+        """
+        query = self.get_splitter().filter(
+            self.get_query(), self.model, *shard.bounds)
+        start = time.time()
+
+        def fetch(cursor):
+            return query.fetch_page_async(
+                self.batch_size, start_cursor=cursor,
+                keys_only=self.keys_only)
+
+        # (future of counters, batch size, cursor after the batch), oldest first
+        in_flight = collections.deque()
+
+        def wait_oldest():
+            future, size, cursor = in_flight.popleft()
+            # Raises if the batch failed, the cursor stays before it then
+            counters = future.get_result()
+            shard.add_batch(size, counters)
+            shard.cursor = cursor and cursor.urlsafe()
+            ndb.get_context().clear_cache()
+
+        future = fetch(shard.cursor and Cursor(urlsafe=shard.cursor))
+        while True:
+            batch, cursor, more = future.get_result()
+            if more:
+                # Fetch the next page while this one is mapped
+                future = fetch(cursor)
+
+            in_flight.append((self.map_async(batch), len(batch), cursor))
+
+            if not more or time.time() - start > self.time_budget:
+                while in_flight:
+                    wait_oldest()
+                return not more
+
+            if len(in_flight) >= self.batches_in_flight:
+                wait_oldest()
+                shard.put()
+
+    def finish_shard(self, shard):
+        def txn():
+            if shard.key.get().status != MapperJob.RUNNING:
+                return
+
+            job = shard.job.get()
+            job.add_shard(shard)
+            if job.shards_done == job.shard_count:
+                job.status = MapperJob.REDUCING
+                deferred.defer(
+                    self.run_reduce, job.key.id(),
+                    _queue=self.queue, _transactional=True)
+
+            shard.status = MapperJob.DONE
+            ndb.put_multi([shard, job])
+
+        ndb.transaction(txn, xg=True)
+
+    def run_reduce(self, job_id):
+        job = MapperJob.get_by_id(job_id)
+        if job is None or job.status != MapperJob.REDUCING:
+            return
+
+        job.result = self.reduce(job)
+        job.status = MapperJob.DONE
+        job.put()
+
+
+class QueryMapper(Mapper):
+    """
+    Mapper over a model with filters given as {operator name: (property
+    name, value)}, e.g. {'lt': ('expire_date', now)}.
+
+    Queries with an inequality filter are split by that property, others by
+    key ranges.
+    """
+    INEQUALITIES = ('lt', 'le', 'gt', 'ge', 'ne')
+
+    def __init__(self, model, filters=None, queue='default', batch_size=BATCH_SIZE, shard_count=SHARD_COUNT):
+        self.model = model
+        self.filters = filters or {}
+        self.queue = queue
+        self.batch_size = batch_size
+        self.shard_count = shard_count
+
+    def get_query(self):
+        query = self.model.query()
+
+        for operator_str, operands in self.filters.iteritems():
+            query = query.filter(getattr(operator, operator_str)(self.model._properties[operands[0]], operands[1]))
+
+        return query
+
+    def get_splitter(self):
+        for operator_str, operands in self.filters.iteritems():
+            if operator_str in self.INEQUALITIES:
+                return PropertyRangeSplitter(operands[0])
+
+        return KeyRangeSplitter()
 
 
 class DeleteMapper(QueryMapper):
     """
-    Delete all entities mapped.
+    Delete all entities mapped, with delete_multi_async of keys-only batches,
+    `batches_in_flight` of them at once.
     """
+    keys_only = True
+    batches_in_flight = 4
+
+    @ndb.tasklet
+    def map_async(self, keys):
+        # Fails if any of the deletes failed
+        yield ndb.delete_multi_async(keys)
+        raise ndb.Return({'deleted': len(keys)})
+
+    def map(self, keys):
+        return self.map_async(keys).get_result()
 
-    def process_key(self, key):
-        # Deleting key
-        logging.info('DeleteMapper deleted %s' % str(key))
-        key.delete()
+    def reduce(self, job):
+        elapsed = (job.updated_at - job.created_at).total_seconds()
+        logging.info('%s deleted %d entities in %.1fs (%.1f/s)' % (
+            job.name, job.processed, elapsed,
+            job.processed / elapsed if elapsed else 0))
@@ -3,7 +3,8 @@ from google.appengine.ext import ndb
 
 class Session(ndb.Model):
     session_key = ndb.StringProperty()
-    session_data = ndb.TextProperty()
+    # Encoded by appengine_sessions.backends.codec
+    session_data = ndb.BlobProperty()
     expire_date = ndb.DateTimeProperty()
 
 # The code below is causing a circular import error when running in appengine
@@ -13,5 +14,66 @@ class Session(ndb.Model):
 #    def get_decoded(self):
 #        return SessionStore().decode(self.session_data)
 
+
+def merge_counters(counters, other):
+    merged = dict(counters or {})
+    for name, value in (other or {}).iteritems():
+        merged[name] = merged.get(name, 0) + value
+    return merged
+
+
+class MapperJob(ndb.Model):
+    """
+    Status of a job run by appengine_sessions.mapper.Mapper
+    """
+    RUNNING = "running"
+    REDUCING = "reducing"
+    DONE = "done"
+
+    name = ndb.StringProperty()
+    status = ndb.StringProperty(default=RUNNING)
+    # None until the key space is split
+    shard_count = ndb.IntegerProperty(indexed=False)
+    shards_done = ndb.IntegerProperty(default=0, indexed=False)
+    processed = ndb.IntegerProperty(default=0, indexed=False)
+    counters = ndb.JsonProperty()
+    result = ndb.JsonProperty()
+    created_at = ndb.DateTimeProperty(auto_now_add=True)
+    updated_at = ndb.DateTimeProperty(auto_now=True, indexed=False)
+
+    def add_shard(self, shard):
+        self.shards_done += 1
+        self.processed += shard.processed
+        self.counters = merge_counters(self.counters, shard.counters)
+
+
+class MapperShard(ndb.Model):
+    """
+    Progress of one shard of a MapperJob, keyed by "<job id>-<shard number>".
+
+    Not a child of the job, so shards checkpointing at the same time never
+    contend for one entity group.
+    """
+    job = ndb.KeyProperty(kind=MapperJob)
+    number = ndb.IntegerProperty(indexed=False)
+    # (start, end) of the part of the key space processed by the shard
+    bounds = ndb.PickleProperty()
+    status = ndb.StringProperty(default=MapperJob.RUNNING, indexed=False)
+    # Number of the task (slice) allowed to process the shard
+    slice = ndb.IntegerProperty(default=0, indexed=False)
+    cursor = ndb.StringProperty(indexed=False)
+    processed = ndb.IntegerProperty(default=0, indexed=False)
+    counters = ndb.JsonProperty()
+    updated_at = ndb.DateTimeProperty(auto_now=True, indexed=False)
+
+    @classmethod
+    def make_id(cls, job_id, number):
+        return "%s-%d" % (job_id, number)
+
+    def add_batch(self, size, counters):
+        self.processed += size
+        self.counters = merge_counters(self.counters, counters)
+
+
 # At the bottom to win against circular imports
 #from appengine_sessions.backends.db import SessionStore
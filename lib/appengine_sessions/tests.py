@@ -1,16 +1,25 @@
+import json
+import time
+
 from appengine_sessions.backends import cached_db
+from appengine_sessions.backends.codec import BinaryCodec
+from appengine_sessions.lru import LRUCache
 from appengine_sessions.backends.cached_db import SessionStore as CacheDBSession
 from appengine_sessions.backends.db import SessionStore as DatabaseSession
 from appengine_sessions.mapper import DeleteMapper
 from appengine_sessions.middleware import SessionMiddleware
-from appengine_sessions.models import Session
+from appengine_sessions.models import MapperJob, MapperShard, Session
 from datetime import datetime, timedelta
 from django.conf import settings
+from django.contrib.sessions.backends.base import CreateError, SessionBase
 from django.core.cache import cache
 from django.http import HttpResponse
 from django.test.client import Client
 from django.test.utils import override_settings
+from google.appengine.datastore import datastore_stub_util
 from google.appengine.ext import testbed, ndb
+from lib import rpcstats
+from ndbtestcase import run_deferred_tasks
 from unittest import TestCase
 
 # Use normal unittest.TestCase as Django TestCase requires a Database
@@ -33,6 +42,7 @@ class SessionTestsMixin(object):
         self.session = self.backend()
         for s in Session.query().fetch():
             s.delete()
+        cached_db.local_cache.clear()
 
         # Make sure the default Use Timezone setting is False
         settings.USE_TZ = False
@@ -262,6 +272,92 @@ class SessionTestsMixin(object):
         self.assertEqual(self.session.decode(encoded), data)
 
 
+class LRUCacheTests(TestCase):
+
+    def setUp(self):
+        self.cache = LRUCache(2)
+
+    def test_least_recently_used_evicted(self):
+        self.cache.set('a', 1, 'v')
+        self.cache.set('b', 2, 'v')
+        self.cache.get('a', 'v')
+        self.cache.set('c', 3, 'v')
+
+        self.assertEqual(self.cache.get('a', 'v'), 1)
+        self.assertEqual(self.cache.get('b', 'v'), None)
+        self.assertEqual(self.cache.get('c', 'v'), 3)
+
+    def test_served_at_current_version_only(self):
+        self.cache.set('a', 1, 'v1')
+
+        self.assertEqual(self.cache.get('a', 'v1'), 1)
+        self.assertEqual(self.cache.get('a', 'v2'), None)
+        self.assertEqual(self.cache.get('a', 'v1'), None)
+
+    def test_unknown_version_not_served(self):
+        self.cache.set('a', 1, 'v1')
+
+        self.assertEqual(self.cache.get('a', None), None)
+        self.assertEqual(self.cache.stats()['stale'], 1)
+
+    def test_contains(self):
+        self.cache.set('a', 1, 'v1')
+
+        self.assertIn('a', self.cache)
+        self.assertNotIn('b', self.cache)
+        self.assertEqual(self.cache.stats()['hits'], 0)
+
+    def test_stats(self):
+        self.cache.set('a', 1, 'v1')
+        self.cache.get('a', 'v1')
+        self.cache.get('b', 'v1')
+
+        stats = self.cache.stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['size'], 1)
+        self.assertEqual(stats['hit_rate'], 0.5)
+
+
+class BinaryCodecTests(TestCase):
+
+    def setUp(self):
+        self.codec = BinaryCodec()
+
+    def test_round_trip(self):
+        data = {'a': 1, 'b': [u'\u0105', datetime(2013, 1, 1)]}
+        encoded = self.codec.encode(data)
+
+        self.assertTrue(encoded.startswith(BinaryCodec.VERSION))
+        self.assertEqual(self.codec.decode(encoded), data)
+
+    def test_compressed_above_threshold(self):
+        small = self.codec.encode({'a': 'x'})
+        large = self.codec.encode({'a': 'x' * 10000})
+
+        self.assertFalse(ord(small[1]) & BinaryCodec.FLAG_ZLIB)
+        self.assertTrue(ord(large[1]) & BinaryCodec.FLAG_ZLIB)
+        self.assertTrue(len(large) < 1000)
+        self.assertEqual(self.codec.decode(large), {'a': 'x' * 10000})
+
+    def test_tampered_data(self):
+        encoded = self.codec.encode({'user': 1})
+        tampered = encoded[:-1] + chr(ord(encoded[-1]) ^ 1)
+
+        self.assertEqual(self.codec.decode(tampered), {})
+        self.assertEqual(self.codec.decode(encoded[:10]), {})
+
+    def test_django_encoded_data(self):
+        """
+        Test sessions stored in Django's format still decode
+        """
+        encoded = SessionBase().encode({'x': 1})
+
+        self.assertFalse(self.codec.can_decode(encoded))
+        self.assertEqual(DatabaseSession().decode(encoded), {'x': 1})
+        self.assertEqual(DatabaseSession().decode(unicode(encoded)), {'x': 1})
+
+
 class DatabaseSessionTests(SessionTestsMixin, TestCase):
 
     backend = DatabaseSession
@@ -337,6 +433,55 @@ class DatabaseSessionTests(SessionTestsMixin, TestCase):
         self.assertEquals(ndb_s.session_key, self.session.session_key)
         self.assertEquals(DatabaseSession().decode(ndb_s.session_data), {'z': 1})
 
+    def test_load_django_encoded_session(self):
+        """
+        Test a session stored in Django's format loads
+        """
+        Session(
+            id='legacy', session_key='legacy',
+            session_data=SessionBase().encode({'x': 1}),
+            expire_date=datetime.utcnow() + timedelta(seconds=60),
+        ).put()
+
+        self.assertEqual(self.backend('legacy')['x'], 1)
+        self.backend().delete('legacy')
+
+    def test_create_existing_session(self):
+        """
+        Test creating a session with a key already in use fails
+        """
+        self.session.save()
+
+        session = self.backend(self.session.session_key)
+        self.assertRaises(CreateError, session.save, must_create=True)
+
+    def test_save_new_session_creates_it(self):
+        """
+        Test saving a session without a key creates it under a new key
+        """
+        self.session['x'] = 1
+        self.session.save()
+
+        self.assertTrue(self.session.exists(self.session.session_key))
+        self.assertEquals(self.backend(self.session.session_key)['x'], 1)
+
+    def test_exists_strongly_consistent(self):
+        """
+        Test a session is seen as existing right after it was created, even
+        when queries don't see it yet
+        """
+        self.testbed.deactivate()
+        self.testbed.activate()
+        self.testbed.init_datastore_v3_stub(
+            consistency_policy=datastore_stub_util.PseudoRandomHRConsistencyPolicy(probability=0))
+        self.testbed.init_memcache_stub()
+
+        self.session['x'] = 1
+        self.session.save()
+        ndb.get_context().clear_cache()
+
+        self.assertTrue(self.session.exists(self.session.session_key))
+
     def test_session_expiry_date(self):
         """
         Test the expiry date is set correct
@@ -402,7 +547,7 @@ class CacheDBSessionTests(SessionTestsMixin, TestCase):
         self.assertEquals(self.session.cache_key, '%s%s' % (cached_db.KEY_PREFIX, self.session.session_key))
 
         # Test the session is the same in memcahce
-        self.assertEquals(cache.get(self.session.cache_key), s)
+        self.assertEquals(cache.get(self.session.cache_key)["data"], s)
 
         # Session data is empty
         self.assertEquals(s, {})
@@ -422,7 +567,180 @@ class CacheDBSessionTests(SessionTestsMixin, TestCase):
         self.assertEquals(self.session.cache_key, '%s%s' % (cached_db.KEY_PREFIX, self.session.session_key))
 
         # Test the session is the same in memcache
-        self.assertEquals(cache.get(self.session.cache_key), {'z': 1})
+        self.assertEquals(cache.get(self.session.cache_key)["data"], {'z': 1})
+
+    def test_create_guarded_by_cache(self):
+        """
+        Test a key taken in the cache can't be used for a new session
+        """
+        session = self.backend('taken')
+        cache.set(cached_db.KEY_PREFIX + 'taken', {})
+
+        self.assertRaises(CreateError, session.save, must_create=True)
+        self.assertIsNone(session.get_ndb_session_key().get())
+        cache.delete(cached_db.KEY_PREFIX + 'taken')
+
+    def test_exists_in_cache(self):
+        """
+        Test exists doesn't need the datastore for cached sessions
+        """
+        self.session.save()
+        self.session.get_ndb_session_key().delete()
+
+        self.assertTrue(self.session.exists(self.session.session_key))
+
+    def test_load_from_local_cache(self):
+        """
+        Test a session used recently on this instance is loaded with just
+        its version from memcache
+        """
+        self.session['z'] = 1
+        self.session.save()
+        cache.delete(self.session.cache_key)
+
+        self.assertEquals(self.backend(self.session.session_key)['z'], 1)
+        self.assertEquals(cached_db.local_cache.stats()['hits'], 1)
+
+    def test_local_cache_hit_single_memcache_call(self):
+        """
+        Test a session in the local cache is loaded with a single memcache get
+        """
+        self.session['z'] = 1
+        self.session.save()
+
+        with rpcstats.recording() as stats:
+            self.assertEquals(self.backend(self.session.session_key)['z'], 1)
+
+        self.assertEquals(stats.by_service(), {'memcache': 1})
+
+    def test_local_cache_miss_single_memcache_call(self):
+        """
+        Test a session missing from the local cache is loaded from memcache
+        with a single call
+        """
+        self.session['z'] = 1
+        self.session.save()
+        cached_db.local_cache.clear()
+
+        with rpcstats.recording() as stats:
+            self.assertEquals(self.backend(self.session.session_key)['z'], 1)
+
+        self.assertEquals(stats.by_service(), {'memcache': 1})
+
+    def test_local_cache_validated(self):
+        """
+        Test a session changed on another instance is not served from the local cache
+        """
+        self.session['z'] = 1
+        self.session.save()
+
+        session = self.backend(self.session.session_key)
+        self.assertEquals(session['z'], 1)
+
+        # Another instance saves the session
+        cached_db.local_cache.clear()
+        other = self.backend(self.session.session_key)
+        other['z'] = 2
+        other.save()
+        cached_db.local_cache.set(
+            self.session.session_key, ({'z': 1}, other._stored_expire_date), 'old version')
+
+        self.assertEquals(self.backend(self.session.session_key)['z'], 2)
+        self.assertEquals(cached_db.local_cache.stats()['stale'], 1)
+
+    def test_local_cache_not_used_after_logout(self):
+        """
+        Test a session flushed on another instance is not served from the local cache
+        """
+        self.session['z'] = 1
+        self.session.save()
+        session_key = self.session.session_key
+        local_entry = cached_db.local_cache.entries[session_key]
+
+        # Another instance logs the user out
+        other = self.backend(session_key)
+        other.flush()
+        cached_db.local_cache.entries[session_key] = local_entry
+
+        self.assertNotIn('z', self.backend(session_key))
+
+    def test_unchanged_session_not_written(self):
+        """
+        Test saving a session without changes does not write the datastore
+        """
+        self.session['z'] = 1
+        self.session.save()
+
+        session = self.backend(self.session.session_key)
+        session['z'] = 1
+        self.session.get_ndb_session_key().delete()
+        session.save()
+
+        self.assertIsNone(self.session.get_ndb_session_key().get())
+
+    def test_changed_session_written(self):
+        """
+        Test saving changed data of a loaded session writes the datastore
+        """
+        self.session['z'] = 1
+        self.session.save()
+
+        session = self.backend(self.session.session_key)
+        session['z'] = 2
+        session.save()
+
+        ndb_s = self.session.get_ndb_session_key().get()
+        self.assertEquals(CacheDBSession().decode(ndb_s.session_data), {'z': 2})
+
+    def test_changed_nested_data_written(self):
+        """
+        Test changes inside mutable values are detected
+        """
+        self.session['z'] = [1]
+        self.session.save()
+
+        session = self.backend(self.session.session_key)
+        session['z'].append(2)
+        session.save()
+
+        ndb_s = self.session.get_ndb_session_key().get()
+        self.assertEquals(CacheDBSession().decode(ndb_s.session_data), {'z': [1, 2]})
+
+    def test_expiry_refresh_throttled(self):
+        """
+        Test the expiry date is written only after it moved far enough
+        """
+        self.session['z'] = 1
+        self.session.save()
+        stored_expire_date = self.session.get_ndb_session_key().get().expire_date
+
+        session = self.backend(self.session.session_key)
+        session.load()
+        session.save()
+
+        ndb_s = self.session.get_ndb_session_key().get()
+        self.assertEquals(ndb_s.expire_date, stored_expire_date)
+
+        # As if the session was saved a while ago
+        session._stored_expire_date -= cached_db.expiry_refresh_interval()
+        session.save()
+
+        ndb_s = self.session.get_ndb_session_key().get()
+        self.assertTrue(ndb_s.expire_date > stored_expire_date)
+
+    @override_settings(SESSION_EXPIRY_REFRESH_FRACTION=0)
+    def test_expiry_refresh_every_save(self):
+        self.session['z'] = 1
+        self.session.save()
+        stored_expire_date = self.session.get_ndb_session_key().get().expire_date
+
+        session = self.backend(self.session.session_key)
+        session.load()
+        session.save()
+
+        ndb_s = self.session.get_ndb_session_key().get()
+        self.assertTrue(ndb_s.expire_date >= stored_expire_date)
+        self.assertEquals(session._stored_expire_date, ndb_s.expire_date)
 
 
 class CacheDBSessionWithTimeZoneTests(CacheDBSessionTests):
@@ -469,6 +787,25 @@ class SessionMiddlewareTests(TestCase):
         self.assertTrue(response.cookies[settings.SESSION_COOKIE_NAME]['secure'])
 
 
+class SlowDeleteMapper(DeleteMapper):
+    """
+    Takes longer than its time budget to delete a batch
+    """
+    time_budget = 0.05
+
+    def map_async(self, keys):
+        time.sleep(0.06)
+        return super(SlowDeleteMapper, self).map_async(keys)
+
+
+class FailingDeleteMapper(DeleteMapper):
+
+    def map_async(self, keys):
+        future = ndb.Future()
+        future.set_exception(ValueError('Delete failed'))
+        return future
+
+
 class SessionCleanUpTest(TestCase):
     def setUp(self):
         self.testbed = testbed.Testbed()
@@ -476,56 +813,103 @@ class SessionCleanUpTest(TestCase):
         self.testbed.init_datastore_v3_stub()
         self.testbed.init_memcache_stub()
         self.testbed.init_taskqueue_stub(enable=True)
+        self.taskqueue = self.testbed.get_stub(testbed.TASKQUEUE_SERVICE_NAME)
 
     def tearDown(self):
         self.testbed.deactivate()
 
+    def make_sessions(self, count, expired=True):
+        now = datetime.utcnow()
+        for i in range(0, count):
+            if expired:
+                expire_date = now - timedelta(hours=i)
+            else:
+                expire_date = now + timedelta(hours=i + 1)
+            Session(session_key='%s-%s' % (expired, i), expire_date=expire_date).put()
+
     def test_mapper(self):
         """
-        Test a session gets deleted and another
-        one has been put on as a task to be deleted
+        Test only the expired sessions get deleted, by all shards together
         """
-        for i in range(0, 2):
-            s = Session(session_key='%s' % i, expire_date=datetime.utcnow())
-            s.put()
+        self.make_sessions(10)
+        self.make_sessions(2, expired=False)
 
-        mapper = DeleteMapper(Session, filters={'lt': ('expire_date', datetime.utcnow())}, deferred_batch_size=1)
-        mapper.transaction()
+        mapper = DeleteMapper(Session, filters={'lt': ('expire_date', datetime.utcnow())}, batch_size=2, shard_count=4)
+        job = mapper.start()
+        run_deferred_tasks(self.taskqueue, mapper.queue)
 
-        taskqueue = self.testbed.get_stub(testbed.TASKQUEUE_SERVICE_NAME)
+        self.assertEquals(Session.query().count(), 2)
 
-        # One expired session left
-        self.assertEquals(Session.query().count(), 1)
+        job = job.key.get()
+        self.assertEquals(job.status, MapperJob.DONE)
+        self.assertEquals(job.shard_count, 4)
+        self.assertEquals(job.shards_done, 4)
+        self.assertEquals(job.processed, 10)
+        self.assertEquals(job.counters, {'deleted': 10})
 
-        tasks = taskqueue.GetTasks(mapper.queue)
+    def test_mapper_without_filters(self):
+        self.make_sessions(5)
 
-        # Another deferred task in the queue to remove the next expired session
-        self.assertEquals(len(tasks), 1)
+        mapper = DeleteMapper(Session, batch_size=2, shard_count=2)
+        job = mapper.start()
+        run_deferred_tasks(self.taskqueue, mapper.queue)
 
-    def test_mapper_session_data(self):
+        self.assertEquals(Session.query().count(), 0)
+        self.assertEquals(job.key.get().status, MapperJob.DONE)
+
+    def test_mapper_nothing_to_map(self):
+        mapper = DeleteMapper(Session, filters={'lt': ('expire_date', datetime.utcnow())})
+        job = mapper.start()
+        run_deferred_tasks(self.taskqueue, mapper.queue)
+
+        job = job.key.get()
+        self.assertEquals(job.status, MapperJob.DONE)
+        self.assertEquals(job.shard_count, 1)
+        self.assertEquals(job.processed, 0)
+
+    def test_mapper_out_of_time(self):
         """
-        Test the mapper only deletes the expired session and
-        doesn't create a new task on queue
+        Test a shard out of time checkpoints after a batch and
+        carries on in another task
         """
+        self.make_sessions(3)
+
+        mapper = SlowDeleteMapper(Session, filters={'lt': ('expire_date', datetime.utcnow())}, batch_size=1, shard_count=1)
+        job = mapper.start()
 
-        s1 = Session(session_key='1', expire_date=datetime.utcnow() + timedelta(seconds=3600))
-        s1.put()
-        s2 = Session(session_key='2', expire_date=datetime.utcnow())
-        s2.put()
+        # Split, then the first slice
+        run_deferred_tasks(self.taskqueue, mapper.queue, once=True)
+        run_deferred_tasks(self.taskqueue, mapper.queue, once=True)
 
-        mapper = DeleteMapper(Session, filters={'lt': ('expire_date', datetime.utcnow())}, deferred_batch_size=1)
-        mapper.transaction()
-        taskqueue = self.testbed.get_stub(testbed.TASKQUEUE_SERVICE_NAME)
+        shard = MapperShard.get_by_id(MapperShard.make_id(job.key.id(), 0))
+        self.assertEquals(shard.slice, 1)
+        self.assertEquals(shard.processed, 1)
+        self.assertEquals(Session.query().count(), 2)
 
-        tasks = taskqueue.GetTasks(mapper.queue)
+        # A retry of the first slice does nothing
+        mapper.run_slice(shard.key.id(), 0)
+        self.assertEquals(Session.query().count(), 2)
 
-        # Should be no task in the queue as
-        # no more sessions to delete.
-        self.assertEquals(len(tasks), 0)
+        run_deferred_tasks(self.taskqueue, mapper.queue)
+        self.assertEquals(Session.query().count(), 0)
+        self.assertEquals(job.key.get().processed, 3)
+
+    def test_mapper_failed_batch_not_checkpointed(self):
+        """
+        Test the cursor doesn't move past a batch whose deletes failed
+        """
+        self.make_sessions(3)
+
+        mapper = FailingDeleteMapper(Session, batch_size=1, shard_count=1)
+        job = mapper.start()
+        run_deferred_tasks(self.taskqueue, mapper.queue, once=True)
 
-        # Should be 1 valid session left
-        self.assertEquals(Session.query().count(), 1)
-        self.assertEquals(Session.query().get().session_key, '1')
+        shard_id = MapperShard.make_id(job.key.id(), 0)
+        self.assertRaises(ValueError, mapper.run_slice, shard_id, 0)
+
+        shard = MapperShard.get_by_id(shard_id)
+        self.assertEquals(shard.processed, 0)
+        self.assertEquals(shard.cursor, None)
 
     def test_view(self):
         """
@@ -536,28 +920,27 @@ class SessionCleanUpTest(TestCase):
         c = Client()
         response = c.get('/appengine_sessions/clean-up/')
 
-        taskqueue = self.testbed.get_stub(testbed.TASKQUEUE_SERVICE_NAME)
         self.assertEquals(response.status_code, 200)
-        self.assertEquals(len(taskqueue.GetTasks('default')), 1)
+        self.assertEquals(len(self.taskqueue.GetTasks('default')), 1)
 
-    def test_mapper_batch_size(self):
-        """
-        Test the amount of sessions gets deleted is
-        the same as the deferred_batch_size
-        """
-        for i in range(0, 20):
-            s = Session(session_key='%s' % i, expire_date=datetime.utcnow())
-            s.put()
+    def test_status_view(self):
+        self.make_sessions(3)
+        mapper = DeleteMapper(Session, filters={'lt': ('expire_date', datetime.utcnow())}, shard_count=2)
+        job = mapper.start()
+        run_deferred_tasks(self.taskqueue, mapper.queue)
 
-        mapper = DeleteMapper(Session, filters={'lt': ('expire_date', datetime.utcnow())}, deferred_batch_size=10)
-        mapper.transaction()
+        c = Client()
+        jobs = json.loads(c.get('/appengine_sessions/mappers/').content)
 
-        self.testbed.get_stub(testbed.TASKQUEUE_SERVICE_NAME)
+        self.assertEquals(len(jobs), 1)
+        self.assertEquals(jobs[0]['id'], job.key.id())
+        self.assertEquals(jobs[0]['status'], MapperJob.DONE)
 
-        # Should be 10 left
-        self.assertEquals(Session.query().count(), 10)
+        status = json.loads(c.get('/appengine_sessions/mappers/%s/' % job.key.id()).content)
+        self.assertEquals(len(status['shards']), 2)
+        self.assertEquals(sum(shard['processed'] for shard in status['shards']), 3)
 
-        mapper.transaction()
+    def test_status_view_missing_job(self):
+        response = Client().get('/appengine_sessions/mappers/1/')
 
-        # Should be 0 session left
-        self.assertEquals(Session.query().count(), 0)
+        self.assertEquals(response.status_code, 404)
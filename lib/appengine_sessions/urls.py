@@ -3,4 +3,6 @@ from appengine_sessions import views
 
 urlpatterns = patterns('',
     url(r'^clean-up/$', views.session_clean_up, name='session-clean-up'),
+    url(r'^mappers/$', views.mapper_status, name='mapper-status'),
+    url(r'^mappers/(?P<job_id>\d+)/$', views.mapper_status, name='mapper-job-status'),
 )
@@ -1,10 +1,13 @@
+import json
+
 from appengine_sessions.backends.db import SessionStore
 from appengine_sessions.mapper import DeleteMapper
-from appengine_sessions.models import Session
+from appengine_sessions.models import MapperJob, MapperShard, Session
 from datetime import datetime
 from django.contrib.sessions.backends.base import SessionBase
-from django.http import HttpResponse
+from django.http import Http404, HttpResponse
 from django.views.generic.base import View
+from google.appengine.ext import ndb
 
 
 class SessionCleanUpCron(View):
@@ -22,3 +25,49 @@ class SessionCleanUpCron(View):
         return HttpResponse('Session cleaner mapper started')
 
 session_clean_up = SessionCleanUpCron.as_view()
+
+
+class MapperStatusView(View):
+    """
+    JSON status of recent mapper jobs, or of a single job with its shards
+    """
+    recent_jobs = 20
+
+    def job_status(self, job):
+        status = job.to_dict(exclude=['created_at', 'updated_at'])
+        status.update({
+            'id': job.key.id(),
+            'created_at': job.created_at.isoformat(),
+            'updated_at': job.updated_at.isoformat(),
+        })
+        return status
+
+    def shard_status(self, shard):
+        return {
+            'number': shard.number,
+            'status': shard.status,
+            'slice': shard.slice,
+            'processed': shard.processed,
+            'counters': shard.counters,
+            'updated_at': shard.updated_at.isoformat(),
+        }
+
+    def get(self, request, job_id=None, *args, **kwargs):
+        if job_id is None:
+            jobs = MapperJob.query().order(-MapperJob.created_at).fetch(self.recent_jobs)
+            status = [self.job_status(job) for job in jobs]
+        else:
+            job = MapperJob.get_by_id(int(job_id))
+            if job is None:
+                raise Http404()
+
+            shards = ndb.get_multi([
+                ndb.Key(MapperShard, MapperShard.make_id(job.key.id(), number))
+                for number in range(job.shard_count or 0)
+            ])
+            status = self.job_status(job)
+            status['shards'] = [self.shard_status(shard) for shard in shards if shard]
+
+        return HttpResponse(json.dumps(status, indent=2), content_type='application/json')
+
+mapper_status = MapperStatusView.as_view()
@@ -0,0 +1,146 @@
+"""
+Process wide cache of compiled templates.
+
+Works like django.template.loaders.cached.Loader, and additionally:
+
+- static includes (`{% include "name.html" %}` without `with`/`only`) are
+  flattened into the including template when it is loaded, so rendering
+  an include inside a loop costs nothing extra
+- with TEMPLATE_DEBUG on, templates are reloaded when their file (or file
+  of any template flattened into them) changes
+"""
+import hashlib
+import os
+
+from django.conf import settings
+from django.template.base import TemplateDoesNotExist
+from django.template.defaulttags import IfNode
+from django.template.loader import get_template_from_string
+from django.template.loader_tags import (
+    BlockNode, ConstantIncludeNode, ExtendsNode
+)
+from django.template.loaders import cached
+
+
+def child_nodelists(node):
+    # IfNode builds its `nodelist` on the fly, the real ones are in conditions
+    if isinstance(node, IfNode):
+        return [nodelist for condition, nodelist in node.conditions_nodelists]
+
+    nodelists = [getattr(node, attr, None) for attr in node.child_nodelists]
+    return [nodelist for nodelist in nodelists if nodelist]
+
+
+def can_flatten(node):
+    return (
+        node.template is not None and
+        not node.extra_context and
+        not node.isolated_context and
+        not node.template.nodelist.get_nodes_by_type((ExtendsNode, BlockNode))
+    )
+
+
+def flatten_includes(nodelist):
+    """
+    Replace (in place) static includes with nodes of included templates.
+
+    Returns all templates included by the nodelist.
+    """
+    included = []
+    nodes = []
+
+    for node in nodelist:
+        if isinstance(node, ConstantIncludeNode):
+            if node.template is not None:
+                included.append(node.template)
+
+            if can_flatten(node):
+                nodes.extend(node.template.nodelist)
+                continue
+
+        for child in child_nodelists(node):
+            included.extend(flatten_includes(child))
+
+        nodes.append(node)
+
+    nodelist[:] = nodes
+    return included
+
+
+class Loader(cached.Loader):
+
+    def __init__(self, loaders):
+        super(Loader, self).__init__(loaders)
+        # Modification times of files each cached template was built from
+        self.template_sources = {}
+
+    def cache_key(self, template_name, template_dirs=None):
+        if template_dirs:
+            dirs_hash = hashlib.sha1('|'.join(template_dirs)).hexdigest()
+            return '-'.join([template_name, dirs_hash])
+
+        return template_name
+
+    def find_template_path(self, template_name, template_dirs=None):
+        for loader in self.loaders:
+            get_sources = getattr(loader, "get_template_sources", None)
+            if get_sources is None:
+                continue
+
+            for path in get_sources(template_name, template_dirs):
+                if os.path.exists(path):
+                    return path
+
+    def get_sources(self, template_name, template_dirs, included):
+        sources = {}
+
+        path = self.find_template_path(template_name, template_dirs)
+        if path:
+            sources[path] = os.path.getmtime(path)
+
+        for template in included:
+            if template.name in self.template_sources:
+                sources.update(self.template_sources[template.name])
+            else:
+                sources.update(self.get_sources(template.name, None, []))
+
+        return sources
+
+    def is_stale(self, key):
+        for path, mtime in self.template_sources.get(key, {}).iteritems():
+            if not os.path.exists(path) or os.path.getmtime(path) != mtime:
+                return True
+
+        return False
+
+    def load_template(self, template_name, template_dirs=None):
+        key = self.cache_key(template_name, template_dirs)
+
+        if settings.TEMPLATE_DEBUG and self.is_stale(key):
+            self.template_cache.pop(key, None)
+
+        if key not in self.template_cache:
+            template, origin = self.find_template(template_name, template_dirs)
+            if not hasattr(template, 'render'):
+                try:
+                    template = get_template_from_string(
+                        template, origin, template_name)
+                except TemplateDoesNotExist:
+                    # Same as the cached loader, let the caller report the
+                    # template that is really missing
+                    return template, origin
+
+            # Flatten before caching, so other threads never see it changing
+            included = flatten_includes(template.nodelist)
+
+            if settings.TEMPLATE_DEBUG:
+                self.template_sources[key] = self.get_sources(
+                    template_name, template_dirs, included)
+
+            self.template_cache[key] = template
+
+        return self.template_cache[key], None
+
+    def reset(self):
+        super(Loader, self).reset()
+        self.template_sources.clear()
@@ -61,3 +61,28 @@ def setup_environ():
                     setup_environ(settings, original_settings_path='settings')
                 except ImportError:
                     logging.error("Could not import django settings")
+
+
+def setup_stubs(datastore_path=DATASTORE_PATH):
+    """
+    Service stubs over the local data of dev_appserver, unless there are
+    stubs already (e.g. testbed's)
+    """
+    from google.appengine.api import apiproxy_stub_map
+    if apiproxy_stub_map.apiproxy.GetStub('datastore_v3'):
+        return
+
+    from google.appengine.tools import dev_appserver_main
+    from google.appengine.tools import old_dev_appserver
+
+    app_id = os.environ['APPLICATION_ID']
+
+    kwargs = dev_appserver_main.DEFAULT_ARGS.copy()
+
+    kwargs.update({
+        'use_sqlite': True,
+        'datastore_path': datastore_path
+        # todo: blobstore, prospective search
+    })
+    old_dev_appserver.SetupStubs(app_id, **kwargs)
+    logging.info('DataStore Path: %s' % datastore_path)
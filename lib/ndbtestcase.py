@@ -1,15 +1,30 @@
+import base64
 import logging
 import unittest
 
 from django.test import TransactionTestCase
 from google.appengine.datastore import datastore_stub_util
-from google.appengine.ext import testbed
+from google.appengine.ext import deferred, testbed
 
 
 logging.basicConfig()
 log = logging.getLogger("ndbtestcase")
 
 
+def run_deferred_tasks(taskqueue_stub, queue="default", once=False):
+    """Run deferred tasks of the queue, until no new ones are added (or just
+    the ones in the queue now, with `once`)"""
+    tasks = taskqueue_stub.GetTasks(queue)
+    while tasks:
+        taskqueue_stub.FlushQueue(queue)
+        for task in tasks:
+            deferred.run(base64.b64decode(task["body"]))
+
+        if once:
+            return
+        tasks = taskqueue_stub.GetTasks(queue)
+
+
 class AppEngineTestCase(TransactionTestCase):
     """Common test setup required for testing App Engine-related things.
 
@@ -68,6 +83,11 @@ class AppEngineTestCase(TransactionTestCase):
         datastore_stub = self.testbed.get_stub(testbed.DATASTORE_SERVICE_NAME)
         datastore_stub.Clear()
 
+    def run_deferred_tasks(self, queue="default"):
+        """Run deferred tasks of the queue, until no new ones are added"""
+        run_deferred_tasks(
+            self.testbed.get_stub(testbed.TASKQUEUE_SERVICE_NAME), queue)
+
     def users_login(self, email, user_id=None, is_admin=False):
         self.testbed.setup_env(
             USER_EMAIL=email,
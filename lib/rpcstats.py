@@ -0,0 +1,171 @@
+"""
+Accounting of API calls (RPCs) made by a thread, through apiproxy hooks.
+
+    import rpcstats
+
+    rpcstats.install()
+    with rpcstats.recording() as stats:
+        ...                # recordings can nest
+    stats.calls        # {("datastore_v3", "Get"): 2, ...}
+    stats.ops          # estimated billable datastore operations
+
+Wall time of an RPC is the time from the call to its completion, so with
+parallel (async) RPCs the sum of times is more than the time spent.
+
+Billable operations are estimated from requests and responses:
+entity reads (gets and entities returned by queries, plus one per query),
+small operations (keys only results, allocated ids) and writes (2 per put
+entity plus 2 per indexed property value, 2 per deleted key). Composite
+indexes aren't known, real writes may cost more.
+"""
+import collections
+import contextlib
+import threading
+import time
+
+from google.appengine.api import apiproxy_stub_map
+
+HOOK_NAME = "rpcstats"
+
+_local = threading.local()
+
+
+class RPCStats(object):
+
+    def __init__(self):
+        self.calls = collections.Counter()
+        self.time = collections.Counter()
+        self.ops = collections.Counter()
+        self.started = {}
+
+    def by_service(self, values=None):
+        totals = collections.Counter()
+        for (service, call), value in (values or self.calls).iteritems():
+            totals[service] += value
+        return totals
+
+    @property
+    def total_calls(self):
+        return sum(self.calls.itervalues())
+
+    @property
+    def total_time(self):
+        return sum(self.time.itervalues())
+
+    def summary(self):
+        """
+        Compact one line summary, e.g.
+        "datastore_v3: 3 calls 12ms, memcache: 2 calls 1ms; reads=3"
+        """
+        times = self.by_service(self.time)
+        services = ", ".join(
+            "{}: {} calls {:.0f}ms".format(service, count, times[service] * 1000)
+            for service, count in sorted(self.by_service().iteritems()))
+        ops = " ".join(
+            "{}={}".format(name, count) for name, count in sorted(self.ops.iteritems()))
+        return "; ".join(part for part in (services or "no calls", ops) if part)
+
+    def start_call(self, service, call, request, response):
+        self.started[id(response)] = time.time()
+
+    def end_call(self, service, call, request, response):
+        start = self.started.pop(id(response), None)
+        self.calls[(service, call)] += 1
+        if start is not None:
+            self.time[(service, call)] += time.time() - start
+
+        if service == "datastore_v3":
+            self.ops.update(estimate_ops(call, request, response))
+
+
+def estimate_ops(call, request, response):
+    ops = collections.Counter()
+    try:
+        if call == "Get":
+            ops["reads"] += request.key_size()
+        elif call in ("RunQuery", "Next"):
+            if call == "RunQuery":
+                ops["reads"] += 1
+            if response.keys_only():
+                ops["small"] += response.result_size()
+            else:
+                ops["reads"] += response.result_size()
+        elif call == "Put":
+            for entity in request.entity_list():
+                ops["writes"] += 2 + 2 * entity.property_size()
+        elif call == "Delete":
+            ops["writes"] += 2 * request.key_size()
+        elif call == "AllocateIds":
+            ops["small"] += 1
+    except AttributeError:
+        # Not the protocol buffer expected, nothing to estimate
+        pass
+
+    return ops
+
+
+def _active():
+    if not hasattr(_local, "active"):
+        _local.active = []
+    return _local.active
+
+
+def current():
+    """
+    Innermost recording of the thread, None if nothing is recorded
+    """
+    active = _active()
+    return active[-1] if active else None
+
+
+def _pre_call(service, call, request, response):
+    for stats in _active():
+        stats.start_call(service, call, request, response)
+
+
+def _post_call(service, call, request, response):
+    for stats in _active():
+        stats.end_call(service, call, request, response)
+
+
+def install():
+    """
+    Add the hooks to the current apiproxy (testbed replaces it, so call
+    this after activating one)
+    """
+    # Hooks added already are not added again
+    apiproxy = apiproxy_stub_map.apiproxy
+    apiproxy.GetPreCallHooks().Append(HOOK_NAME, _pre_call)
+    apiproxy.GetPostCallHooks().Append(HOOK_NAME, _post_call)
+
+
+def start():
+    """
+    Start a recording, recordings nest: calls are counted by all of them
+    """
+    install()
+    stats = RPCStats()
+    _active().append(stats)
+    return stats
+
+
+def stop(stats=None):
+    """
+    Stop the recording (the innermost one if not given) and return it
+    """
+    active = _active()
+    if stats is None:
+        return active.pop() if active else None
+
+    if stats in active:
+        active.remove(stats)
+    return stats
+
+
+@contextlib.contextmanager
+def recording():
+    stats = start()
+    try:
+        yield stats
+    finally:
+        stop(stats)
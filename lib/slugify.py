@@ -6,13 +6,20 @@ import unicodedata
 import re
 
 
+def fold(value):
+    """
+    Converts to lowercase ASCII, dropping accents and other characters that
+    have no ASCII equivalent.
+    """
+    value = unicodedata.normalize('NFKD', value).encode('ascii', 'ignore')
+    return value.decode('ascii').lower()
+
+
 def slugify(value):
     """
     Converts to lowercase, removes non-word characters (alphanumerics and
     underscores) and converts spaces to hyphens. Also strips leading and
     trailing whitespace.
     """
-    value = unicodedata.normalize('NFKD', value).encode('ascii', 'ignore')
-    value = value.decode('ascii')
-    value = re.sub('[^\w\s-]', '', value).strip().lower()
+    value = re.sub('[^\w\s-]', '', fold(value)).strip()
     return re.sub('[-\s]+', '-', value)
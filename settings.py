@@ -36,6 +36,14 @@ django.contrib.sessions.backends.cache?
 
 SESSION_ENGINE = "appengine_sessions.backends.cached_db"
 
+# Part of SESSION_COOKIE_AGE the expiry date of a session has to move by
+# before it is written to the datastore again
+SESSION_EXPIRY_REFRESH_FRACTION = 0.1
+
+# Sessions kept in memory of every instance, used after checking memcache
+# has no newer version
+SESSION_LOCAL_CACHE_SIZE = 1000
+
 TIME_ZONE = 'Europe/London'
 LANGUAGE_CODE = 'en-gb'
 
@@ -95,13 +103,21 @@ STATICFILES_FINDERS = (
 SECRET_KEY = '^(&s11q!@t2j@=dgpp65k+df6o1(@1h9cq-$^p@=k4!5))xi6u'
 
 # List of callables that know how to import templates from various sources.
+# Compiled templates are cached for the life of the instance (see
+# lib/cachedloader.py), in development they are reloaded when files change.
 TEMPLATE_LOADERS = (
-    'django.template.loaders.filesystem.Loader',
-    'django.template.loaders.app_directories.Loader',
+    ('lib.cachedloader.Loader', (
+        'django.template.loaders.filesystem.Loader',
+        'django.template.loaders.app_directories.Loader',
+    )),
 )
 
 MIDDLEWARE_CLASSES = (
+    # First in, last out: counts RPCs of all the other middleware
+    'blog.middleware.RPCAccountingMiddleware',
     'google.appengine.ext.ndb.django_middleware.NdbDjangoMiddleware',
+    # Runs last on the response, after sessions and CSRF had their say
+    'blog.middleware.CachePolicyMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -157,6 +173,27 @@ LOGGING = {
     }
 }
 
+# Number of posts on a single page of the blog
+BLOG_PAGE_SIZE = 10
+
+# How long (in seconds) pages rendered for anonymous users stay in memcache
+PAGE_CACHE_TIMEOUT = 60 * 60
+
+# How long (in seconds) browsers and Google's edge cache may keep public pages
+PUBLIC_CACHE_MAX_AGE = 60
+
+# Number of latest posts in the Atom feed
+BLOG_FEED_SIZE = 20
+
+# Number of posts read from the datastore at once when writing the sitemap
+SITEMAP_BATCH_SIZE = 500
+
+# Number of most read posts listed on the home page
+BLOG_POPULAR_POSTS = 5
+
+# How often (in seconds) views buffered in memcache are written to the datastore
+VIEW_COUNT_FLUSH_INTERVAL = 60
+
 ALLOWED_HOSTS = [
     'blog-karol-duleba.appspot.com'
 ]
@@ -1,7 +1,10 @@
 from django.conf.urls import *
 
+from blog.warmup import WarmupView
+
 urlpatterns = patterns(
     '',
+    (r'^_ah/warmup$', WarmupView.as_view()),
     (r'^appengine_sessions/', include('appengine_sessions.urls')),
     (r'', include('blog.urls')),
 )